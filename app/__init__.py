@@ -1,8 +1,32 @@
 from flask import Flask
 from .routes import init_routes
+from .cli import init_cli
+from .serving import Executors
+from .jobs import JobQueue
+from .monitoring import init_monitoring
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config["SECRET_KEY"] = "секретный_ключ"
+    app.config["DATABASE"] = "data/tables.db"
+    app.config["SHARDS_DIR"] = "data/properties"  # Базы отдельных объектов недвижимости
+    app.config["JOBS_DIR"] = "data/jobs"  # Очередь фоновых задач и их файлы
+    app.config.from_prefixed_env()  # FLASK_WORKER_THREADS=32 и т.п.
+    app.config.update(config or {})
+    app.extensions["executors"] = Executors(app.config)
+    # Исполнители запускаются при первой задаче, при старте ASGI-сервера или, если очередь
+    # осталась с прошлого запуска, при первом запросе. Команды flask запросов не обслуживают
+    # и задачи не забирают.
+    app.extensions["jobs"] = JobQueue(app.config["JOBS_DIR"], app.config)
+    app.before_request(app.extensions["jobs"].resume)
+    init_monitoring(app)
     init_routes(app)
-    return app
\ No newline at end of file
+    init_cli(app)
+    if app.config.get("ANALYSIS_WARM_UP"):
+        app.extensions["executors"].warm_up(app.config["DATABASE"])
+    return app
+
+def create_asgi_app(config=None):
+    """Приложение для ASGI-сервера (uvicorn, hypercorn) с плавной остановкой"""
+    from .asgi import AsgiAdapter
+    return AsgiAdapter(create_app(config))
@@ -0,0 +1,127 @@
+# Материализованные агрегаты по операциям. Обновляются в той же транзакции,
+# что и запись операций, поэтому баланс и итоги по категориям читаются
+# за O(число категорий), а не O(число операций). Суммы хранятся в копейках,
+# поэтому сверка с operations точная. Итоги по времени считаются по снимку
+# операций в памяти (snapshot.py), поэтому итогов по дням и месяцам здесь нет.
+
+CREATE_STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS agg_balance (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        income INTEGER NOT NULL DEFAULT 0,
+        expense INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS agg_category_totals (
+        category_id INTEGER NOT NULL,
+        operation_type TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (category_id, operation_type)
+    ) WITHOUT ROWID
+    """,
+)
+
+def create_tables(conn):
+    """Создание таблиц агрегатов; при первом создании они заполняются по operations"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agg_balance'"
+    ).fetchone()
+    for statement in CREATE_STATEMENTS:
+        conn.execute(statement)
+    if not exists:
+        rebuild(conn)
+
+
+def apply_operations(conn, rows, sign=1):
+    """Учёт добавленных (sign=1) или удалённых (sign=-1) операций в агрегатах.
+
+    rows — строки (копейки, category_id, секунды, operation_type, ...).
+    """
+    totals = {}
+    balance = {"доход": 0, "расход": 0}
+    for row in rows:
+        amount, category_id, operation_type = row[0] * sign, row[1], row[3]
+        item = totals.setdefault((category_id, operation_type), [0, 0])
+        item[0] += amount
+        item[1] += sign
+        if operation_type in balance:
+            balance[operation_type] += amount
+    conn.executemany("""
+        INSERT INTO agg_category_totals (category_id, operation_type, total, count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (category_id, operation_type) DO UPDATE
+        SET total = total + excluded.total, count = count + excluded.count
+    """, [(category_id, operation_type, total, count)
+          for (category_id, operation_type), (total, count) in totals.items()])
+    if sign < 0:
+        conn.execute("DELETE FROM agg_category_totals WHERE count <= 0")
+    conn.execute("""
+        UPDATE agg_balance SET income = income + ?, expense = expense + ?
+        WHERE id = 1
+    """, (balance["доход"], balance["расход"]))
+
+
+def expected_totals(conn, source="operations", totals=None):
+    """Итоги по категориям для операций source: {(category_id, тип): [сумма, число]}.
+
+    Итоги добавляются к totals, поэтому их можно накапливать по нескольким
+    базам (рабочей таблице и архивам закрытых лет).
+    """
+    totals = totals if totals is not None else {}
+    for category_id, operation_type, total, count in conn.execute(f"""
+        SELECT category_id, operation_type, SUM(amount), COUNT(*)
+        FROM {source}
+        GROUP BY 1, 2
+    """):
+        item = totals.setdefault((category_id, operation_type), [0, 0])
+        item[0] += total
+        item[1] += count
+    return totals
+
+
+def _balance(totals):
+    """Доходы и расходы по итогам категорий"""
+    balance = {"доход": 0, "расход": 0}
+    for (_, operation_type), (total, _) in totals.items():
+        if operation_type in balance:
+            balance[operation_type] += total
+    return balance["доход"], balance["расход"]
+
+
+def rebuild(conn, totals=None):
+    """Полный пересчёт агрегатов по operations (или по заранее посчитанным totals, включающим архивы)"""
+    totals = expected_totals(conn) if totals is None else totals
+    conn.execute("DELETE FROM agg_category_totals")
+    conn.executemany("""
+        INSERT INTO agg_category_totals (category_id, operation_type, total, count)
+        VALUES (?, ?, ?, ?)
+    """, [(category_id, operation_type, total, count)
+          for (category_id, operation_type), (total, count) in totals.items()])
+    conn.execute("DELETE FROM agg_balance")
+    conn.execute("INSERT INTO agg_balance (id, income, expense) VALUES (1, ?, ?)", _balance(totals))
+
+
+def verify(conn, totals=None):
+    """Сверка агрегатов с operations (или с totals); возвращает список расхождений"""
+    totals = expected_totals(conn) if totals is None else totals
+    mismatches = []
+    stored = {
+        (category_id, operation_type): (total, count)
+        for category_id, operation_type, total, count in conn.execute(
+            "SELECT category_id, operation_type, total, count FROM agg_category_totals"
+        )
+    }
+    expected = {key: tuple(value) for key, value in totals.items()}
+    for key in stored.keys() | expected.keys():
+        actual = stored.get(key, (0, 0))
+        wanted = expected.get(key, (0, 0))
+        if actual != wanted:
+            mismatches.append(("agg_category_totals", key, actual, wanted))
+    income, expense = conn.execute("SELECT income, expense FROM agg_balance WHERE id = 1").fetchone() or (0, 0)
+    wanted_income, wanted_expense = _balance(totals)
+    for name, actual, wanted in (("income", income, wanted_income), ("expense", expense, wanted_expense)):
+        if actual != wanted:
+            mismatches.append(("agg_balance", name, actual, wanted))
+    return mismatches
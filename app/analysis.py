@@ -1,147 +1,287 @@
-import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
+# pandas, NumPy и matplotlib импортируются при первом обращении к анализу,
+# чтобы запуск приложения и страницы без графиков не ждали их загрузки.
 from io import BytesIO
 import base64
+import threading
+from datetime import datetime
+from .db import get_manager
+from .utils import from_minor_units
+
+_matplotlib_lock = threading.Lock()
+_backend_selected = False
+
+# Графики, доступные по имени, и методы, строящие их Figure
+CHARTS = {
+    "income_vs_expenses": "_income_vs_expenses_figure",
+    "expenses_by_category": "_expenses_by_category_figure",
+    "incomes_by_category": "_incomes_by_category_figure",
+    "top_expenses": "_top_expenses_figure",
+    "top_incomes": "_top_incomes_figure",
+    "top_expenses_and_incomes": "_top_expenses_and_incomes_figure",
+}
+
+# Данные тех же графиков для отрисовки в браузере и методы, которые их собирают
+CHART_DATA = {
+    "income_vs_expenses": "_income_vs_expenses_data",
+    "expenses_by_category": "_expenses_by_category_data",
+    "incomes_by_category": "_incomes_by_category_data",
+    "top_expenses": "_top_expenses_data",
+    "top_incomes": "_top_incomes_data",
+    "top_expenses_and_incomes": "_top_expenses_and_incomes_data",
+}
+
+# Интервалы агрегации (подписи — в snapshot.bucket_label) и их примерная длина
+# в днях, используемая при автоматическом выборе
+BUCKET_DAYS = {"day": 1, "week": 7, "month": 31, "quarter": 92, "year": 366}
+
+BUCKET_LABELS = {"day": "День", "week": "Неделя", "month": "Месяц", "quarter": "Квартал", "year": "Год"}
+
+
+def new_figure(**kwargs):
+    """Figure с холстом Agg: графики строятся без pyplot и без GUI-бэкенда"""
+    global _backend_selected
+    with _matplotlib_lock:
+        if not _backend_selected:
+            import matplotlib
+            matplotlib.use("Agg")  # pyplot не импортируется, GUI-бэкенд не нужен
+            _backend_selected = True
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def rotate_tick_labels(ax):
+    """Наклон подписей оси X, чтобы длинные названия не перекрывались"""
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment("right")
+
+
+def warm_up(db_name=None):
+    """Предварительная загрузка pandas и matplotlib (и снимка операций базы db_name).
+
+    Первый график после запуска иначе ждёт импорта библиотек и построения кэша шрифтов.
+    """
+    import pandas  # noqa: F401
+    fig = new_figure(figsize=(1, 1))
+    fig.subplots().plot([0, 1], [0, 1])
+    fig.savefig(BytesIO(), format="png")
+    if db_name is not None:
+        FinancialAnalysis(db_name).snapshot.refresh()
+
+
+def choose_bucket(date_from, date_to, max_points=120):
+    """Наименьший интервал, при котором на графике не больше max_points точек"""
+    span = (datetime.strptime(date_to[:10], "%Y-%m-%d") - datetime.strptime(date_from[:10], "%Y-%m-%d")).days + 1
+    for bucket, days in BUCKET_DAYS.items():
+        if span / days <= max_points:
+            return bucket
+    return "year"
+
 
 class FinancialAnalysis:
-    def __init__(self, db_name="data/tables.db"):
+    """Анализ операций базы.
+
+    Баланс и итоги по категориям за всё время читаются из агрегатов и
+    учитывают архивы закрытых лет. Графики по времени, топ-N и итоги за
+    период считаются по снимку: по открытым годам или, с include_archive=True,
+    по всей истории вместе с архивами.
+    """
+
+    def __init__(self, db_name="data/tables.db", include_archive=False):
         self.db_name = db_name
+        self.include_archive = include_archive
+        self.db = get_manager(db_name)
+        self._snapshot = None
+
+    @property
+    def snapshot(self):
+        """Общий снимок операций базы (NumPy загружается при первом обращении)"""
+        if self._snapshot is None:
+            from .snapshot import get_snapshot
+            self._snapshot = get_snapshot(self.db_name, self.include_archive)
+        return self._snapshot
 
     def get_balance(self):
-        """Расчёт текущего баланса (доходы - расходы)"""
-        with sqlite3.connect(self.db_name) as conn:
-            df = pd.read_sql("""
-                SELECT o.amount, o.operation_type
-                FROM operations o
-            """, conn)
-        incomes = df[df["operation_type"] == "доход"]["amount"].sum()
-        expenses = df[df["operation_type"] == "расход"]["amount"].sum()
-        return incomes - expenses
-
-    def get_category_summary(self, operation_type="расход"):
-        """Суммарные расходы или доходы по категориям"""
-        with sqlite3.connect(self.db_name) as conn:
-            df = pd.read_sql("""
-                SELECT c.name, SUM(o.amount) AS total
-                FROM operations o
-                JOIN categories c ON o.category_id = c.id
-                WHERE o.operation_type = ?
-                GROUP BY c.name
-            """, conn, params=(operation_type,))
-        return df
+        """Расчёт текущего баланса (доходы - расходы) по материализованным агрегатам"""
+        with self.db.connection() as conn:
+            row = conn.execute("SELECT income - expense FROM agg_balance WHERE id = 1").fetchone()
+        return from_minor_units(row[0] if row else 0)
+
+    def category_totals(self, operation_type="расход"):
+        """Пары (название категории, сумма) за всё время по агрегатам, по алфавиту"""
+        with self.db.connection() as conn:
+            return [(name, from_minor_units(total)) for name, total in conn.execute("""
+                SELECT c.name, a.total
+                FROM agg_category_totals a
+                JOIN categories c ON a.category_id = c.id
+                WHERE a.operation_type = ? AND a.count > 0
+                ORDER BY c.name
+            """, (operation_type,))]
+
+    def get_category_summary(self, operation_type="расход", date_from=None, date_to=None):
+        """Суммарные расходы или доходы по категориям, при необходимости за период.
+
+        Итоги за всё время читаются из агрегатов, за период — считаются по снимку.
+        """
+        import pandas as pd
+        if date_from or date_to:
+            rows = self.snapshot.category_summary(operation_type, date_from, date_to)
+        else:
+            rows = self.category_totals(operation_type)
+        return pd.DataFrame(rows, columns=["name", "total"])
 
     def get_top_expenses_or_incomes(self, n=10, operation_type="расход"):
         """Топ-N расходов или доходов"""
-        with sqlite3.connect(self.db_name) as conn:
-            df = pd.read_sql("""
-                SELECT o.amount, c.name, o.date
-                FROM operations o
-                JOIN categories c ON o.category_id = c.id
-                WHERE o.operation_type = ?
-                ORDER BY o.amount DESC
-                LIMIT ?
-            """, conn, params=(operation_type, n))
+        import pandas as pd
+        amounts, names, dates = self.snapshot.top(n, operation_type)
+        return pd.DataFrame({"amount": amounts, "name": names, "date": dates})
+
+    def get_time_series(self, bucket="auto", date_from=None, date_to=None, window=3, category_id=None):
+        """Доходы, расходы, сальдо и нарастающий баланс по интервалам времени.
+
+        Группировка выполняется векторно по снимку операций в памяти.
+        bucket: day, week, month, quarter, year или auto; window — ширина
+        скользящего среднего в интервалах; category_id — только одна категория.
+        """
+        import pandas as pd
+        first_day, last_day = self.snapshot.date_range(category_id)
+        if first_day is None:
+            return pd.DataFrame(columns=["bucket", "income", "expense", "net", "balance",
+                                         "income_avg", "expense_avg", "net_avg"])
+        date_from = (date_from or first_day)[:10]
+        date_to = (date_to or last_day)[:10]
+        if bucket == "auto":
+            bucket = choose_bucket(date_from, date_to)
+        if bucket not in BUCKET_DAYS:
+            raise ValueError(f"Неизвестный интервал: {bucket}")
+        labels, income, expense, opening = self.snapshot.time_series(bucket, date_from, date_to, category_id)
+        df = pd.DataFrame({"bucket": labels, "income": income, "expense": expense})
+        df["net"] = df["income"] - df["expense"]
+        df["balance"] = df["net"].cumsum() + opening
+        for column in ("income", "expense", "net"):
+            df[f"{column}_avg"] = df[column].rolling(window, min_periods=1).mean()
+        df.attrs["bucket"] = bucket
         return df
 
-    def _fig_to_html(self, fig):
-        """Конвертирует объект Figure в HTML-тег <img> с изображением в формате base64."""
+    def _fig_to_png(self, fig):
+        """Конвертирует объект Figure в PNG-изображение."""
         buf = BytesIO()
         fig.savefig(buf, format="png")
-        data = base64.b64encode(buf.getbuffer()).decode("ascii")
+        return buf.getvalue()
+
+    def _fig_to_html(self, fig):
+        """Конвертирует объект Figure в HTML-тег <img> с изображением в формате base64."""
+        data = base64.b64encode(self._fig_to_png(fig)).decode("ascii")
         return f"<img src='data:image/png;base64,{data}'/>"
 
-    def plot_expenses_by_category(self):
-        """График расходов по категориям в виде HTML-тега <img>"""
+    def _plot_to_html(self, build_figure):
+        """HTML-тег <img> для графика или «Нет данных», если строить нечего"""
+        fig = build_figure()
+        if fig is None:
+            return "Нет данных"
+        return self._fig_to_html(fig)
+
+    def render_chart(self, name):
+        """PNG-изображение графика по имени из CHARTS"""
+        fig = getattr(self, CHARTS[name])()
+        if fig is None:
+            fig = new_figure(figsize=(8, 2))
+            fig.text(0.5, 0.5, "Нет данных", ha="center", va="center", fontsize=14)
+        return self._fig_to_png(fig)
+
+    def _expenses_by_category_figure(self):
+        """График расходов по категориям"""
         df = self.get_category_summary(operation_type="расход")
         if df.empty:
-            return "Нет данных"
-        fig = Figure(figsize=(8, 6))
+            return None
+        fig = new_figure(figsize=(8, 6))
         ax = fig.subplots()
         ax.bar(df["name"], df["total"])
         ax.set_title("Расходы по категориям")
         ax.set_xlabel("Категория")
         ax.set_ylabel("Сумма")
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
+        return fig
 
-    def plot_incomes_by_category(self):
-        """График доходов по категориям в виде HTML-тега <img>"""
+    def _incomes_by_category_figure(self):
+        """График доходов по категориям"""
         df = self.get_category_summary(operation_type="доход")
         if df.empty:
-            return "Нет данных"
-        fig = Figure(figsize=(8, 6))
+            return None
+        fig = new_figure(figsize=(8, 6))
         ax = fig.subplots()
         ax.bar(df["name"], df["total"])
         ax.set_title("Доходы по категориям")
         ax.set_xlabel("Категория")
         ax.set_ylabel("Сумма")
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
+        return fig
 
-    def plot_top_expenses(self):
-        """График топовых расходов в виде HTML-тега <img>"""
+    def _top_expenses_figure(self):
+        """График топовых расходов"""
         df = self.get_top_expenses_or_incomes(operation_type="расход")
         if df.empty:
-            return "Нет данных"
-        fig = Figure(figsize=(8, 6))
+            return None
+        fig = new_figure(figsize=(8, 6))
         ax = fig.subplots()
         ax.bar(df["name"], df["amount"])
         ax.set_title("Топ расходов")
         ax.set_xlabel("Категория")
-        ax.set_.ylabel("Сумма")
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        ax.set_ylabel("Сумма")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
+        return fig
 
-    def plot_top_incomes(self):
-        """График топовых доходов в виде HTML-тега <img>"""
+    def _top_incomes_figure(self):
+        """График топовых доходов"""
         df = self.get_top_expenses_or_incomes(operation_type="доход")
         if df.empty:
-            return "Нет данных"
-        fig = Figure(figsize=(8, 6))
+            return None
+        fig = new_figure(figsize=(8, 6))
         ax = fig.subplots()
         ax.bar(df["name"], df["amount"])
         ax.set_title("Топ доходов")
         ax.set_xlabel("Категория")
         ax.set_ylabel("Сумма")
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
+        return fig
 
-    def plot_income_vs_expenses(self):
-        """График доходов и расходов в виде HTML-тега <img>"""
-        with sqlite3.connect(self.db_name) as conn:
-            df = pd.read_sql("""
-                SELECT o.date, o.amount, o.operation_type
-                FROM operations o
-            """, conn)
+    def _income_vs_expenses_figure(self):
+        """График доходов и расходов по времени с автоматическим выбором интервала"""
+        df = self.get_time_series()
         if df.empty:
-            return "Нет данных"
-        income_df = df[df["operation_type"] == "доход"].groupby("date").sum()
-        expense_df = df[df["operation_type"] == "расход"].groupby("date").sum()
-        fig = Figure(figsize=(10, 6))
+            return None
+        fig = new_figure(figsize=(10, 6))
         ax = fig.subplots()
-        ax.plot(income_df.index, income_df["amount"], label="Доходы")
-        ax.plot(expense_df.index, expense_df["amount"], label="Расходы")
+        x = range(len(df))
+        ax.plot(x, df["income"], label="Доходы")
+        ax.plot(x, df["expense"], label="Расходы")
+        ax.plot(x, df["net_avg"], label="Сальдо (скользящее среднее)", linestyle="--")
+        ax.plot(x, df["balance"], label="Баланс", color="grey", linewidth=1)
+        step = max(1, len(df) // 24)  # Не больше ~24 подписей по оси X
+        ax.set_xticks(list(x)[::step])
+        ax.set_xticklabels(df["bucket"].tolist()[::step])
         ax.set_title("Доходы и расходы по времени")
-        ax.set_xlabel("Дата")
+        ax.set_xlabel(BUCKET_LABELS[df.attrs["bucket"]])
         ax.set_ylabel("Сумма")
         ax.legend()
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
+        return fig
 
-    def plot_top_expenses_and_incomes(self):
-        """График топ 10 расходов и доходов в виде HTML-тега <img>"""
+    def _top_expenses_and_incomes_figure(self):
+        """График топ 10 расходов и доходов"""
         top_expenses = self.get_top_expenses_or_incomes(operation_type="расход")
         top_incomes = self.get_top_expenses_or_incomes(operation_type="доход")
         if top_expenses.empty and top_incomes.empty:
-            return "Нет данных"
-        fig = Figure(figsize=(10, 6))
+            return None
+        fig = new_figure(figsize=(10, 6))
         ax = fig.subplots()
         if not top_expenses.empty:
             ax.bar(top_expenses["name"], top_expenses["amount"], label="Расходы")
@@ -151,6 +291,93 @@ class FinancialAnalysis:
         ax.set_xlabel("Категория")
         ax.set_ylabel("Сумма")
         ax.legend()
-        plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+        rotate_tick_labels(ax)
         fig.tight_layout()
-        return self._fig_to_html(fig)
\ No newline at end of file
+        return fig
+
+    def chart_data(self, name):
+        """Данные графика по имени из CHART_DATA для отрисовки в браузере.
+
+        Словарь: title, type (bar или line), x_label, y_label, подписи точек labels
+        и ряды series ({"name", "values"}, пропуск — None); пустой labels — нет данных.
+        """
+        return getattr(self, CHART_DATA[name])()
+
+    @staticmethod
+    def _chart(title, chart_type, x_label, labels, series, **extra):
+        return dict({
+            "title": title,
+            "type": chart_type,
+            "x_label": x_label,
+            "y_label": "Сумма",
+            "labels": labels,
+            "series": [{"name": name, "values": [None if value is None else round(float(value), 2)
+                                                  for value in values]}
+                       for name, values in series],
+        }, **extra)
+
+    def _category_data(self, operation_type, title):
+        rows = self.category_totals(operation_type)
+        return self._chart(title, "bar", "Категория", [name for name, _ in rows],
+                           [("Сумма", [total for _, total in rows])])
+
+    def _top_data(self, operation_type, title):
+        amounts, names, dates = self.snapshot.top(10, operation_type)
+        return self._chart(title, "bar", "Категория", names, [("Сумма", amounts)], dates=dates)
+
+    def _expenses_by_category_data(self):
+        return self._category_data("расход", "Расходы по категориям")
+
+    def _incomes_by_category_data(self):
+        return self._category_data("доход", "Доходы по категориям")
+
+    def _top_expenses_data(self):
+        return self._top_data("расход", "Топ расходов")
+
+    def _top_incomes_data(self):
+        return self._top_data("доход", "Топ доходов")
+
+    def _top_expenses_and_incomes_data(self):
+        """Топ 10 расходов и доходов: подписи расходов, затем доходов"""
+        expense_amounts, expense_names, expense_dates = self.snapshot.top(10, "расход")
+        income_amounts, income_names, income_dates = self.snapshot.top(10, "доход")
+        return self._chart("Топ 10 расходов и доходов", "bar", "Категория", expense_names + income_names, [
+            ("Расходы", expense_amounts + [None] * len(income_amounts)),
+            ("Доходы", [None] * len(expense_amounts) + income_amounts),
+        ], dates=expense_dates + income_dates)
+
+    def _income_vs_expenses_data(self):
+        df = self.get_time_series()
+        if df.empty:
+            return self._chart("Доходы и расходы по времени", "line", "", [], [])
+        return self._chart("Доходы и расходы по времени", "line", BUCKET_LABELS[df.attrs["bucket"]],
+                           df["bucket"].tolist(), [
+                               ("Доходы", df["income"].tolist()),
+                               ("Расходы", df["expense"].tolist()),
+                               ("Сальдо (скользящее среднее)", df["net_avg"].tolist()),
+                               ("Баланс", df["balance"].tolist()),
+                           ])
+
+    def plot_expenses_by_category(self):
+        """График расходов по категориям в виде HTML-тега <img>"""
+        return self._plot_to_html(self._expenses_by_category_figure)
+
+    def plot_incomes_by_category(self):
+        """График доходов по категориям в виде HTML-тега <img>"""
+        return self._plot_to_html(self._incomes_by_category_figure)
+
+    def plot_top_expenses(self):
+        """График топовых расходов в виде HTML-тега <img>"""
+        return self._plot_to_html(self._top_expenses_figure)
+
+    def plot_top_incomes(self):
+        """График топовых доходов в виде HTML-тега <img>"""
+        return self._plot_to_html(self._top_incomes_figure)
+
+    def plot_income_vs_expenses(self):
+        """График доходов и расходов в виде HTML-тега <img>"""
+        return self._plot_to_html(self._income_vs_expenses_figure)
+
+    def plot_top_expenses_and_incomes(self):
+        """График топ 10 расходов и доходов в виде HTML-тега <img>"""
+        return self._plot_to_html(self._top_expenses_and_incomes_figure)
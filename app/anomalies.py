@@ -0,0 +1,219 @@
+# Поиск аномальных расходов и перерасхода месячных бюджетов по категориям.
+# Статистика считается по снимку операций (snapshot.py) векторно, через pandas:
+# медиана и MAD сумм категории (устойчивый z-показатель) и скользящий перцентиль
+# предыдущих операций категории. Пока снимок только дописывается, новые операции
+# пересчитывают лишь свои категории и добавляются к месячным итогам.
+import calendar
+import os
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from .snapshot import TYPE_CODES, format_epoch, get_snapshot
+
+# Параметры по умолчанию (переопределяются в app.config)
+DEFAULTS = {
+    "ANOMALY_THRESHOLD": 3.5,  # Порог устойчивого z-показателя (Иглевич и Хоглин)
+    "ANOMALY_MIN_OPERATIONS": 5,  # Меньше операций в категории — статистика не считается
+    "ANOMALY_WINDOW": 20,  # Сколько предыдущих операций категории берёт скользящий перцентиль
+    "ANOMALY_PERCENTILE": 95,
+    "ANOMALY_ROLLING_FACTOR": 1.5,  # Во сколько раз сумма должна превысить скользящий перцентиль
+}
+
+# Масштаб MAD и среднего абсолютного отклонения до стандартного отклонения нормального распределения
+MAD_SCALE = 1.4826
+MEAN_AD_SCALE = 1.2533
+
+EXPENSE = TYPE_CODES["расход"]
+
+
+def month_labels(dates):
+    """Секунды от начала эпохи в месяцы YYYY-MM"""
+    return np.datetime_as_string(np.asarray(dates, dtype="datetime64[s]").astype("datetime64[M]"))
+
+
+def score(frame, config):
+    """Статистика операций frame (id, amount, date, category) по их категориям.
+
+    Добавляет столбцы median и z (устойчивый z-показатель относительно медианы
+    и MAD категории; NaN, если операций в категории меньше минимума), rolling
+    (перцентиль сумм предыдущих ANOMALY_WINDOW операций категории по дате)
+    и признаки аномальности by_z и by_rolling.
+    """
+    frame = frame.sort_values(["category", "date", "id"], kind="stable", ignore_index=True)
+    amounts = frame["amount"].astype(np.float64)
+    categories = frame["category"]
+    median = amounts.groupby(categories, sort=False).transform("median")
+    deviation = (amounts - median).abs()
+    by_category = deviation.groupby(categories, sort=False)
+    mad = by_category.transform("median")
+    # Больше половины сумм одинаковы (MAD = 0) — масштаб по среднему отклонению
+    scale = (mad * MAD_SCALE).where(mad > 0, by_category.transform("mean") * MEAN_AD_SCALE)
+    z = ((amounts - median) / scale.where(scale > 0)).fillna(0.0)
+    enough = by_category.transform("size") >= config["ANOMALY_MIN_OPERATIONS"]
+    rolling = (amounts.groupby(categories, sort=False)
+               .rolling(config["ANOMALY_WINDOW"], min_periods=config["ANOMALY_MIN_OPERATIONS"])
+               .quantile(config["ANOMALY_PERCENTILE"] / 100))
+    # Порог операции — по предыдущим операциям категории, без неё самой
+    rolling = rolling.groupby(level=0, sort=False).shift().droplevel(0).sort_index()
+    frame["median"] = median
+    frame["z"] = z.where(enough)
+    frame["rolling"] = rolling
+    frame["by_z"] = frame["z"] > config["ANOMALY_THRESHOLD"]
+    frame["by_rolling"] = amounts > rolling * config["ANOMALY_ROLLING_FACTOR"]
+    return frame
+
+
+class AnomalyDetector:
+    """Аномальные расходы и перерасход бюджетов по снимку операций.
+
+    Хранит оценённые операции каждой категории и суммы расходов по категориям
+    и месяцам. update() сверяется со снимком: если с прошлого раза строки
+    только дописывались (поколение снимка прежнее), пересчитываются лишь
+    категории новых операций; после изменений и удалений — всё заново.
+    """
+
+    def __init__(self, snapshot, config=None):
+        config = config or {}
+        self.config = {key: config.get(key, value) for key, value in DEFAULTS.items()}
+        self.snapshot = snapshot
+        self._lock = threading.Lock()
+        self.generation = None
+        self.size = 0  # Сколько строк снимка уже учтено
+        self._frames = {}  # код категории -> оценённые операции
+        self._flagged = {}  # код категории -> отмеченные операции
+        self._monthly = {}  # (код категории, YYYY-MM) -> сумма расходов, копейки
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0}
+
+    def update(self):
+        """Учёт операций, появившихся в снимке с прошлого вызова"""
+        with self._lock:
+            # Вид снимка берётся под блокировкой: иначе поток с более старым видом
+            # мог бы войти после более нового и учесть те же строки повторно
+            generation, ids, amounts, dates, categories, types = self.snapshot.view()
+            if generation == self.generation and len(ids) <= self.size:
+                self.stats["unchanged"] += 1
+                return self
+            full = generation != self.generation
+            start = 0 if full else self.size
+            mask = (types[start:] == EXPENSE) & (categories[start:] >= 0)
+            new = pd.DataFrame({
+                "id": ids[start:][mask],
+                "amount": amounts[start:][mask],
+                "date": dates[start:][mask],
+                "category": categories[start:][mask],
+            })
+            if full:
+                self._frames, self._flagged, self._monthly = {}, {}, {}
+                self._rescore(new)
+                self.stats["full"] += 1
+            else:
+                # Пересчёт только затронутых категорий: их прежние операции и новые
+                touched = new["category"].unique().tolist()
+                parts = [self._frames[code][list(new.columns)] for code in touched if code in self._frames]
+                self._rescore(pd.concat(parts + [new], ignore_index=True) if parts else new)
+                self.stats["incremental"] += 1
+            self._add_monthly(new)
+            self.generation, self.size = generation, len(ids)
+        return self
+
+    def _rescore(self, frame):
+        scored = score(frame, self.config)
+        for code, group in scored.groupby("category", sort=False):
+            self._frames[code] = group
+            self._flagged[code] = group[group["by_z"] | group["by_rolling"]]
+
+    def _add_monthly(self, frame):
+        if not len(frame):
+            return
+        totals = frame.groupby([frame["category"], month_labels(frame["date"])])["amount"].sum()
+        for key, total in totals.items():
+            self._monthly[key] = self._monthly.get(key, 0) + int(total)
+
+    def outliers(self, limit=50):
+        """Аномальные расходы, самые отклоняющиеся сначала (суммы — в рублях)"""
+        self.update()
+        with self._lock:
+            flagged = [frame for frame in self._flagged.values() if len(frame)]
+        if not flagged:
+            return []
+        frame = pd.concat(flagged, ignore_index=True)
+        # Отклонение от скользящего порога учитывается, если z не посчитан
+        excess = frame["z"].fillna(frame["amount"] / frame["rolling"])
+        frame = frame.iloc[np.argsort(-excess.to_numpy(), kind="stable")[:limit]]
+        names = self.snapshot.category_names
+        ids = self.snapshot.category_ids
+        return [
+            {
+                "id": int(row.id),
+                "date": date,
+                "category_id": ids[row.category],
+                "category": names[row.category],
+                "amount": row.amount / 100,
+                "median": round(row.median / 100, 2),
+                "z": None if np.isnan(row.z) else round(row.z, 2),
+                "rolling": None if np.isnan(row.rolling) else round(row.rolling / 100, 2),
+                "reasons": [reason for reason, flag in (("robust_z", row.by_z), ("rolling", row.by_rolling))
+                            if flag],
+            }
+            for row, date in zip(frame.itertuples(index=False), format_epoch(frame["date"]).tolist())
+        ]
+
+    def budget_overruns(self, budgets, month=None, now=None):
+        """Расходы месяца по категориям с бюджетом (budgets: {id категории: лимит в копейках}).
+
+        month — YYYY-MM, по умолчанию текущий (UTC); для текущего месяца
+        дополнительно оценивается расход к концу месяца при том же темпе.
+        Категории отсортированы по доле использованного бюджета.
+        """
+        self.update()
+        today = datetime.fromtimestamp(now or datetime.now(timezone.utc).timestamp(), timezone.utc)
+        current = today.strftime("%Y-%m")
+        month = month or current
+        if month == current:
+            elapsed = today.day / calendar.monthrange(today.year, today.month)[1]
+        else:
+            elapsed = None
+        names = self.snapshot.category_names
+        result = []
+        with self._lock:
+            for category_id, limit in budgets.items():
+                code = self.snapshot.category_code(category_id)
+                spent = self._monthly.get((code, month), 0)
+                over_months = sum(1 for (key, _), total in self._monthly.items()
+                                  if key == code and total > limit)
+                projected = round(spent / elapsed) if elapsed else spent
+                result.append({
+                    "category_id": category_id,
+                    "category": names[code] if code is not None else None,
+                    "month": month,
+                    "limit": limit / 100,
+                    "spent": spent / 100,
+                    "share": round(spent / limit, 3),
+                    "projected": projected / 100,
+                    "over": spent > limit,
+                    "projected_over": projected > limit,
+                    "over_months": over_months,
+                })
+        result.sort(key=lambda item: -item["share"])
+        return result
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_detector(db_name, config=None):
+    """Общий детектор для файла базы данных (параметры — при первом обращении)"""
+    key = os.path.abspath(db_name)
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = _detectors[key] = AnomalyDetector(get_snapshot(db_name), config)
+        return detector
+
+
+def release_detector(db_name):
+    """Удаление детектора файла из общего реестра"""
+    with _detectors_lock:
+        _detectors.pop(os.path.abspath(db_name), None)
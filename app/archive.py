@@ -0,0 +1,159 @@
+# Архивы закрытых лет. Операции года переносятся из operations в отдельный
+# файл SQLite <база>.archive/<год>.db вместе с итогами года. Соединения пула
+# архивы не подключают: выгрузка всей истории, сверка агрегатов и снимок
+# анализа с архивами (snapshot.py) открывают архивы по одному только для чтения,
+# поэтому число архивных лет не ограничено пределом SQLite на число подключённых
+# баз. Рабочая таблица остаётся маленькой; материализованные агрегаты базы
+# по-прежнему учитывают и архивные операции.
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+from .utils import to_timestamp
+
+OPERATION_COLUMNS = "id, amount, category_id, date, operation_type, comment"
+
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE {schema}.operations (
+        id INTEGER PRIMARY KEY,
+        amount INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        date INTEGER NOT NULL,
+        operation_type TEXT NOT NULL,
+        comment TEXT
+    )
+    """,
+    "CREATE INDEX {schema}.idx_operations_date_id ON operations (date, id)",
+    # Итоги года, по категориям (с названием на момент переноса) и по месяцам, в копейках
+    """
+    CREATE TABLE {schema}.year_totals (
+        operation_type TEXT PRIMARY KEY,
+        total INTEGER NOT NULL,
+        count INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE {schema}.category_totals (
+        category_id INTEGER NOT NULL,
+        name TEXT,
+        operation_type TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (category_id, operation_type)
+    )
+    """,
+    """
+    CREATE TABLE {schema}.monthly_totals (
+        month TEXT NOT NULL,
+        operation_type TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (month, operation_type)
+    )
+    """,
+)
+
+
+def archive_dir(db_name):
+    """Каталог архивов базы: data/tables.db -> data/tables.archive"""
+    return os.path.splitext(db_name)[0] + ".archive"
+
+
+def archive_path(db_name, year):
+    return os.path.join(archive_dir(db_name), f"{int(year)}.db")
+
+
+def year_bounds(year):
+    """Начало года и начало следующего года в секундах от начала эпохи (UTC)"""
+    return to_timestamp(f"{year:04d}-01-01"), to_timestamp(f"{year + 1:04d}-01-01")
+
+
+def connect(db_name, year):
+    """Соединение с архивом года только для чтения (закрывает вызывающий)"""
+    path = os.path.abspath(archive_path(db_name, year))
+    return sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+
+
+def check_closed(year, now=None):
+    """ValueError, если год не раньше текущего (UTC)"""
+    if year >= datetime.fromtimestamp(now or time.time(), timezone.utc).year:
+        raise ValueError(f"Год {year} ещё не закрыт")
+
+
+def archive_year(db_name, year, now=None):
+    """Перенос операций закрытого года в архивный файл одной транзакцией.
+
+    Год должен быть раньше текущего, а более ранние годы — уже в архиве.
+    Возвращает число перенесённых операций (0 — операций за год нет, архив
+    не создаётся). После переноса запись операций за этот и более ранние
+    годы запрещена триггерами.
+    """
+    check_closed(year, now)
+    start, end = year_bounds(year)
+    directory = archive_dir(db_name)
+    os.makedirs(directory, exist_ok=True)
+    path = archive_path(db_name, year)
+    filename = os.path.basename(path)
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        if conn.execute("SELECT 1 FROM archives WHERE year = ?", (year,)).fetchone():
+            raise ValueError(f"Год {year} уже в архиве")
+        if conn.execute("SELECT 1 FROM operations WHERE date < ? LIMIT 1", (start,)).fetchone():
+            raise ValueError(f"Сначала перенесите в архив годы раньше {year}")
+        if not conn.execute("SELECT 1 FROM operations WHERE date >= ? AND date < ? LIMIT 1",
+                            (start, end)).fetchone():
+            return 0
+        if os.path.exists(path):
+            os.remove(path)  # Остаток прерванного переноса: год не зарегистрирован
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement.format(schema="archive"))
+            conn.execute(f"""
+                INSERT INTO archive.operations ({OPERATION_COLUMNS})
+                SELECT {OPERATION_COLUMNS} FROM main.operations
+                WHERE date >= ? AND date < ?
+            """, (start, end))
+            conn.execute("""
+                INSERT INTO archive.year_totals (operation_type, total, count)
+                SELECT operation_type, SUM(amount), COUNT(*) FROM archive.operations GROUP BY 1
+            """)
+            conn.execute("""
+                INSERT INTO archive.category_totals (category_id, name, operation_type, total, count)
+                SELECT o.category_id, c.name, o.operation_type, SUM(o.amount), COUNT(*)
+                FROM archive.operations o
+                LEFT JOIN main.categories c ON o.category_id = c.id
+                GROUP BY 1, 3
+            """)
+            conn.execute("""
+                INSERT INTO archive.monthly_totals (month, operation_type, total, count)
+                SELECT strftime('%Y-%m', date, 'unixepoch'), operation_type, SUM(amount), COUNT(*)
+                FROM archive.operations GROUP BY 1, 2
+            """)
+            rows, income, expense = conn.execute("""
+                SELECT COALESCE(SUM(count), 0),
+                       COALESCE(SUM(CASE WHEN operation_type = 'доход' THEN total END), 0),
+                       COALESCE(SUM(CASE WHEN operation_type = 'расход' THEN total END), 0)
+                FROM archive.year_totals
+            """).fetchone()
+            conn.execute("DELETE FROM main.operations WHERE date >= ? AND date < ?", (start, end))
+            conn.execute("""
+                INSERT INTO main.archives (year, filename, rows, income, expense, until, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (year, filename, rows, income, expense, end, int(time.time())))
+            conn.execute("UPDATE main.data_version SET version = version + 1 WHERE id = 1")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.execute("DETACH DATABASE archive")
+            os.remove(path)
+            raise
+        conn.execute("DETACH DATABASE archive")
+        return rows
+    finally:
+        conn.close()
@@ -0,0 +1,145 @@
+import asyncio
+import contextvars
+import sys
+from tempfile import SpooledTemporaryFile
+from .db import close_all_managers
+
+_END = object()
+
+
+class AsgiAdapter:
+    """ASGI-обёртка над WSGI-приложением Flask.
+
+    Обработчики выполняются в ограниченном пуле потоков Executors.workers,
+    поэтому цикл событий не блокируется обращениями к БД, а тело ответа
+    (в том числе потоковая выгрузка) передаётся клиенту по частям.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.executors = flask_app.extensions["executors"]
+        self.jobs = flask_app.extensions["jobs"]
+        self._active = 0
+        self._idle = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            self._active += 1
+            try:
+                await self._http(scope, receive, send)
+            finally:
+                self._active -= 1
+                if self._active == 0 and self._idle is not None:
+                    self._idle.set()
+        else:
+            raise ValueError(f"Неподдерживаемый тип соединения: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._idle = asyncio.Event()
+                # Задачи, оставшиеся в очереди с прошлого запуска, выполняются сразу
+                await asyncio.get_running_loop().run_in_executor(None, self.jobs.start)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _shutdown(self):
+        """Дожидаемся текущих запросов, затем останавливаем пулы и закрываем соединения"""
+        if self._active:
+            self._idle.clear()
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.executors.config["SHUTDOWN_TIMEOUT"])
+            except asyncio.TimeoutError:
+                pass
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.jobs.shutdown, self.executors.config["SHUTDOWN_TIMEOUT"])
+        await loop.run_in_executor(None, self.executors.shutdown)
+        close_all_managers()
+
+    async def _read_body(self, receive):
+        body = SpooledTemporaryFile(max_size=1024 * 1024)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body.seek(0)
+        return body
+
+    def _environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                key = name
+            else:
+                key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        executor = self.executors.workers
+        body = await self._read_body(receive)
+        environ = self._environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return lambda data: None
+
+        def next_chunk(iterator):
+            # Заголовки могут появиться только после первой итерации тела
+            for chunk in iterator:
+                if chunk:
+                    return chunk
+            return _END
+
+        # Один контекст на весь запрос: потоковые ответы Flask (stream_with_context)
+        # продолжают работу в контексте запроса в любом потоке пула
+        context = contextvars.copy_context()
+        result = await loop.run_in_executor(executor, context.run, self.flask_app.wsgi_app,
+                                            environ, start_response)
+        iterator = iter(result)
+        try:
+            chunk = await loop.run_in_executor(executor, context.run, next_chunk, iterator)
+            await send({"type": "http.response.start", "status": response["status"],
+                        "headers": response["headers"]})
+            while chunk is not _END:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(executor, context.run, next_chunk, iterator)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(executor, context.run, result.close)
+            body.close()
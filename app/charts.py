@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+
+class CachedChart:
+    """PNG-изображение графика, построенное для определённой версии данных"""
+
+    def __init__(self, version, png):
+        self.version = version
+        self.png = png
+        self.etag = hashlib.sha1(png).hexdigest()
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    @property
+    def size(self):
+        return len(self.png)
+
+
+class ChartCache:
+    """LRU-кэш графиков с ограничением по памяти.
+
+    Если данные изменились, отдаётся устаревшее изображение, а новое строится
+    в пуле потоков приложения (executor); синхронно график строится только при
+    первом обращении. Одновременные запросы одного графика ждут одно построение.
+    """
+
+    def __init__(self, executor, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pending = {}  # ключ -> (версия, Future) строящегося графика
+        self._lock = threading.Lock()
+        self._executor = executor
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "waits": 0, "evictions": 0}
+
+    def get(self, key, version, render):
+        """Изображение для key; render() строит PNG для текущей версии данных"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.version == version:
+                    self.stats["hits"] += 1
+                    return entry
+                self.stats["stale"] += 1
+                if key not in self._pending:
+                    try:
+                        future = self._executor.submit(self._build, key, version, render)
+                    except RuntimeError:
+                        pass  # Пул остановлен: приложение завершается
+                    else:
+                        self._pending[key] = (version, future)
+                return entry
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] >= version:
+                self.stats["waits"] += 1
+                future = pending[1]
+            else:
+                self.stats["misses"] += 1
+                future = Future()
+                self._pending[key] = (version, future)
+                pending = None
+        if pending is not None:
+            return future.result()
+        try:
+            entry = self._build(key, version, render)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(entry)
+        return entry
+
+    def _build(self, key, version, render):
+        """Построение графика; по завершении ключ снимается с ожидания"""
+        try:
+            return self._store(key, CachedChart(version, render()))
+        finally:
+            with self._lock:
+                # Построение более новой версии, начатое позже, остаётся в ожидании
+                if self._pending.get(key, (None,))[0] == version:
+                    del self._pending[key]
+
+    def _store(self, key, entry):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None:
+                if current.version > entry.version:
+                    return current
+                self._size -= current.size
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._size += entry.size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self.stats["evictions"] += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,85 @@
+import click
+from app.shards import ShardRouter, UnknownProperty
+from app.storage import Storage
+
+
+def init_cli(app):
+    def storage_for(property_id):
+        """Хранилище объекта недвижимости или базы по умолчанию"""
+        if property_id:
+            try:
+                return ShardRouter(app.config["SHARDS_DIR"]).storage(property_id)
+            except (UnknownProperty, ValueError) as e:
+                raise click.ClickException(str(e))
+        return Storage(app.config["DATABASE"])
+
+    @app.cli.group("property")
+    def property_group():
+        """Базы объектов недвижимости"""
+
+    @property_group.command("create")
+    @click.argument("property_id")
+    def create_property(property_id):
+        """Создание базы объекта PROPERTY_ID"""
+        router = ShardRouter(app.config["SHARDS_DIR"])
+        try:
+            if router.exists(property_id):
+                raise click.ClickException(f"Объект {property_id} уже существует")
+            router.storage(property_id, create=True)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"База объекта создана: {router.db_name(property_id)}")
+
+    @property_group.command("list")
+    def list_properties():
+        """Объекты, для которых есть база"""
+        for property_id in ShardRouter(app.config["SHARDS_DIR"]).properties():
+            click.echo(property_id)
+
+    @app.cli.group()
+    def aggregates():
+        """Обслуживание материализованных агрегатов"""
+
+    @aggregates.command("rebuild")
+    @click.option("--property", "property_id", help="объект недвижимости (по умолчанию основная база)")
+    def rebuild_aggregates(property_id):
+        """Пересчёт агрегатов по таблице операций"""
+        storage_for(property_id).rebuild_aggregates()
+        click.echo("Агрегаты пересчитаны")
+
+    @aggregates.command("verify")
+    @click.option("--property", "property_id", help="объект недвижимости (по умолчанию основная база)")
+    def verify_aggregates(property_id):
+        """Сверка агрегатов с таблицей операций"""
+        mismatches = storage_for(property_id).verify_aggregates()
+        for table, key, actual, expected in mismatches:
+            click.echo(f"{table} {key}: сохранено {actual}, ожидалось {expected}")
+        if mismatches:
+            raise SystemExit(1)
+        click.echo("Агрегаты совпадают с операциями")
+
+    @app.cli.group()
+    def archive():
+        """Архивы закрытых лет"""
+
+    @archive.command("close-year")
+    @click.argument("year", type=int)
+    @click.option("--property", "property_id", help="объект недвижимости (по умолчанию основная база)")
+    def close_year(year, property_id):
+        """Перенос операций всех лет по YEAR включительно в архивы"""
+        try:
+            archived = storage_for(property_id).archive_closed_years(year)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for archived_year, rows in archived:
+            click.echo(f"{archived_year}: перенесено операций {rows}")
+        if not archived:
+            click.echo("Нет операций для переноса")
+
+    @archive.command("list")
+    @click.option("--property", "property_id", help="объект недвижимости (по умолчанию основная база)")
+    def list_archives(property_id):
+        """Архивные годы и их итоги"""
+        for item in storage_for(property_id).get_archives():
+            click.echo(f"{item['year']}: операций {item['rows']}, доходы {item['income']}, "
+                       f"расходы {item['expense']}, сальдо {item['balance']}")
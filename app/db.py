@@ -0,0 +1,144 @@
+import atexit
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from .metrics import InstrumentedConnection
+
+# Настройки соединения, применяемые один раз при его открытии
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 МБ кэша страниц
+    "PRAGMA mmap_size=268435456",  # 256 МБ отображения файла в память
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionManager:
+    """Пул долгоживущих соединений SQLite для одного файла базы данных.
+
+    Поток получает соединение из пула на время работы и возвращает его обратно.
+    Вложенные вызовы connection() в одном потоке используют то же соединение
+    и одну транзакцию, которая фиксируется при выходе из внешнего блока.
+    """
+
+    def __init__(self, db_name, pool_size=8):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self.stats = {"opened": 0, "reused": 0, "closed": 0}
+
+    def _open(self):
+        """Открытие нового соединения с настройками PRAGMAS"""
+        directory = os.path.dirname(self.db_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, factory=InstrumentedConnection)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self.stats["opened"] += 1
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                self.stats["reused"] += 1
+                return self._idle.pop()
+        return self._open()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+            self.stats["closed"] += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Соединение текущего потока; транзакция фиксируется на внешнем уровне."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._release(conn)
+
+    def get_stats(self):
+        """Счётчики открытых и повторно использованных соединений"""
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle))
+
+    def ensure_schema(self, create_tables):
+        """Однократное создание схемы; другие потоки ждут, пока она будет создана"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            with self.connection() as conn:
+                create_tables(conn)
+            self._schema_ready = True
+
+    def close_all(self):
+        """Закрытие всех простаивающих соединений"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.stats["closed"] += len(idle)
+        for conn in idle:
+            conn.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_name):
+    """Общий менеджер соединений для файла базы данных"""
+    key = os.path.abspath(db_name)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = ConnectionManager(db_name)
+        return manager
+
+
+def release_manager(db_name):
+    """Закрытие соединений файла и удаление его менеджера из общего реестра"""
+    with _managers_lock:
+        manager = _managers.pop(os.path.abspath(db_name), None)
+    if manager is not None:
+        manager.close_all()
+
+
+def close_all_managers():
+    """Закрытие соединений всех менеджеров (при завершении процесса)"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close_all()
+
+
+atexit.register(close_all_managers)
@@ -0,0 +1,116 @@
+import csv
+import io
+
+OPERATION_COLUMNS = ["amount", "category_id", "date", "operation_type", "comment"]
+
+# Форматы выгрузки: MIME-тип и расширение файла
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файлоподобный приёмник, из которого записанные байты забираются по частям"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_csv(chunks):
+    """Потоковая выгрузка пачек строк операций в CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(OPERATION_COLUMNS)  # Заголовок
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Для выгрузки в Arrow/Parquet установите пакет pyarrow.")
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ("amount", pa.float64()),
+        ("category_id", pa.int64()),
+        ("date", pa.string()),
+        ("operation_type", pa.string()),
+        ("comment", pa.string()),
+    ])
+
+
+def _record_batch(pa, schema, rows):
+    columns = list(zip(*rows))
+    return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                           schema=schema)
+
+
+def stream_arrow(chunks):
+    """Потоковая выгрузка в формате Arrow IPC stream (по пакету записей на пачку)"""
+    pa = _require_pyarrow()
+    import pyarrow.ipc
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        writer.write_batch(_record_batch(pa, schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_parquet(chunks):
+    """Потоковая выгрузка в Parquet (по группе строк на пачку)"""
+    pa = _require_pyarrow()
+    import pyarrow.parquet
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for rows in chunks:
+        writer.write_batch(_record_batch(pa, schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(chunks, export_format="csv"):
+    """Генератор содержимого выгрузки в выбранном формате"""
+    if export_format == "csv":
+        return stream_csv(chunks)
+    if export_format in ("arrow", "parquet"):
+        _require_pyarrow()  # Ошибка об отсутствии pyarrow — до начала ответа
+    if export_format == "arrow":
+        return stream_arrow(chunks)
+    if export_format == "parquet":
+        return stream_parquet(chunks)
+    raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
@@ -0,0 +1,133 @@
+import csv
+from .utils import validate_amount, format_date, to_minor_units, to_timestamp
+
+OPERATION_TYPES = ("доход", "расход")
+
+
+class IdempotencyConflict(Exception):
+    """Ключ идемпотентности уже использован для другой пачки операций"""
+
+
+def check_open_date(date, closed_until):
+    """Операции закрытых (перенесённых в архив) лет не принимаются"""
+    if closed_until is not None and date < closed_until:
+        raise ValueError("Год операции закрыт и перенесён в архив")
+
+
+class ImportResult:
+    """Итог загрузки CSV: число принятых и отклонённых строк с причинами.
+
+    position — название поля с номером строки в to_dict (line для CSV, index для JSON).
+    """
+
+    def __init__(self, max_errors=100, position="line"):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.position = position
+
+    def reject(self, line, reason):
+        """Учёт отклонённой строки; причины хранятся для первых max_errors строк"""
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, reason))
+
+    def to_dict(self):
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "errors": [{self.position: line, "reason": reason} for line, reason in self.errors],
+        }
+
+    def __str__(self):
+        text = f"Загружено строк: {self.accepted}, отклонено: {self.rejected}"
+        if self.errors:
+            details = "; ".join(f"строка {line}: {reason}" for line, reason in self.errors[:5])
+            text += f" ({details})"
+        return text
+
+
+def parse_operation_row(row, category_ids, closed_until=None):
+    """Разбор строки CSV операции в кортеж для INSERT (сумма в копейках, дата в секундах)"""
+    if len(row) < 4:
+        raise ValueError("Недостаточно столбцов")
+    amount = to_minor_units(row[0])
+    validate_amount(amount)
+    try:
+        category_id = int(row[1])
+    except ValueError:
+        raise ValueError(f"Некорректный ID категории: {row[1]!r}")
+    if category_id not in category_ids:
+        raise ValueError(f"Категория {category_id} не найдена")
+    date = to_timestamp(format_date(row[2].strip()))
+    check_open_date(date, closed_until)
+    operation_type = row[3].strip()
+    if operation_type not in OPERATION_TYPES:
+        raise ValueError(f"Некорректный тип операции: {operation_type!r}")
+    comment = row[4] if len(row) > 4 else ""
+    return amount, category_id, date, operation_type, comment
+
+
+def parse_operation_item(item, category_ids, closed_until=None):
+    """Разбор операции из JSON-объекта в кортеж для INSERT с теми же проверками, что и в форме"""
+    if not isinstance(item, dict):
+        raise ValueError("Операция должна быть объектом")
+    amount = item.get("amount")
+    if isinstance(amount, bool):
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+    validate_amount(amount)
+    amount = to_minor_units(amount)
+    validate_amount(amount)
+    category_id = item.get("category_id")
+    if not isinstance(category_id, int) or isinstance(category_id, bool):
+        raise ValueError(f"Некорректный ID категории: {category_id!r}")
+    if category_id not in category_ids:
+        raise ValueError(f"Категория {category_id} не найдена")
+    if not isinstance(item.get("date"), str):
+        raise ValueError("Некорректный формат даты. Используйте YYYY-MM-DD.")
+    date = to_timestamp(format_date(item["date"]))
+    check_open_date(date, closed_until)
+    operation_type = item.get("operation_type")
+    if operation_type not in OPERATION_TYPES:
+        raise ValueError(f"Некорректный тип операции: {operation_type!r}")
+    comment = item.get("comment") or ""
+    if not isinstance(comment, str):
+        raise ValueError("Комментарий должен быть строкой")
+    return amount, category_id, date, operation_type, comment
+
+
+def parse_category_row(row, known_names):
+    """Разбор строки CSV категории; повторяющиеся названия отклоняются"""
+    if len(row) < 2:
+        raise ValueError("Недостаточно столбцов")
+    name = row[0].strip()
+    category_type = row[1].strip()
+    if not name:
+        raise ValueError("Пустое название категории")
+    if category_type not in OPERATION_TYPES:
+        raise ValueError(f"Некорректный тип категории: {category_type!r}")
+    if name in known_names:
+        raise ValueError(f"Категория {name!r} уже существует")
+    known_names.add(name)
+    return name, category_type
+
+
+def iter_batches(stream, parse_row, result, batch_size=5000):
+    """Потоковый разбор CSV (с заголовком) пачками корректных строк"""
+    reader = csv.reader(stream)
+    next(reader, None)  # Пропускаем заголовок
+    batch = []
+    for row in reader:
+        if not row:
+            continue
+        try:
+            batch.append(parse_row(row))
+        except ValueError as e:
+            result.reject(reader.line_num, str(e))
+            continue
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
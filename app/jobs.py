@@ -0,0 +1,409 @@
+import base64
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from .db import get_manager
+
+log = logging.getLogger("app.jobs")
+
+# Настройки очереди задач по умолчанию (переопределяются в app.config)
+DEFAULTS = {
+    "JOB_WORKERS": 2,  # Потоки, выполняющие задачи
+    "JOB_RETENTION_SECONDS": 86400,  # Сколько хранить завершённые задачи и их файлы
+    "JOB_HEARTBEAT_SECONDS": 10,  # Как часто выполняющиеся задачи отмечаются живыми
+    "JOB_STALE_SECONDS": 60,  # Задача без отметок дольше этого возвращается в очередь
+}
+
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED = ("done", "failed", "cancelled")
+
+# Как часто обновлять прогресс в базе и проверять запрос отмены (секунды)
+PROGRESS_INTERVAL = 0.5
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class JobContext:
+    """Прогресс выполняющейся задачи и проверка запроса на её отмену"""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+        self.processed = 0
+        self.total = None
+        self._reported = 0.0
+
+    def path(self, filename):
+        """Путь к файлу задачи в её каталоге"""
+        return os.path.join(self.queue.job_dir(self.job["id"]), filename)
+
+    def progress(self, processed, total=None, force=False):
+        """Обработано processed из total; JobCancelled, если задачу отменили"""
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        now = time.time()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        if self.queue._report_progress(self.job, self.processed, self.total, now):
+            raise JobCancelled()
+
+
+def _count_lines(path):
+    """Число строк данных в CSV-файле (без заголовка)"""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        lines += 1  # Последняя строка без перевода строки
+    return max(lines - 1, 0)
+
+
+def import_operations_job(job, context):
+    """Загрузка операций из сохранённого CSV-файла"""
+    from .storage import Storage
+    path = context.path(job["params"]["filename"])
+    context.progress(0, _count_lines(path), force=True)
+    with open(path, "r", encoding="utf-8-sig", newline="") as file:
+        result = Storage(job["db_name"]).import_operations(file, progress=context.progress)
+    os.remove(path)
+    return result.to_dict(), None
+
+
+def export_operations_job(job, context):
+    """Выгрузка операций с фильтрами в файл задачи"""
+    from .exporter import EXPORT_FORMATS, stream_export
+    from .storage import Storage
+    storage = Storage(job["db_name"])
+    filters, export_format = job["params"]["filters"], job["params"]["format"]
+    include_archive = job["params"].get("archive", False)
+    context.progress(0, storage.count_operations(filters, include_archive), force=True)
+
+    def counted(chunks):
+        processed = 0
+        for chunk in chunks:
+            yield chunk
+            processed += len(chunk)
+            context.progress(processed)
+
+    filename = f"operations.{EXPORT_FORMATS[export_format][1]}"
+    with open(context.path(filename), "wb") as file:
+        chunks = counted(storage.iter_operation_chunks(filters, include_archive=include_archive))
+        for part in stream_export(chunks, export_format):
+            file.write(part.encode("utf-8") if isinstance(part, str) else part)
+    return {"rows": context.processed}, filename
+
+
+# Графики отчёта и их заголовки (как на странице анализа)
+REPORT_CHARTS = (
+    ("income_vs_expenses", "Доходы и расходы"),
+    ("expenses_by_category", "Расходы по категориям"),
+    ("incomes_by_category", "Доходы по категориям"),
+    ("top_expenses_and_incomes", "Топ 10 расходов и доходов"),
+)
+
+
+def report_job(job, context):
+    """HTML-отчёт со всеми графиками анализа, встроенными в файл"""
+    from .analysis import FinancialAnalysis
+    analysis = FinancialAnalysis(job["db_name"])
+    parts = ["<!doctype html><html lang=\"ru\"><head><meta charset=\"utf-8\">",
+             "<title>Анализ финансовых данных</title></head><body>",
+             "<h1>Анализ финансовых данных</h1>",
+             f"<p>Баланс: {analysis.get_balance()}</p>"]
+    context.progress(0, len(REPORT_CHARTS), force=True)
+    for done, (name, title) in enumerate(REPORT_CHARTS, 1):
+        png = base64.b64encode(analysis.render_chart(name)).decode("ascii")
+        parts.append(f"<h2>{title}</h2><img src=\"data:image/png;base64,{png}\" alt=\"{title}\">")
+        context.progress(done, force=True)
+    parts.append("</body></html>")
+    with io.open(context.path("report.html"), "w", encoding="utf-8") as file:
+        file.write("".join(parts))
+    return {"charts": len(REPORT_CHARTS)}, "report.html"
+
+
+# Виды задач: функция (job, context) -> (результат для JSON, имя файла результата или None)
+HANDLERS = {
+    "import_operations": import_operations_job,
+    "export_operations": export_operations_job,
+    "report": report_job,
+}
+
+
+class JobQueue:
+    """Постоянная очередь задач в SQLite с пулом потоков-исполнителей.
+
+    Задачи переживают перезапуск: очередь хранится в base_dir/jobs.db, файлы
+    задач — в base_dir/<id>/. Несколько процессов могут разбирать одну очередь:
+    задача захватывается атомарным UPDATE. Выполняющиеся задачи периодически
+    отмечаются живыми; задача процесса, завершившегося аварийно, возвращается
+    в очередь. Завершённые задачи и их файлы удаляются через JOB_RETENTION_SECONDS.
+    """
+
+    def __init__(self, base_dir, config=None, handlers=None):
+        self.base_dir = base_dir
+        self.config = {key: (config or {}).get(key, value) for key, value in DEFAULTS.items()}
+        self.handlers = handlers or HANDLERS
+        self.db = get_manager(os.path.join(base_dir, "jobs.db"))
+        self._running = {}  # id задач, выполняющихся в этом процессе -> метка захвата
+        self._resumed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._stop = False
+
+    def _create_tables(self, conn):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                db_name TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL CHECK(status IN ({", ".join(f"'{status}'" for status in STATUSES)})),
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL,
+                processed INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                artifact TEXT,
+                claim TEXT
+            )
+        """)
+        # Очередь, созданная до появления меток захвата
+        if "claim" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN claim TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+
+    def _connection(self):
+        self.db.ensure_schema(self._create_tables)
+        return self.db.connection()
+
+    def job_dir(self, job_id):
+        return os.path.join(self.base_dir, job_id)
+
+    def start(self):
+        """Запуск потоков-исполнителей (повторный вызов ничего не делает).
+
+        При JOB_WORKERS=0 потоки не запускаются, задачи выполняются вызовами run_pending().
+        """
+        with self._lock:
+            if self._threads or self._stop or not self.config["JOB_WORKERS"]:
+                return
+            for index in range(self.config["JOB_WORKERS"]):
+                thread = threading.Thread(target=self._work, name=f"job-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def resume(self):
+        """Запуск исполнителей, если очередь уже существует: задачи, оставшиеся
+        с прошлого запуска, выполняются, не дожидаясь новой задачи.
+
+        Вызывается перед запросами; файл очереди проверяется только один раз.
+        """
+        if self._resumed:
+            return
+        self._resumed = True
+        if os.path.exists(self.db.db_name):
+            self.start()
+
+    def shutdown(self, timeout=None):
+        """Остановка: новые задачи не берутся, выполняющиеся вернутся в очередь при следующем запуске"""
+        with self._lock:
+            self._stop = True
+            self._wakeup.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, kind, db_name, params=None, files=None):
+        """Постановка задачи в очередь; files — {имя: поток} для сохранения в каталог задачи.
+
+        Возвращает id задачи сразу, не дожидаясь выполнения.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Неизвестный вид задачи: {kind}")
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        for filename, stream in (files or {}).items():
+            with open(os.path.join(self.job_dir(job_id), filename), "wb") as file:
+                shutil.copyfileobj(stream, file, 1024 * 1024)
+        with self._connection() as conn:
+            conn.execute("""
+                INSERT INTO jobs (id, kind, db_name, params, status, created_at)
+                VALUES (?, ?, ?, ?, 'queued', ?)
+            """, (job_id, kind, db_name, json.dumps(params or {}, ensure_ascii=False), time.time()))
+        self.start()
+        with self._lock:
+            self._wakeup.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """Состояние задачи с долей выполнения и оценкой оставшегося времени; None, если её нет"""
+        with self._connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return self._describe(dict(zip(columns, row))) if row else None
+
+    def list(self, limit=50):
+        with self._connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+            columns = [column[0] for column in cursor.description]
+            return [self._describe(dict(zip(columns, row))) for row in cursor.fetchall()]
+
+    def _describe(self, job):
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = job["eta_seconds"] = None
+        if job["total"]:
+            job["progress"] = min(job["processed"] / job["total"], 1.0)
+        if job["status"] == "running" and job["total"] and job["processed"]:
+            elapsed = time.time() - job["started_at"]
+            job["eta_seconds"] = max(job["total"] - job["processed"], 0) * elapsed / job["processed"]
+        del job["cancel_requested"], job["heartbeat_at"], job["claim"]
+        return job
+
+    def cancel(self, job_id):
+        """Отмена: задача в очереди отменяется сразу, выполняющаяся — при следующей отметке прогресса"""
+        with self._connection() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'cancelled', finished_at = ?
+                WHERE id = ? AND status = 'queued'
+            """, (time.time(), job_id))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def artifact_path(self, job_id):
+        """Файл результата завершённой задачи или None"""
+        job = self.get(job_id)
+        if job is None or job["status"] != "done" or not job["artifact"]:
+            return None
+        return os.path.join(self.job_dir(job_id), job["artifact"])
+
+    def _claim(self):
+        """Атомарный захват самой старой задачи в очереди.
+
+        Захват получает новую метку (claim): прогресс и результат записываются
+        только исполнителем с этой меткой, пока задача выполняется.
+        """
+        now = time.time()
+        with self._connection() as conn:
+            # Задачи процессов, переставших отмечаться, возвращаются в очередь
+            conn.execute("""
+                UPDATE jobs SET status = 'queued', started_at = NULL, claim = NULL
+                WHERE status = 'running' AND heartbeat_at < ?
+            """, (now - self.config["JOB_STALE_SECONDS"],))
+            row = conn.execute("""
+                UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, processed = 0, claim = ?
+                WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1)
+                  AND status = 'queued'
+                RETURNING id, kind, db_name, params, claim
+            """, (now, now, uuid.uuid4().hex)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "db_name": row[2], "params": json.loads(row[3]), "claim": row[4]}
+
+    def _report_progress(self, job, processed, total, now):
+        """Запись прогресса; True, если запрошена отмена или задача больше не принадлежит исполнителю"""
+        with self._connection() as conn:
+            row = conn.execute("""
+                UPDATE jobs SET processed = ?, total = COALESCE(?, total), heartbeat_at = ?
+                WHERE id = ? AND status = 'running' AND claim = ?
+                RETURNING cancel_requested
+            """, (processed, total, now, job["id"], job["claim"])).fetchone()
+        return row is None or bool(row[0])
+
+    def _finish(self, job, status, processed, result=None, error=None, artifact=None):
+        """Запись результата; False, если задачу уже вернули в очередь или отдали другому исполнителю"""
+        with self._connection() as conn:
+            return conn.execute("""
+                UPDATE jobs SET status = ?, finished_at = ?, processed = ?, result = ?, error = ?, artifact = ?
+                WHERE id = ? AND status = 'running' AND claim = ?
+            """, (status, time.time(), processed, json.dumps(result, ensure_ascii=False) if result else None,
+                  error, artifact, job["id"], job["claim"])).rowcount == 1
+
+    def run_pending(self):
+        """Выполнение одной задачи из очереди в текущем потоке; False, если очередь пуста"""
+        job = self._claim()
+        if job is None:
+            return False
+        with self._lock:
+            self._running[job["id"]] = job["claim"]
+        context = JobContext(self, job)
+        try:
+            result, artifact = self.handlers[job["kind"]](job, context)
+        except JobCancelled:
+            self._finish(job, "cancelled", context.processed)
+        except Exception as e:
+            self._finish(job, "failed", context.processed, error=str(e) or type(e).__name__)
+        else:
+            if not self._finish(job, "done", context.total or context.processed, result, artifact=artifact):
+                log.warning("Задача %s выполнена, но уже передана другому исполнителю", job["id"])
+        finally:
+            with self._lock:
+                self._running.pop(job["id"], None)
+        return True
+
+    def cleanup(self):
+        """Удаление завершённых задач старше JOB_RETENTION_SECONDS вместе с их файлами"""
+        cutoff = time.time() - self.config["JOB_RETENTION_SECONDS"]
+        with self._connection() as conn:
+            expired = [row[0] for row in conn.execute(f"""
+                SELECT id FROM jobs
+                WHERE status IN ({", ".join("?" * len(FINISHED))}) AND finished_at < ?
+            """, (*FINISHED, cutoff))]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return expired
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if self._stop:
+                    return
+            try:
+                if self.run_pending():
+                    continue
+                self.cleanup()
+            except Exception:
+                # Ошибка самой очереди (например, база занята) не должна останавливать исполнителя
+                log.exception("Ошибка очереди задач")
+            with self._lock:
+                if not self._stop:
+                    self._wakeup.wait(self.config["JOB_HEARTBEAT_SECONDS"])
+
+    def _heartbeat(self):
+        while True:
+            with self._lock:
+                if self._stop:
+                    return
+                self._wakeup.wait(self.config["JOB_HEARTBEAT_SECONDS"])
+                running = list(self._running.items())
+            if not running:
+                continue
+            try:
+                with self._connection() as conn:
+                    conn.executemany("""
+                        UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running' AND claim = ?
+                    """, [(time.time(), job_id, claim) for job_id, claim in running])
+            except Exception:
+                # Пропущенная отметка (например, база занята) повторится на следующем шаге
+                log.exception("Ошибка отметки выполняющихся задач")
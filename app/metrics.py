@@ -0,0 +1,216 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм длительности (секунды) и числа строк
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 1000, 10000, 100000, 1000000)
+
+slow_query_log = logging.getLogger("app.sql.slow")
+
+# Настройки, задаваемые из конфигурации приложения (см. configure)
+settings = {"enabled": True, "slow_query_seconds": None}
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с произвольными метками"""
+
+    def __init__(self, name, help_text, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            base = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(base, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(base, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_labels(base)} {total}")
+            lines.append(f"{self.name}_count{_labels(base)} {count}")
+        return "\n".join(lines)
+
+
+def _labels(base, le=None):
+    pairs = base + [f'le="{le}"'] if le is not None else base
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                             ("method", "endpoint", "status"))
+SQL_DURATION = Histogram("sql_query_duration_seconds", "Время выполнения SQL-запроса",
+                         ("statement", "table"))
+SQL_ROWS = Histogram("sql_query_rows", "Число строк, возвращённых или изменённых SQL-запросом",
+                     ("statement", "table"), buckets=ROW_BUCKETS)
+CHART_DURATION = Histogram("chart_render_duration_seconds", "Время построения графика", ("chart",))
+TEMPLATE_DURATION = Histogram("template_render_duration_seconds", "Время рендеринга шаблона", ("template",))
+
+HISTOGRAMS = (REQUEST_DURATION, SQL_DURATION, SQL_ROWS, CHART_DURATION, TEMPLATE_DURATION)
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+
+
+def _statement_labels(sql):
+    """Метки запроса: вид (select, insert, ...) и первая упомянутая таблица"""
+    words = sql.split(None, 1)
+    statement = words[0].lower() if words else "other"
+    match = _TABLE.search(sql)
+    return statement, match.group(1).lower() if match else ""
+
+
+def configure(config):
+    """Применение настроек METRICS_ENABLED и SLOW_QUERY_MS из конфигурации приложения"""
+    settings["enabled"] = config.get("METRICS_ENABLED", True)
+    slow_query_ms = config.get("SLOW_QUERY_MS")
+    settings["slow_query_seconds"] = slow_query_ms / 1000 if slow_query_ms is not None else None
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время и число строк запроса.
+
+    Время складывается из execute и вызовов fetchall/fetchmany — без обработки
+    строк вызывающим кодом; строки считаются по этим же вызовам. Построчные
+    вызовы (итерация, fetchone) не перехватываются, чтобы не добавлять вызов
+    Python на каждую строку больших выборок: их строки в SQL_ROWS не попадают.
+    """
+
+    _sql = None
+    _elapsed = 0.0
+    _rows = 0
+
+    def _begin(self, sql):
+        self._finish()
+        self._sql = sql
+        self._rows = 0
+        self._elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        duration = self._elapsed
+        labels = _statement_labels(self._sql)
+        rows = self._rows if labels[0] in ("select", "with", "pragma") else max(self.rowcount, 0)
+        SQL_DURATION.observe(duration, *labels)
+        SQL_ROWS.observe(rows, *labels)
+        threshold = settings["slow_query_seconds"]
+        if threshold is not None and duration >= threshold:
+            slow_query_log.warning("Медленный запрос (%.1f мс, строк: %d): %s",
+                                   duration * 1000, rows, " ".join(self._sql.split()))
+        self._sql = None
+
+    def execute(self, sql, parameters=()):
+        if not settings["enabled"]:
+            return super().execute(sql, parameters)
+        self._begin(sql)
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._elapsed += time.perf_counter() - started
+        if self.description is None:  # Запрос без результата — завершён сразу
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not settings["enabled"]:
+            return super().executemany(sql, seq_of_parameters)
+        self._begin(sql)
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._elapsed += time.perf_counter() - started
+        self._finish()
+        return self
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone() не дочитывает результат — учитываем запрос при удалении курсора
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, создающее InstrumentedCursor (в том числе для conn.execute)"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_stats_lines():
+    """Счётчики пулов соединений в формате Prometheus"""
+    from .db import _managers, _managers_lock
+    with _managers_lock:
+        managers = list(_managers.values())
+    lines = ["# HELP db_connections_total Операции пула соединений SQLite",
+             "# TYPE db_connections_total counter"]
+    for manager in managers:
+        stats = manager.get_stats()
+        for event in ("opened", "reused", "closed"):
+            lines.append(f'db_connections_total{{db="{_escape(manager.db_name)}",event="{event}"}} {stats[event]}')
+    return lines
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    parts = [histogram.render() for histogram in HISTOGRAMS]
+    parts.append("\n".join(connection_stats_lines()))
+    return "\n".join(parts) + "\n"
@@ -0,0 +1,340 @@
+# Версионированные изменения схемы. Номер применённой миграции хранится
+# в PRAGMA user_version, каждая миграция выполняется ровно один раз.
+# Новая база создаётся исходной схемой (версия 0) и проходит все миграции
+# по порядку, так же как база, созданная старой версией приложения.
+import logging
+from calendar import timegm
+from datetime import datetime
+from . import aggregates
+from .utils import format_date, to_minor_units, to_timestamp
+
+log = logging.getLogger("app.migrations")
+
+OPERATION_TYPES_CHECK = "operation_type IN ('доход', 'расход')"
+
+
+def _baseline(conn):
+    """Исходная схема: категории, операции (REAL/TEXT) и счётчик версии данных"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            type TEXT NOT NULL CHECK(type IN ('доход', 'расход'))
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS operations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            amount REAL NOT NULL,
+            category_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            operation_type TEXT NOT NULL,
+            comment TEXT,
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    """)
+    # Счётчик версии данных: увеличивается при любой записи в operations или categories
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+
+def _listing_indexes(conn):
+    """Индексы для постраничного просмотра операций с фильтрами"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_date_id ON operations (date, id)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_operations_category_date
+        ON operations (category_id, date, id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_operations_type_date
+        ON operations (operation_type, date, id)
+    """)
+
+
+# Сколько последних записей журнала изменений хранить; снимок, отставший сильнее,
+# перечитывает операции целиком
+CHANGELOG_KEEP = 10000
+
+
+def _operations_changelog(conn):
+    """Журнал изменений и удалений операций для инкрементального обновления снимков"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS operations_changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK(kind IN ('update', 'delete'))
+        )
+    """)
+    for kind, event in (("update", "UPDATE"), ("delete", "DELETE")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS operations_changelog_{kind}
+            AFTER {event} ON operations
+            BEGIN
+                INSERT INTO operations_changelog (operation_id, kind) VALUES (old.id, '{kind}');
+                DELETE FROM operations_changelog
+                WHERE seq <= (SELECT MAX(seq) FROM operations_changelog) - {CHANGELOG_KEEP};
+            END
+        """)
+
+
+# Форматы дат, встречающиеся в базах старых версий, кроме основного YYYY-MM-DDTHH:MM
+LEGACY_DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d",
+                       "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+
+def _legacy_timestamp(value):
+    """Дата из базы старой версии в секунды от начала эпохи (UTC); ValueError, если не разобрать"""
+    text = str(value if value is not None else "").strip()
+    try:
+        return to_timestamp(format_date(text))
+    except ValueError:
+        pass
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            return timegm(datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата: {value!r}")
+
+
+def _convert_legacy_operation(row):
+    """Строка operations старой схемы в строку новой; ValueError с причиной, если не привести"""
+    operation_id, amount, category_id, date, operation_type, comment = row
+    if amount is None:
+        raise ValueError("Не указана сумма")
+    amount = to_minor_units(amount)
+    if amount <= 0:
+        raise ValueError(f"Сумма должна быть положительной: {row[1]!r}")
+    if category_id is None:
+        raise ValueError("Не указана категория")
+    operation_type = str(operation_type or "").strip().lower()
+    if operation_type not in ("доход", "расход"):
+        raise ValueError(f"Неизвестный тип операции: {row[4]!r}")
+    return operation_id, amount, category_id, _legacy_timestamp(date), operation_type, comment
+
+
+def _integer_amounts_and_dates(conn):
+    """Суммы в копейках (INTEGER), даты в секундах от начала эпохи (INTEGER),
+    ограничения CHECK на сумму и тип операции; агрегаты пересчитываются в копейках.
+
+    Тип операции приводится к нижнему регистру без пробелов, даты разбираются
+    и в форматах старых версий. Строки, которые привести не удалось,
+    сохраняются в operations_rejected с причиной.
+    """
+    conn.execute(f"""
+        CREATE TABLE operations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            amount INTEGER NOT NULL CHECK(amount > 0),
+            category_id INTEGER NOT NULL,
+            date INTEGER NOT NULL,
+            operation_type TEXT NOT NULL CHECK({OPERATION_TYPES_CHECK}),
+            comment TEXT,
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    """)
+    # Строки, которые не удалось привести к новым ограничениям, переносятся
+    # в operations_rejected с причиной, а не прерывают миграцию
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS operations_rejected (
+            id INTEGER PRIMARY KEY,
+            amount,
+            category_id,
+            date,
+            operation_type,
+            comment,
+            reason TEXT NOT NULL
+        )
+    """)
+    cursor = conn.execute("SELECT id, amount, category_id, date, operation_type, comment FROM operations")
+    rejected = 0
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        converted, failed = [], []
+        for row in rows:
+            try:
+                converted.append(_convert_legacy_operation(row))
+            except ValueError as e:
+                failed.append(row + (str(e),))
+        conn.executemany("""
+            INSERT INTO operations_new (id, amount, category_id, date, operation_type, comment)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, converted)
+        conn.executemany("""
+            INSERT INTO operations_rejected (id, amount, category_id, date, operation_type, comment, reason)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, failed)
+        rejected += len(failed)
+    if rejected:
+        # id отклонённых строк не выдаются новым операциям
+        last_id = conn.execute("SELECT MAX(id) FROM operations").fetchone()[0]
+        if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'operations_new'",
+                            (last_id,)).rowcount:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('operations_new', ?)", (last_id,))
+        log.warning("Миграция операций: %d строк не приведены к новой схеме и перенесены "
+                    "в operations_rejected", rejected)
+    conn.execute("DROP TABLE operations")  # Вместе с индексами и триггерами
+    conn.execute("ALTER TABLE operations_new RENAME TO operations")
+    _listing_indexes(conn)
+    _operations_changelog(conn)
+    for table in ("agg_balance", "agg_category_totals", "agg_daily", "agg_monthly"):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    aggregates.create_tables(conn)
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+
+def _ingest_batches(conn):
+    """Ключи идемпотентности пачек операций, загруженных через JSON API"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_batches (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            response TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_batches_created_at ON ingest_batches (created_at)")
+
+
+def _top_amount_index(conn):
+    """Индекс для выборки крупнейших операций каждого типа без сортировки таблицы"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_type_amount ON operations (operation_type, amount)")
+
+
+def _operations_search(conn):
+    """Полнотекстовый индекс FTS5 по комментариям операций и названиям их категорий.
+
+    rowid записи индекса — id операции. Индекс поддерживается триггерами на
+    operations (в том числе при пакетной загрузке) и на переименование категорий.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS operations_fts USING fts5(
+            comment, category, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    category_name = "(SELECT name FROM categories WHERE id = new.category_id)"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS operations_fts_insert
+        AFTER INSERT ON operations
+        BEGIN
+            INSERT INTO operations_fts (rowid, comment, category) VALUES (new.id, new.comment, {category_name});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS operations_fts_update
+        AFTER UPDATE OF comment, category_id ON operations
+        BEGIN
+            DELETE FROM operations_fts WHERE rowid = old.id;
+            INSERT INTO operations_fts (rowid, comment, category) VALUES (new.id, new.comment, {category_name});
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS operations_fts_delete
+        AFTER DELETE ON operations
+        BEGIN
+            DELETE FROM operations_fts WHERE rowid = old.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS operations_fts_category_rename
+        AFTER UPDATE OF name ON categories
+        BEGIN
+            UPDATE operations_fts SET category = new.name
+            WHERE rowid IN (SELECT id FROM operations WHERE category_id = new.id);
+        END
+    """)
+    conn.execute("""
+        INSERT INTO operations_fts (rowid, comment, category)
+        SELECT o.id, o.comment, c.name FROM operations o LEFT JOIN categories c ON o.category_id = c.id
+    """)
+
+
+def _archives(conn):
+    """Реестр архивов закрытых лет и запрет записи операций в закрытые годы.
+
+    until — начало года, следующего за архивным (секунды от начала эпохи):
+    операции с более ранней датой хранятся только в архивах.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archives (
+            year INTEGER PRIMARY KEY,
+            filename TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            income INTEGER NOT NULL,
+            expense INTEGER NOT NULL,
+            until INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL
+        )
+    """)
+    for event in ("INSERT", "UPDATE OF date"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS operations_closed_year_{event.split()[0].lower()}
+            BEFORE {event} ON operations
+            WHEN new.date < (SELECT MAX(until) FROM archives)
+            BEGIN
+                SELECT RAISE(ABORT, 'Год операции закрыт и перенесён в архив');
+            END
+        """)
+
+
+def _budgets(conn):
+    """Месячные бюджеты расходов по категориям (копейки) для предупреждений о перерасходе"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS budgets (
+            category_id INTEGER PRIMARY KEY,
+            monthly_limit INTEGER NOT NULL CHECK(monthly_limit > 0),
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    """)
+
+
+def _drop_time_aggregates(conn):
+    """Итоги по дням и месяцам больше не ведутся: графики по времени строятся по снимку"""
+    conn.execute("DROP TABLE IF EXISTS agg_daily")
+    conn.execute("DROP TABLE IF EXISTS agg_monthly")
+
+
+MIGRATIONS = (
+    (1, "Индексы для постраничного просмотра операций", _listing_indexes),
+    (2, "Журнал изменений операций", _operations_changelog),
+    (3, "Целочисленные суммы (копейки) и даты (секунды от начала эпохи)", _integer_amounts_and_dates),
+    (4, "Ключи идемпотентности пакетной загрузки", _ingest_batches),
+    (5, "Индекс для топ-N операций", _top_amount_index),
+    (6, "Полнотекстовый поиск по операциям", _operations_search),
+    (7, "Архивы закрытых лет", _archives),
+    (8, "Месячные бюджеты категорий", _budgets),
+    (9, "Удаление неиспользуемых агрегатов по дням и месяцам", _drop_time_aggregates),
+)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Применение всех ещё не выполненных миграций в одной транзакции.
+
+    Транзакция открывается с блокировкой записи (BEGIN IMMEDIATE), и версия
+    перечитывается уже под ней: процесс, запущенный одновременно с другим,
+    дождётся его миграций и не применит их повторно.
+    """
+    if get_version(conn) >= MIGRATIONS[-1][0]:
+        return []
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    current = get_version(conn)
+    pending = [migration for migration in MIGRATIONS if migration[0] > current]
+    if not pending:
+        return []
+    if current == 0:
+        _baseline(conn)
+    for version, _, apply in pending:
+        apply(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+    return [(version, description) for version, description, _ in pending]
@@ -0,0 +1,73 @@
+import threading
+import time
+from flask import Response, g, jsonify, request, template_rendered, before_render_template
+from . import metrics
+from .profiler import SamplingProfiler
+
+_template_starts = threading.local()
+
+
+def init_monitoring(app):
+    """Замер времени запросов и шаблонов, эндпоинты /metrics и /metrics/profile"""
+    metrics.configure(app.config)
+    profiler = SamplingProfiler(interval=app.config.get("PROFILER_INTERVAL", 0.005))
+    app.extensions["profiler"] = profiler
+    if app.config.get("PROFILER_ENABLED"):
+        profiler.start()
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        if profiler.running:
+            profiler.enter(request.endpoint or "unknown")
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is not None and metrics.settings["enabled"]:
+            metrics.REQUEST_DURATION.observe(time.perf_counter() - started, request.method,
+                                             request.endpoint or "unknown", response.status_code)
+        return response
+
+    @app.teardown_request
+    def leave_profiler(exc):
+        profiler.leave()
+
+    def template_started(sender, template, context, **extra):
+        stack = getattr(_template_starts, "stack", None)
+        if stack is None:
+            stack = _template_starts.stack = []
+        stack.append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        stack = getattr(_template_starts, "stack", None)
+        if stack and metrics.settings["enabled"]:
+            metrics.TEMPLATE_DURATION.observe(time.perf_counter() - stack.pop(), template.name or "")
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.route("/metrics")
+    def show_metrics():
+        return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    # Сэмплирующий профилировщик: GET — свёрнутые стеки (?route=...), POST action=start|stop|reset
+    # (только при PROFILER_CONTROL: профилировщик замедляет все запросы)
+    @app.route("/metrics/profile", methods=["GET", "POST"])
+    def profile():
+        if request.method == "POST":
+            if not app.config.get("PROFILER_CONTROL"):
+                return "Управление профилировщиком отключено (PROFILER_CONTROL)", 403
+            action = request.values.get("action")
+            if action == "start":
+                profiler.start()
+            elif action == "stop":
+                profiler.stop()
+            elif action == "reset":
+                profiler.reset()
+            else:
+                return "Неизвестное действие", 400
+            return jsonify(running=profiler.running, routes=profiler.routes())
+        if request.args.get("format") == "json":
+            return jsonify(running=profiler.running, routes=profiler.routes())
+        return Response(profiler.dump(request.args.get("route")), mimetype="text/plain")
@@ -0,0 +1,81 @@
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик: периодически снимает стеки потоков,
+    обрабатывающих запросы, и копит их в свёрнутом формате (folded stacks)
+    отдельно для каждого маршрута. Результат подходит для flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._routes = {}  # id потока -> маршрут текущего запроса
+        self._stacks = {}  # маршрут -> Counter свёрнутых стеков
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def enter(self, route):
+        """Отметка: текущий поток начал обработку запроса route"""
+        self._routes[threading.get_ident()] = route
+
+    def leave(self):
+        self._routes.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, route in list(self._routes.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                folded = ";".join(reversed(stack))
+                with self._lock:
+                    self._stacks.setdefault(route, Counter())[folded] += 1
+
+    def dump(self, route=None):
+        """Свёрнутые стеки («стек число» построчно) для маршрута или для всех маршрутов"""
+        with self._lock:
+            stacks = {name: Counter(counter) for name, counter in self._stacks.items()}
+        lines = []
+        for name, counter in sorted(stacks.items()):
+            if route is not None and name != route:
+                continue
+            for stack, count in counter.most_common():
+                lines.append(f"{name};{stack} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def routes(self):
+        with self._lock:
+            return {name: sum(counter.values()) for name, counter in self._stacks.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
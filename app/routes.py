@@ -1,20 +1,108 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, abort, Response, stream_with_context, g
+from markupsafe import Markup, escape
+from werkzeug.local import LocalProxy
 from .utils import validate_amount, format_date
+import functools
+import gzip
+import io
+import json
 import os
-from app.storage import Storage
-from app.analysis import FinancialAnalysis
+from app.storage import MATCH_END, MATCH_START, Storage
+from app.analysis import FinancialAnalysis, CHARTS, CHART_DATA
+from app.charts import ChartCache
+from app.exporter import EXPORT_FORMATS, stream_export
+from app.importer import IdempotencyConflict
+from app.jobs import FINISHED
+from app.serving import Busy
+from app.shards import ShardRouter, merge_partials, shard_partial
+
+OPERATIONS_PAGE_SIZE = 50
+
+# Ответы JSON меньше этого размера не сжимаются: выигрыш меньше накладных расходов gzip
+GZIP_MIN_BYTES = 512
+
+
+def parse_operation_filters(args):
+    """Фильтры списка операций из параметров запроса"""
+    def number(name, convert):
+        value = args.get(name, "").strip()
+        if not value:
+            return None
+        try:
+            return convert(value)
+        except ValueError:
+            raise ValueError(f"Некорректное значение параметра {name}.")
+
+    return {
+        "date_from": args.get("date_from", "").strip() or None,
+        "date_to": args.get("date_to", "").strip() or None,
+        "category_id": number("category_id", int),
+        "operation_type": args.get("operation_type", "").strip() or None,
+        "amount_min": number("amount_min", float),
+        "amount_max": number("amount_max", float),
+    }
+
 
 def init_routes(app):
-    storage = Storage()
-    analysis = FinancialAnalysis()
+    router = ShardRouter(app.config["SHARDS_DIR"])
+
+    # База по умолчанию открывается (и её схема создаётся) при первом запросе, а не при запуске
+    @functools.lru_cache(maxsize=None)
+    def default_storage():
+        return Storage(app.config["DATABASE"])
+
+    @functools.lru_cache(maxsize=None)
+    def default_analysis(include_archive):
+        return FinancialAnalysis(default_storage().db_name, include_archive)
+
+    def with_archive():
+        """Анализ вместе с архивами закрытых лет (?archive=1)"""
+        return request.args.get("archive") == "1"
+
+    # Хранилище и анализ базы объекта из URL (/p/<property_id>/...) или базы по умолчанию
+    storage = LocalProxy(lambda: router.storage(g.property_id) if g.get("property_id") else default_storage())
+    analysis = LocalProxy(lambda: router.analysis(g.property_id, with_archive()) if g.get("property_id")
+                          else default_analysis(with_archive()))
+    executors = app.extensions["executors"]
+    # Фоновое перестроение графиков идёт в пуле потоков приложения и останавливается вместе с ним
+    chart_cache = ChartCache(executors.workers, max_bytes=app.config.get("CHART_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+    def route(rule, **options):
+        """Маршрут для базы по умолчанию и для базы объекта недвижимости (/p/<property_id>/...)"""
+        def decorator(view):
+            app.route(rule, **options)(view)
+            return app.route(f"/p/<property_id>{rule}", **options)(view)
+        return decorator
+
+    @app.url_value_preprocessor
+    def pull_property_id(endpoint, values):
+        g.property_id = values.pop("property_id", None) if values else None
+        if g.property_id is not None:
+            # Базы объектов создаются только явно (flask property create), не запросами
+            try:
+                if not router.exists(g.property_id):
+                    abort(404)
+            except ValueError:
+                abort(404)
 
-    @app.route("/")
+    @app.url_defaults
+    def add_property_id(endpoint, values):
+        # url_for внутри страницы объекта ведёт на страницы того же объекта
+        if g.get("property_id") and "property_id" not in values \
+                and app.url_map.is_endpoint_expecting(endpoint, "property_id"):
+            values["property_id"] = g.property_id
+
+    @app.errorhandler(Busy)
+    def busy(e):
+        return "Сервер занят, повторите запрос позже", 503, {"Retry-After": "5"}
+
+    @route("/")
     def index():
         balance = analysis.get_balance()
         operations = storage.get_operations()
         return render_template("index.html", balance=balance, operations=operations)
 
-    @app.route("/add_operation", methods=["GET", "POST"])
+    @route("/add_operation", methods=["GET", "POST"])
     def add_operation():
         if request.method == "POST":
             try:
@@ -29,24 +117,77 @@ def init_routes(app):
                 return str(e), 400  # Возвращаем ошибку, если дата некорректна
             operation_type = request.form["operation_type"]
             comment = request.form["comment"]
-            storage.add_operation({
-                "amount": amount,
-                "category_id": category_id,
-                "date": date,
-                "operation_type": operation_type,
-                "comment": comment
-            })
+            try:
+                storage.add_operation({
+                    "amount": amount,
+                    "category_id": category_id,
+                    "date": date,
+                    "operation_type": operation_type,
+                    "comment": comment
+                })
+            except ValueError as e:
+                return str(e), 400  # Например, год операции уже закрыт
             return redirect(url_for("index"))
         income_categories = storage.get_categories(category_type="доход")
         expense_categories = storage.get_categories(category_type="расход")
         return render_template("add_operation.html", income_categories=income_categories, expense_categories=expense_categories)
 
-    @app.route("/view_operations")
+    @route("/view_operations")
     def view_operations():
-        operations = storage.get_operations(limit=2000)
-        return render_template("view_operations.html", operations=operations)
+        try:
+            filters = parse_operation_filters(request.args)
+            operations, next_cursor = storage.list_operations(
+                filters, cursor=request.args.get("cursor"), limit=OPERATIONS_PAGE_SIZE
+            )
+        except ValueError as e:
+            return str(e), 400
+        return render_template("view_operations.html",
+                               operations=operations,
+                               next_cursor=next_cursor,
+                               filters=request.args,
+                               categories=storage.get_categories())
+
+    def search_page():
+        """Страница результатов поиска (с 1), размер страницы и фильтры из параметров запроса"""
+        page = max(request.args.get("page", 1, type=int), 1)
+        limit = min(max(request.args.get("limit", OPERATIONS_PAGE_SIZE, type=int), 1), 200)
+        results, has_next = storage.search_operations(
+            request.args.get("q", ""), parse_operation_filters(request.args), limit=limit, offset=(page - 1) * limit)
+        return page, results, has_next
+
+    # Полнотекстовый поиск по комментариям и категориям: ранжированные результаты постранично
+    @route("/api/operations/search")
+    def search_operations_api():
+        try:
+            page, results, has_next = search_page()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            "query": request.args.get("q", ""),
+            "page": page,
+            "next_page": page + 1 if has_next else None,
+            "results": [{
+                "id": row[0], "amount": row[1], "category": row[2], "date": row[3],
+                "operation_type": row[4], "comment": row[5],
+                "snippet": row[6].replace(MATCH_START, "").replace(MATCH_END, ""),
+            } for row in results],
+        })
+
+    @route("/search_operations")
+    def search_operations():
+        try:
+            page, results, has_next = search_page()
+        except ValueError as e:
+            return str(e), 400
+        return render_template("search_operations.html", results=results, page=page, has_next=has_next,
+                               filters=request.args)
 
-    @app.route("/categories", methods=["GET", "POST"])
+    @app.template_filter("highlight")
+    def highlight(snippet):
+        """Фрагмент результата поиска с найденными словами в <mark>; остальной текст экранируется"""
+        return escape(snippet).replace(MATCH_START, Markup("<mark>")).replace(MATCH_END, Markup("</mark>"))
+
+    @route("/categories", methods=["GET", "POST"])
     def categories():
         if request.method == "POST":
             if "add" in request.form:
@@ -62,8 +203,15 @@ def init_routes(app):
         categories = storage.get_categories()
         return render_template("categories.html", categories=categories)
 
+    def import_response(result, endpoint):
+        """Итог загрузки: JSON для API-клиентов, иначе сообщение и редирект"""
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(result.to_dict())
+        flash(str(result), "warning" if result.rejected else "success")
+        return redirect(url_for(endpoint))
+
     # Загрузка категорий из CSV
-    @app.route("/load_categories_csv", methods=["POST"])
+    @route("/load_categories_csv", methods=["POST"])
     def load_categories_csv():
         if "file" not in request.files:
             return "Файл не найден", 400
@@ -71,23 +219,22 @@ def init_routes(app):
         if file.filename == "":
             return "Файл не выбран", 400
         if file and file.filename.endswith(".csv"):
-            # Сохраняем файл на диск
-            file_path = os.path.join(app.static_folder, "uploaded_categories.csv")
-            file.save(file_path)
-            # Передаем путь к файлу в функцию
-            storage.load_categories_from_csv(file_path)
-            return redirect(url_for("categories"))
+            # Разбираем файл прямо из потока запроса
+            stream = io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+            with executors.heavy_slot():
+                result = storage.import_categories(stream)
+            return import_response(result, "categories")
         return "Некорректный формат файла", 400
 
     # Выгрузка категорий в CSV
-    @app.route("/export_categories_csv")
+    @route("/export_categories_csv")
     def export_categories_csv():
         file_path = os.path.join(app.static_folder, "categories_export.csv")
         storage.export_categories_to_csv(file_path)
         return send_file(file_path, as_attachment=True)
 
     # Загрузка операций из CSV
-    @app.route("/load_operations_csv", methods=["POST"])
+    @route("/load_operations_csv", methods=["POST"])
     def load_operations_csv():
         if "file" not in request.files:
             return "Файл не найден", 400
@@ -95,31 +242,253 @@ def init_routes(app):
         if file.filename == "":
             return "Файл не выбран", 400
         if file and file.filename.endswith(".csv"):
-            # Вариант 1: Передача данных из памяти
-            #data = file.read().decode("utf-8")
-            #storage.load_operations_from_csv(data)
-            # Вариант 2: Сохранение файла на диск
-            file_path = os.path.join(app.static_folder, "uploaded_operations.csv")
-            file.save(file_path)
-            storage.load_operations_from_csv(file_path)
-            return redirect(url_for("index"))
+            # Разбираем файл прямо из потока запроса, без сохранения на диск
+            stream = io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+            with executors.heavy_slot():
+                result = storage.import_operations(stream)
+            return import_response(result, "index")
         return "Некорректный формат файла", 400
 
-    # Выгрузка операций в CSV
-    @app.route("/export_operations_csv")
+    # Пакетная загрузка операций в JSON: массив операций или {"operations": [...]}
+    @route("/api/operations/batch", methods=["POST"])
+    def ingest_operations():
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get("operations")
+        if not isinstance(payload, list):
+            return jsonify({"error": "Ожидается массив операций"}), 400
+        max_items = app.config.get("INGEST_MAX_ITEMS", 10000)
+        if len(payload) > max_items:
+            return jsonify({"error": f"Не больше {max_items} операций за запрос"}), 413
+        key = request.headers.get("Idempotency-Key") or None
+        if key is not None and len(key) > 255:
+            return jsonify({"error": "Слишком длинный ключ идемпотентности"}), 400
+        try:
+            with executors.heavy_slot():
+                result, replayed = storage.ingest_operations(
+                    payload, key, key_ttl=app.config.get("IDEMPOTENCY_KEY_TTL", 86400))
+        except IdempotencyConflict:
+            return jsonify({"error": "Ключ идемпотентности уже использован для другого запроса"}), 409
+        if result["rejected"]:
+            return jsonify(result), 422
+        return jsonify(result), 200 if replayed else 201, {"Idempotent-Replayed": str(replayed).lower()}
+
+    # Потоковая выгрузка операций (CSV, Arrow IPC или Parquet) без временных файлов
+    @route("/export_operations_csv")
     def export_operations_csv():
-        file_path = os.path.join(app.static_folder, "operations_export.csv")
-        storage.export_operations_to_csv(file_path)
-        return send_file(file_path, as_attachment=True)
+        export_format = request.args.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return "Неизвестный формат выгрузки", 400
+        try:
+            filters = parse_operation_filters(request.args)
+            chunks = storage.iter_operation_chunks(filters, include_archive=request.args.get("archive") == "1")
+            content = stream_export(chunks, export_format)
+        except (ValueError, RuntimeError) as e:
+            return str(e), 400
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        return Response(stream_with_context(content), mimetype=mimetype, headers={
+            "Content-Disposition": f"attachment; filename=operations.{extension}",
+        })
 
-    @app.route("/analysis")
+    # Фоновые задачи: загрузка, выгрузка и отчёт выполняются в очереди, клиент опрашивает состояние
+    jobs = app.extensions["jobs"]
+
+    def job_submitted(job_id):
+        """202 с адресом состояния для API-клиентов, иначе переход на страницу задачи"""
+        status_url = url_for("job_status", job_id=job_id)
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify({"id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+        return redirect(status_url)
+
+    def job_json(job):
+        job = dict(job)
+        del job["db_name"]
+        artifact = job.pop("artifact")
+        job["artifact_url"] = url_for("job_artifact", job_id=job["id"]) if artifact and job["status"] == "done" else None
+        return job
+
+    @route("/jobs/import_operations", methods=["POST"])
+    def submit_import_operations():
+        if "file" not in request.files:
+            return "Файл не найден", 400
+        file = request.files["file"]
+        if file.filename == "":
+            return "Файл не выбран", 400
+        if not file.filename.endswith(".csv"):
+            return "Некорректный формат файла", 400
+        # Файл сохраняется в каталог задачи и разбирается исполнителем
+        job_id = jobs.submit("import_operations", storage.db_name, {"filename": "operations.csv"},
+                             files={"operations.csv": file.stream})
+        return job_submitted(job_id)
+
+    @route("/jobs/export_operations", methods=["POST"])
+    def submit_export_operations():
+        export_format = request.values.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return "Неизвестный формат выгрузки", 400
+        try:
+            filters = parse_operation_filters(request.values)
+        except ValueError as e:
+            return str(e), 400
+        job_id = jobs.submit("export_operations", storage.db_name, {
+            "filters": filters, "format": export_format, "archive": request.values.get("archive") == "1"})
+        return job_submitted(job_id)
+
+    @route("/jobs/report", methods=["POST"])
+    def submit_report():
+        return job_submitted(jobs.submit("report", analysis.db_name))
+
+    @app.route("/jobs")
+    def list_jobs():
+        recent = [job_json(job) for job in jobs.list()]
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(recent)
+        return render_template("jobs.html", jobs=recent)
+
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            abort(404)
+        job = job_json(job)
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(job)
+        return render_template("job.html", job=job, finished=job["status"] in FINISHED)
+
+    @app.route("/jobs/<job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        job = jobs.cancel(job_id)
+        if job is None:
+            abort(404)
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(job_json(job))
+        return redirect(url_for("job_status", job_id=job_id))
+
+    @app.route("/jobs/<job_id>/artifact")
+    def job_artifact(job_id):
+        path = jobs.artifact_path(job_id)
+        if path is None:
+            abort(404)
+        return send_file(os.path.abspath(path), as_attachment=True)
+
+    # Архивы закрытых лет: итоги читаются из предрасчитанных таблиц архивов
+    @route("/archive")
+    def archives():
+        years = storage.get_archives()
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(years)
+        return render_template("archive.html", archives=years, report=None)
+
+    @route("/archive/<int:year>")
+    def archive_report(year):
+        report = storage.get_archive_report(year)
+        if report is None:
+            abort(404)
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(report)
+        return render_template("archive.html", archives=storage.get_archives(), report=report)
+
+    @route("/analysis")
     def show_analysis():
-        expenses_chart = analysis.plot_expenses_by_category()
-        incomes_chart = analysis.plot_incomes_by_category()
-        top_expenses_incomes_chart = analysis.plot_top_expenses_and_incomes()
-        income_vs_expenses_chart = analysis.plot_income_vs_expenses()
-        return render_template("analysis.html", 
-                           expenses_chart=expenses_chart, 
-                           incomes_chart=incomes_chart,
-                           top_expenses_incomes_chart=top_expenses_incomes_chart,
-                           income_vs_expenses_chart=income_vs_expenses_chart)
\ No newline at end of file
+        # По умолчанию графики рисуются в браузере по JSON; render=png — готовые изображения
+        render = "png" if request.args.get("render") == "png" else "client"
+        # archive=1 — графики по всей истории, вместе с архивами закрытых лет
+        archive = 1 if with_archive() else None
+        return render_template("analysis.html", version=storage.get_data_version(), render=render,
+                               archived=bool(storage.get_archives()), archive=archive)
+
+    # Аномальные расходы и перерасход месячных бюджетов. Детектор общий для базы
+    # и после добавления операций пересчитывает только затронутые категории.
+    def anomaly_report():
+        from app.anomalies import get_detector
+        detector = get_detector(analysis.db_name, app.config)
+        month = request.args.get("month", "").strip() or None
+        try:
+            limit = int(request.args.get("limit", 50))
+        except ValueError:
+            raise ValueError("Некорректное значение параметра limit.")
+        return {
+            "outliers": detector.outliers(limit=max(1, min(limit, 500))),
+            "budgets": detector.budget_overruns(storage.get_budgets(), month=month),
+        }
+
+    @route("/anomalies")
+    def anomalies():
+        try:
+            report = anomaly_report()
+        except ValueError as e:
+            return str(e), 400
+        return render_template("anomalies.html", report=report,
+                               categories=storage.get_categories(category_type="расход"))
+
+    @route("/api/anomalies")
+    def anomalies_api():
+        try:
+            return jsonify(anomaly_report())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @route("/anomalies/budgets", methods=["POST"])
+    def set_budget():
+        try:
+            category_id = int(request.form["category_id"])
+            limit = float(request.form.get("monthly_limit") or 0)
+            storage.set_budget(category_id, limit)
+        except ValueError as e:
+            return str(e), 400
+        return redirect(url_for("anomalies"))
+
+    def compressed_json(payload):
+        """JSON-ответ, сжатый gzip, если клиент это принимает"""
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        response = Response(body, mimetype="application/json")
+        if len(body) >= GZIP_MIN_BYTES and request.accept_encodings["gzip"]:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.content_encoding = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    # Данные графиков для отрисовки в браузере: только агрегация по снимку, без matplotlib.
+    # ETag — версия данных, поэтому повторный запрос без изменений получает 304 без расчёта.
+    @route("/api/charts/<name>")
+    def chart_data(name):
+        if name not in CHART_DATA:
+            abort(404)
+        etag = f"{name}-{'archive-' if with_archive() else ''}{storage.get_data_version()}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.vary.add("Accept-Encoding")
+        else:
+            response = compressed_json(analysis.chart_data(name))
+        response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True
+        return response
+
+    # Графики отдаются отдельными кэшируемыми изображениями
+    @route("/charts/<name>.png")
+    def chart_image(name):
+        if name not in CHARTS:
+            abort(404)
+        db_name = analysis.db_name  # Перерисовка может идти в фоне, вне контекста запроса
+        include_archive = with_archive()
+        entry = chart_cache.get((db_name, name, include_archive), storage.get_data_version(),
+                                lambda: executors.render_chart(db_name, name, include_archive))
+        response = Response(entry.png, mimetype="image/png")
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    # Сводный отчёт по всем объектам: частичные итоги баз считаются параллельно в пуле процессов
+    @app.route("/portfolio")
+    def portfolio():
+        n = min(max(request.args.get("n", 10, type=int), 1), 100)
+        shards = [(property_id, router.db_name(property_id)) for property_id in router.properties()]
+        if os.path.exists(app.config["DATABASE"]):
+            shards.insert(0, (None, app.config["DATABASE"]))
+        partials = executors.map_reports(shard_partial, [shard[0] for shard in shards],
+                                         [shard[1] for shard in shards], [n] * len(shards))
+        report = merge_partials(partials, n)
+        if request.accept_mimetypes.best == "application/json" or request.args.get("format") == "json":
+            return jsonify(report)
+        return render_template("portfolio.html", report=report)
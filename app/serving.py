@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from .metrics import CHART_DURATION
+
+# Настройки режима обслуживания по умолчанию (переопределяются в app.config)
+DEFAULTS = {
+    "WORKER_THREADS": 16,  # Потоки для обработки запросов и обращений к БД
+    "RENDER_PROCESSES": 2,  # Процессы для matplotlib; 0 — строить графики в потоке
+    "REPORT_PROCESSES": os.cpu_count() or 2,  # Процессы для сводных отчётов по базам объектов; 0 — в потоке
+    "HEAVY_CONCURRENCY": 2,  # Одновременные тяжёлые операции (импорт, построение графиков)
+    "HEAVY_WAIT_SECONDS": 5,  # Ожидание свободного слота перед ответом 503
+    "SHUTDOWN_TIMEOUT": 30,
+    "ANALYSIS_WARM_UP": False,  # Загрузить pandas и matplotlib в фоне сразу после запуска
+}
+
+
+class Busy(Exception):
+    """Все слоты для тяжёлых операций заняты"""
+
+
+def _render_chart(db_name, name, include_archive=False):
+    """Построение графика в отдельном процессе"""
+    from app.analysis import FinancialAnalysis
+    return FinancialAnalysis(db_name, include_archive).render_chart(name)
+
+
+class Executors:
+    """Пулы потоков и процессов приложения с ограничением тяжёлых операций"""
+
+    def __init__(self, config):
+        self.config = {key: config.get(key, value) for key, value in DEFAULTS.items()}
+        self.workers = ThreadPoolExecutor(max_workers=self.config["WORKER_THREADS"],
+                                          thread_name_prefix="worker")
+        self._heavy = threading.BoundedSemaphore(self.config["HEAVY_CONCURRENCY"])
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def heavy_slot(self):
+        """Слот для тяжёлой операции; Busy, если не освободился за HEAVY_WAIT_SECONDS"""
+        if not self._heavy.acquire(timeout=self.config["HEAVY_WAIT_SECONDS"]):
+            raise Busy()
+        try:
+            yield
+        finally:
+            self._heavy.release()
+
+    def _process_pool(self, name):
+        """Пул процессов name (render, report) размером из настройки <NAME>_PROCESSES"""
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None and not self._closed:
+                # spawn: дочерние процессы не наследуют открытые соединения и блокировки
+                pool = self._pools[name] = ProcessPoolExecutor(
+                    max_workers=self.config[f"{name.upper()}_PROCESSES"],
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return pool
+
+    def render_chart(self, db_name, name, include_archive=False):
+        """PNG графика, построенный в пуле процессов (или в текущем потоке)"""
+        with self.heavy_slot(), CHART_DURATION.time(name):
+            if self.config["RENDER_PROCESSES"] > 0:
+                pool = self._process_pool("render")
+                if pool is not None:
+                    return pool.submit(_render_chart, db_name, name, include_archive).result()
+            return _render_chart(db_name, name, include_archive)
+
+    def warm_up(self, db_name):
+        """Фоновая загрузка библиотек анализа в пуле потоков и в процессах построения графиков"""
+        from app.analysis import warm_up
+        self.workers.submit(warm_up, db_name)
+        if self.config["RENDER_PROCESSES"] > 0:
+            pool = self._process_pool("render")
+            for _ in range(self.config["RENDER_PROCESSES"]):
+                pool.submit(warm_up)
+
+    def map_reports(self, func, *iterables):
+        """Параллельный map по базам объектов в пуле процессов (или в текущем потоке)"""
+        with self.heavy_slot():
+            if self.config["REPORT_PROCESSES"] > 0:
+                pool = self._process_pool("report")
+                if pool is not None:
+                    return list(pool.map(func, *iterables))
+            return list(map(func, *iterables))
+
+    def shutdown(self):
+        """Плавная остановка: дождаться текущих задач, отменить ожидающие"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pools, self._pools = list(self._pools.values()), {}
+        self.workers.shutdown(wait=True, cancel_futures=True)
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
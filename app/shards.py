@@ -0,0 +1,157 @@
+import heapq
+import os
+import re
+import threading
+from collections import OrderedDict
+from .db import release_manager
+from .importer import OPERATION_TYPES
+from .storage import Storage
+from .utils import from_minor_units
+
+# Допустимый идентификатор объекта (дома): используется в имени файла базы
+PROPERTY_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+SHARD_PREFIX = "property_"
+SHARD_SUFFIX = ".db"
+
+# Сколько хранилищ объектов держать открытыми; давно не использованные закрываются
+SHARD_CACHE_SIZE = 64
+
+
+class UnknownProperty(LookupError):
+    """База объекта ещё не создана"""
+
+
+class ShardRouter:
+    """Отдельная база SQLite на каждый объект недвижимости.
+
+    База объекта property_id лежит в base_dir/property_<id>.db. Чтение
+    несуществующего объекта — ошибка UnknownProperty: база создаётся только
+    явно (storage(..., create=True), команда flask property create), чтобы
+    запросы к случайным адресам /p/<id>/ не плодили файлы. Storage и
+    FinancialAnalysis для объекта получаются через storage() и analysis();
+    соединения и снимки общие, как и для базы по умолчанию. Открытыми
+    остаются не больше cache_size хранилищ: у вытесненного объекта
+    закрываются соединения и освобождаются снимок и детектор аномалий.
+    """
+
+    def __init__(self, base_dir, cache_size=SHARD_CACHE_SIZE):
+        self.base_dir = base_dir
+        self.cache_size = cache_size
+        self._storages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def db_name(self, property_id):
+        """Путь к базе объекта; ValueError для недопустимого идентификатора"""
+        if not PROPERTY_ID.match(str(property_id)):
+            raise ValueError(f"Некорректный идентификатор объекта: {property_id!r}")
+        return os.path.join(self.base_dir, f"{SHARD_PREFIX}{property_id}{SHARD_SUFFIX}")
+
+    def exists(self, property_id):
+        return os.path.exists(self.db_name(property_id))
+
+    def storage(self, property_id, create=False):
+        """Хранилище объекта; UnknownProperty, если базы нет и create=False"""
+        db_name = self.db_name(property_id)
+        with self._lock:
+            storage = self._storages.get(db_name)
+            if storage is not None:
+                self._storages.move_to_end(db_name)
+                return storage
+        if not create and not os.path.exists(db_name):
+            raise UnknownProperty(f"Объект {property_id} не найден")
+        storage = Storage(db_name)  # Схема создаётся вне блокировки
+        with self._lock:
+            storage = self._storages.setdefault(db_name, storage)
+            self._storages.move_to_end(db_name)
+            evicted = []
+            while len(self._storages) > self.cache_size:
+                evicted.append(self._storages.popitem(last=False)[0])
+        for old in evicted:
+            self._release(old)
+        return storage
+
+    @staticmethod
+    def _release(db_name):
+        """Закрытие соединений вытесненного объекта и удаление его снимка и детектора"""
+        from .anomalies import release_detector
+        from .snapshot import release_snapshot
+        release_detector(db_name)
+        release_snapshot(db_name)
+        release_manager(db_name)
+
+    def analysis(self, property_id, include_archive=False):
+        from .analysis import FinancialAnalysis
+        return FinancialAnalysis(self.storage(property_id).db_name, include_archive)
+
+    def properties(self):
+        """Идентификаторы объектов, для которых уже есть база, по алфавиту"""
+        if not os.path.isdir(self.base_dir):
+            return []
+        return sorted(
+            name[len(SHARD_PREFIX):-len(SHARD_SUFFIX)] for name in os.listdir(self.base_dir)
+            if name.startswith(SHARD_PREFIX) and name.endswith(SHARD_SUFFIX)
+        )
+
+
+def shard_partial(property_id, db_name, n=10):
+    """Частичные итоги одной базы (в копейках) для сводного отчёта.
+
+    Выполняется в процессе пула: читает только материализованные агрегаты
+    и n крупнейших операций каждого типа по индексу (operation_type, amount).
+    """
+    storage = Storage(db_name)
+    with storage.db.connection() as conn:
+        income, expense = conn.execute("SELECT income, expense FROM agg_balance WHERE id = 1").fetchone() or (0, 0)
+        categories = conn.execute("""
+            SELECT c.name, a.operation_type, a.total, a.count
+            FROM agg_category_totals a
+            JOIN categories c ON a.category_id = c.id
+        """).fetchall()
+        top = {
+            operation_type: [(amount, property_id, name, date) for amount, name, date in conn.execute("""
+                SELECT o.amount, c.name, strftime('%Y-%m-%dT%H:%M', o.date, 'unixepoch')
+                FROM operations o
+                JOIN categories c ON o.category_id = c.id
+                WHERE o.operation_type = ?
+                ORDER BY o.amount DESC
+                LIMIT ?
+            """, (operation_type, n))]
+            for operation_type in OPERATION_TYPES
+        }
+    return {"income": income, "expense": expense, "categories": categories, "top": top}
+
+
+def merge_partials(partials, n=10):
+    """Сводный отчёт по частичным итогам баз: баланс, итоги по категориям и топ-N"""
+    income = expense = 0
+    categories = {}
+    top = {operation_type: [] for operation_type in OPERATION_TYPES}
+    count = 0
+    for partial in partials:
+        count += 1
+        income += partial["income"]
+        expense += partial["expense"]
+        for name, operation_type, total, operations in partial["categories"]:
+            totals = categories.setdefault((name, operation_type), [0, 0])
+            totals[0] += total
+            totals[1] += operations
+        for operation_type, rows in partial["top"].items():
+            top[operation_type] = heapq.nlargest(n, top[operation_type] + rows, key=lambda row: row[0])
+    return {
+        "properties": count,
+        "income": from_minor_units(income),
+        "expense": from_minor_units(expense),
+        "balance": from_minor_units(income - expense),
+        "categories": [
+            {"name": name, "operation_type": operation_type, "total": from_minor_units(total), "count": operations}
+            for (name, operation_type), (total, operations) in sorted(categories.items())
+        ],
+        "top": {
+            operation_type: [
+                {"property": property_id, "amount": from_minor_units(amount), "category": name, "date": date}
+                for amount, property_id, name, date in rows
+            ]
+            for operation_type, rows in top.items()
+        },
+    }
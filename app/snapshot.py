@@ -0,0 +1,326 @@
+import os
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from . import archive
+from .db import get_manager
+from .utils import from_minor_units
+
+# Коды типов операций в снимке
+TYPE_CODES = {"доход": 0, "расход": 1}
+OTHER_TYPE = 2
+
+# Начальная ёмкость столбцов; при заполнении удваивается
+INITIAL_CAPACITY = 1024
+
+# Сколько строк читать из базы за один запрос при загрузке
+FETCH_CHUNK = 50000
+
+
+def to_epoch(value, end_of_day=False):
+    """Дата YYYY-MM-DD или YYYY-MM-DDTHH:MM в секунды от начала эпохи.
+
+    Для даты без времени и end_of_day=True — последняя минута дня включительно.
+    """
+    if len(value) == 10:
+        value += "T23:59" if end_of_day else "T00:00"
+    return int(np.datetime64(value, "m").astype("datetime64[s]").astype(np.int64))
+
+
+def format_epoch(seconds):
+    """Секунды от начала эпохи в строки YYYY-MM-DDTHH:MM (как в таблице operations)"""
+    return np.datetime_as_string(np.asarray(seconds, dtype="datetime64[s]"), unit="m")
+
+
+def bucket_label(day, bucket):
+    """Подпись интервала для дня (номер дня от начала эпохи): 2023-05-01, 2023-W17, 2023-05, 2023-Q2, 2023"""
+    date = datetime.fromtimestamp(int(day) * 86400, timezone.utc)
+    if bucket == "day":
+        return date.strftime("%Y-%m-%d")
+    if bucket == "week":
+        return date.strftime("%Y-W%W")
+    if bucket == "month":
+        return date.strftime("%Y-%m")
+    if bucket == "quarter":
+        return f"{date.year}-Q{(date.month + 2) // 3}"
+    if bucket == "year":
+        return str(date.year)
+    raise ValueError(f"Неизвестный интервал: {bucket}")
+
+
+class OperationsSnapshot:
+    """Снимок таблицы operations в памяти в виде столбцов NumPy.
+
+    Категории и типы операций хранятся кодами (индексы в справочниках),
+    даты — секундами от начала эпохи, суммы — копейками (int64), как в таблице;
+    в рубли они переводятся только в результатах. Снимок общий для всех
+    запросов и обновляется инкрементально: новые строки читаются по id больше
+    последнего загруженного, изменённые и удалённые — по журналу
+    operations_changelog. Если журнал уже обрезан дальше, чем снимок успел
+    прочитать, операции перечитываются целиком.
+
+    Строки в пределах уже опубликованного размера не изменяются на месте:
+    удаление создаёт новые массивы, поэтому читатели, получившие столбцы
+    через columns(), могут работать с ними без блокировки.
+
+    С include_archive=True в снимок сначала читаются операции архивов
+    закрытых лет (каждый архив открывается отдельно, только для чтения),
+    затем рабочая таблица. Архивы не меняются, поэтому перечитываются
+    только при переносе в архив нового года.
+    """
+
+    def __init__(self, db_name, include_archive=False):
+        self.db_name = db_name
+        self.include_archive = include_archive
+        self.db = get_manager(db_name)
+        self._lock = threading.Lock()
+        self.version = None
+        self.last_id = 0
+        self.last_seq = 0
+        self.size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._amounts = np.empty(0, dtype=np.int64)
+        self._dates = np.empty(0, dtype=np.int64)
+        self._categories = np.empty(0, dtype=np.int32)
+        self._types = np.empty(0, dtype=np.int8)
+        self._category_codes = {}  # id категории -> код
+        self.category_ids = []
+        self.category_names = []
+        self.generation = 0  # Растёт, когда строки удаляются или перечитываются (не только дописываются)
+        self.archived_balance = 0  # Сальдо архивов, не прочитанных в снимок (копейки)
+        self.archive_years = ()  # Архивы, прочитанные в снимок (include_archive=True)
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0}
+
+    def refresh(self):
+        """Приведение снимка к текущей версии данных"""
+        with self._lock, self.db.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")  # Согласованное чтение версии, журнала и строк
+            version = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+            if version == self.version:
+                self.stats["unchanged"] += 1
+                return self
+            self._load_categories(conn)
+            archives = conn.execute("SELECT year, income - expense FROM archives ORDER BY year").fetchall()
+            years = tuple(year for year, _ in archives) if self.include_archive else ()
+            self.archived_balance = 0 if self.include_archive else sum(balance for _, balance in archives)
+            first_seq, last_seq = conn.execute(
+                "SELECT MIN(seq), MAX(seq) FROM operations_changelog").fetchone()
+            # Перенос года в архив удаляет его строки из operations: снимок с архивами перечитывается
+            if (self.version is None or years != self.archive_years
+                    or (first_seq is not None and first_seq > self.last_seq + 1)):
+                self._reset()
+                self._load_archives(years)
+                self.last_seq = last_seq or 0
+                self.stats["full"] += 1
+            else:
+                self._apply_changes(conn)
+                self.last_seq = max(self.last_seq, last_seq or 0)
+                self.stats["incremental"] += 1
+            self._append(conn.execute(
+                "SELECT id, amount, category_id, date, operation_type FROM operations WHERE id > ? ORDER BY id",
+                (self.last_id,)))
+            self.version = version
+        return self
+
+    def _reset(self):
+        self.generation += 1
+        self.size = 0
+        self.last_id = 0
+        self._ids = self._ids[:0].copy()
+
+    def _load_archives(self, years):
+        """Операции архивов закрытых лет; id не влияют на last_id рабочей таблицы"""
+        for year in years:
+            archive_conn = archive.connect(self.db_name, year)
+            try:
+                self._append(archive_conn.execute(
+                    "SELECT id, amount, category_id, date, operation_type FROM operations ORDER BY id"),
+                    track_last_id=False)
+            finally:
+                archive_conn.close()
+        self.archive_years = years
+
+    def _load_categories(self, conn):
+        for category_id, name in conn.execute("SELECT id, name FROM categories ORDER BY id"):
+            code = self._category_codes.get(category_id)
+            if code is None:
+                code = self._category_codes[category_id] = len(self.category_ids)
+                self.category_ids.append(category_id)
+                self.category_names.append(name)
+            else:
+                self.category_names[code] = name
+
+    def _apply_changes(self, conn):
+        """Удаление изменённых и удалённых строк и повторное чтение изменённых"""
+        changed = [row[0] for row in conn.execute(
+            "SELECT DISTINCT operation_id FROM operations_changelog WHERE seq > ?", (self.last_seq,))]
+        if not changed:
+            return
+        self.generation += 1
+        changed = np.array(changed, dtype=np.int64)
+        keep = ~np.isin(self._ids[:self.size], changed)
+        self._ids, self._amounts, self._dates, self._categories, self._types = (
+            column[:self.size][keep] for column in
+            (self._ids, self._amounts, self._dates, self._categories, self._types))
+        self.size = len(self._ids)
+        # Строки с id больше last_id будут прочитаны вместе с новыми
+        changed = changed[changed <= self.last_id].tolist()
+        for start in range(0, len(changed), 500):
+            part = changed[start:start + 500]
+            self._append(conn.execute(f"""
+                SELECT id, amount, category_id, date, operation_type FROM operations
+                WHERE id IN ({",".join("?" * len(part))})
+            """, part), track_last_id=False)
+
+    def _append(self, cursor, track_last_id=True):
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                return
+            ids, amounts, category_ids, dates, types = zip(*rows)
+            self._reserve(self.size + len(rows))
+            end = self.size + len(rows)
+            self._ids[self.size:end] = ids
+            self._amounts[self.size:end] = amounts
+            self._dates[self.size:end] = dates
+            codes = self._category_codes
+            self._categories[self.size:end] = [codes.get(category_id, -1) for category_id in category_ids]
+            self._types[self.size:end] = [TYPE_CODES.get(operation_type, OTHER_TYPE) for operation_type in types]
+            self.size = end
+            if track_last_id:
+                self.last_id = max(self.last_id, ids[-1])
+
+    def _reserve(self, size):
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        capacity = max(capacity * 2, size, INITIAL_CAPACITY)
+        for name in ("_ids", "_amounts", "_dates", "_categories", "_types"):
+            old = getattr(self, name)
+            column = np.empty(capacity, dtype=old.dtype)
+            column[:self.size] = old[:self.size]
+            setattr(self, name, column)
+
+    def columns(self):
+        """Актуальные столбцы (amounts, dates, categories, types) одного размера"""
+        self.refresh()
+        with self._lock:
+            size = self.size
+            return (self._amounts[:size], self._dates[:size], self._categories[:size], self._types[:size])
+
+    def view(self):
+        """Согласованный вид снимка: (поколение, ids, amounts, dates, categories, types).
+
+        Пока поколение не меняется, новые строки только дописываются в конец,
+        поэтому потребители могут обрабатывать лишь строки после уже виденных.
+        """
+        self.refresh()
+        with self._lock:
+            size = self.size
+            return (self.generation, self._ids[:size], self._amounts[:size], self._dates[:size],
+                    self._categories[:size], self._types[:size])
+
+    def category_code(self, category_id):
+        """Код категории в столбцах снимка (None — категория снимку неизвестна)"""
+        return self._category_codes.get(int(category_id))
+
+    def _mask(self, dates, categories, types, operation_type=None, date_from=None, date_to=None,
+              category_id=None):
+        mask = np.ones(len(dates), dtype=bool)
+        if operation_type is not None:
+            mask &= types == TYPE_CODES.get(operation_type, OTHER_TYPE)
+        if date_from:
+            mask &= dates >= to_epoch(date_from)
+        if date_to:
+            mask &= dates <= to_epoch(date_to, end_of_day=True)
+        if category_id is not None:
+            mask &= categories == self._category_codes.get(int(category_id), -2)
+        return mask
+
+    def balance(self):
+        """Доходы минус расходы, включая архивы закрытых лет"""
+        amounts, _, _, types = self.columns()
+        income = amounts[types == TYPE_CODES["доход"]].sum()
+        expense = amounts[types == TYPE_CODES["расход"]].sum()
+        return from_minor_units(int(income - expense) + self.archived_balance)
+
+    def category_summary(self, operation_type="расход", date_from=None, date_to=None):
+        """Пары (название категории, сумма) по категориям с операциями, по алфавиту"""
+        amounts, dates, categories, types = self.columns()
+        mask = self._mask(dates, categories, types, operation_type, date_from, date_to)
+        codes = categories[mask]
+        known = codes >= 0
+        length = len(self.category_names)
+        # Веса bincount — float64, но суммы целых копеек точны до 2**53
+        totals = np.bincount(codes[known], weights=amounts[mask][known], minlength=length)
+        counts = np.bincount(codes[known], minlength=length)
+        return sorted((self.category_names[code], from_minor_units(int(totals[code])))
+                      for code in np.flatnonzero(counts))
+
+    def top(self, n=10, operation_type="расход"):
+        """N крупнейших операций: списки сумм, названий категорий и дат"""
+        amounts, dates, categories, types = self.columns()
+        positions = np.flatnonzero(types == TYPE_CODES.get(operation_type, OTHER_TYPE))
+        if len(positions) > n:
+            positions = positions[np.argpartition(-amounts[positions], n - 1)[:n]]
+        positions = positions[np.argsort(-amounts[positions], kind="stable")]
+        names = [self.category_names[code] if code >= 0 else None for code in categories[positions]]
+        return (amounts[positions] / 100).tolist(), names, format_epoch(dates[positions]).tolist()
+
+    def time_series(self, bucket, date_from, date_to, category_id=None):
+        """Доходы и расходы по интервалам и остаток до date_from.
+
+        Возвращает (подписи интервалов, доходы, расходы, входящий остаток).
+        Операции архивов, не прочитанных в снимок, в интервалы не попадают;
+        без category_id их сальдо входит во входящий остаток.
+        """
+        amounts, dates, categories, types = self.columns()
+        scope = self._mask(dates, categories, types, category_id=category_id)
+        signed = np.where(types == TYPE_CODES["доход"], amounts,
+                          np.where(types == TYPE_CODES["расход"], -amounts, 0))
+        start, end = to_epoch(date_from), to_epoch(date_to, end_of_day=True)
+        opening = int(signed[scope & (dates < start)].sum())
+        if category_id is None:
+            opening += self.archived_balance
+        opening = from_minor_units(opening)
+        mask = scope & (dates >= start) & (dates <= end)
+        days, inverse = np.unique(dates[mask] // 86400, return_inverse=True)
+        labels, label_index = np.unique([bucket_label(day, bucket) for day in days], return_inverse=True)
+        positions = label_index[inverse] if len(days) else np.empty(0, dtype=np.int64)
+        period_types, period_amounts = types[mask], amounts[mask]
+        income = np.bincount(positions, weights=np.where(period_types == TYPE_CODES["доход"], period_amounts, 0),
+                             minlength=len(labels))
+        expense = np.bincount(positions, weights=np.where(period_types == TYPE_CODES["расход"], period_amounts, 0),
+                              minlength=len(labels))
+        return labels.tolist(), income / 100, expense / 100, opening
+
+    def date_range(self, category_id=None):
+        """Первая и последняя дата операций (YYYY-MM-DD) или (None, None)"""
+        _, dates, categories, types = self.columns()
+        dates = dates[self._mask(dates, categories, types, category_id=category_id)]
+        if not len(dates):
+            return None, None
+        first, last = format_epoch([dates.min(), dates.max()])
+        return str(first)[:10], str(last)[:10]
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(db_name, include_archive=False):
+    """Общий снимок операций для файла базы данных (include_archive — вместе с архивами)"""
+    key = (os.path.abspath(db_name), include_archive)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            snapshot = _snapshots[key] = OperationsSnapshot(db_name, include_archive)
+        return snapshot
+
+
+def release_snapshot(db_name):
+    """Удаление снимка файла из общего реестра (память освобождается вместе с ним)"""
+    with _snapshots_lock:
+        for include_archive in (False, True):
+            _snapshots.pop((os.path.abspath(db_name), include_archive), None)
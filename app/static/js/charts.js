@@ -0,0 +1,134 @@
+// Отрисовка графиков анализа на <canvas class="chart" data-src="/api/charts/..."> по данным JSON.
+// Формат данных — FinancialAnalysis.chart_data: title, type (bar/line), x_label, y_label, labels, series.
+(function () {
+    "use strict";
+
+    var COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#7f7f7f", "#d62728", "#9467bd"];
+    var MARGIN = {top: 40, right: 20, bottom: 110, left: 80};
+
+    function formatNumber(value) {
+        return value.toLocaleString("ru-RU", {maximumFractionDigits: 2});
+    }
+
+    function truncate(text, length) {
+        return text.length > length ? text.slice(0, length - 1) + "…" : text;
+    }
+
+    function valueRange(series) {
+        var min = 0, max = 0;
+        series.forEach(function (item) {
+            item.values.forEach(function (value) {
+                if (value === null) return;
+                min = Math.min(min, value);
+                max = Math.max(max, value);
+            });
+        });
+        return max === min ? [min, min + 1] : [min, max];
+    }
+
+    function drawMessage(ctx, canvas, text) {
+        ctx.fillStyle = "#333";
+        ctx.font = "16px sans-serif";
+        ctx.textAlign = "center";
+        ctx.fillText(text, canvas.width / 2, canvas.height / 2);
+    }
+
+    function draw(canvas, chart) {
+        var ctx = canvas.getContext("2d");
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = "#333";
+        ctx.font = "bold 15px sans-serif";
+        ctx.textAlign = "center";
+        ctx.fillText(chart.title, canvas.width / 2, 22);
+        if (!chart.labels.length) {
+            drawMessage(ctx, canvas, "Нет данных");
+            return;
+        }
+        var width = canvas.width - MARGIN.left - MARGIN.right;
+        var height = canvas.height - MARGIN.top - MARGIN.bottom;
+        var range = valueRange(chart.series);
+        var y = function (value) {
+            return MARGIN.top + height - (value - range[0]) / (range[1] - range[0]) * height;
+        };
+        var step = width / chart.labels.length;
+        var x = function (index) {
+            return MARGIN.left + step * (index + 0.5);
+        };
+
+        // Оси и сетка
+        ctx.font = "11px sans-serif";
+        ctx.textAlign = "right";
+        ctx.strokeStyle = "#ddd";
+        for (var tick = 0; tick <= 5; tick++) {
+            var value = range[0] + (range[1] - range[0]) * tick / 5;
+            ctx.beginPath();
+            ctx.moveTo(MARGIN.left, y(value));
+            ctx.lineTo(MARGIN.left + width, y(value));
+            ctx.stroke();
+            ctx.fillText(formatNumber(value), MARGIN.left - 6, y(value) + 4);
+        }
+        var every = Math.max(1, Math.ceil(chart.labels.length / 24));  // Не больше ~24 подписей по оси X
+        chart.labels.forEach(function (label, index) {
+            if (index % every) return;
+            ctx.save();
+            ctx.translate(x(index), MARGIN.top + height + 8);
+            ctx.rotate(-Math.PI / 4);
+            ctx.fillText(truncate(label || "—", 18), 0, 0);
+            ctx.restore();
+        });
+
+        // Ряды
+        chart.series.forEach(function (item, seriesIndex) {
+            var color = COLORS[seriesIndex % COLORS.length];
+            ctx.fillStyle = ctx.strokeStyle = color;
+            if (chart.type === "bar") {
+                var barWidth = step * 0.8;
+                item.values.forEach(function (value, index) {
+                    if (value === null) return;
+                    ctx.fillRect(x(index) - barWidth / 2, Math.min(y(value), y(0)), barWidth, Math.abs(y(value) - y(0)));
+                });
+            } else {
+                ctx.lineWidth = 2;
+                ctx.beginPath();
+                var started = false;
+                item.values.forEach(function (value, index) {
+                    if (value === null) {
+                        started = false;
+                        return;
+                    }
+                    if (started) ctx.lineTo(x(index), y(value)); else ctx.moveTo(x(index), y(value));
+                    started = true;
+                });
+                ctx.stroke();
+                ctx.lineWidth = 1;
+            }
+        });
+
+        // Легенда
+        if (chart.series.length > 1) {
+            ctx.textAlign = "left";
+            var left = MARGIN.left + 10;
+            chart.series.forEach(function (item, seriesIndex) {
+                ctx.fillStyle = COLORS[seriesIndex % COLORS.length];
+                ctx.fillRect(left, MARGIN.top - 12, 12, 8);
+                ctx.fillStyle = "#333";
+                ctx.fillText(item.name, left + 16, MARGIN.top - 4);
+                left += ctx.measureText(item.name).width + 36;
+            });
+        }
+    }
+
+    document.querySelectorAll("canvas.chart").forEach(function (canvas) {
+        fetch(canvas.dataset.src, {headers: {"Accept": "application/json"}})
+            .then(function (response) {
+                if (!response.ok) throw new Error(response.status);
+                return response.json();
+            })
+            .then(function (chart) {
+                draw(canvas, chart);
+            })
+            .catch(function () {
+                drawMessage(canvas.getContext("2d"), canvas, "Не удалось загрузить данные графика");
+            });
+    });
+})();
@@ -1,67 +1,108 @@
-import sqlite3
+import base64
 import csv
-import os
+import functools
+import hashlib
+import json
+import re
+import time
+from contextlib import closing
 from datetime import datetime
-from .utils import validate_amount, format_date
+from . import aggregates, archive, migrations
+from .db import get_manager
+from .exporter import stream_csv
+from .importer import (IdempotencyConflict, ImportResult, check_open_date, iter_batches, parse_category_row,
+                       parse_operation_item, parse_operation_row)
+from .utils import validate_amount, format_date, from_minor_units, from_timestamp, to_minor_units, to_timestamp
+
+# Столбцы операции для показа: сумма в рублях и дата YYYY-MM-DDTHH:MM
+OPERATION_DISPLAY_COLUMNS = """
+    o.id, o.amount / 100.0, c.name, strftime('%Y-%m-%dT%H:%M', o.date, 'unixepoch'), o.operation_type, o.comment
+"""
+
+
+# Границы найденных слов во фрагменте комментария результата поиска
+MATCH_START, MATCH_END = "\x02", "\x03"
+
+
+# Слова строки поиска, означающие «или»
+OR_WORDS = {"or", "или"}
+
+
+def fts_query(text):
+    """Запрос FTS5 из строки поиска: все слова (как префиксы) должны встретиться.
+
+    Слова OR и «или» в любом регистре между словами означают «или». Операторы
+    FTS5 и кавычки в тексте не интерпретируются, поэтому любая строка даёт корректный запрос.
+    """
+    parts = []
+    for word in re.findall(r"\w+", text):
+        if word.lower() in OR_WORDS:
+            if parts and parts[-1] != "OR":
+                parts.append("OR")
+        else:
+            parts.append(f'"{word}"*')
+    if parts and parts[-1] == "OR":
+        parts.pop()
+    if not parts:
+        raise ValueError("Пустой поисковый запрос.")
+    return " ".join(parts)
+
+
+def encode_cursor(date, operation_id):
+    """Непрозрачный курсор страницы по последней показанной операции"""
+    return base64.urlsafe_b64encode(f"{date}|{operation_id}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Разбор курсора страницы в пару (date в секундах, id)"""
+    try:
+        date, operation_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return int(date), int(operation_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Некорректный курсор страницы.")
+
 
 class Storage:
     def __init__(self, db_name="data/tables.db"):
         self.db_name = db_name
-        self._ensure_db_exists()
-        self._create_tables()
-
-    def _ensure_db_exists(self):
-        """Проверка наличия файла базы данных. Если файла нет, создаём его."""
-        if not os.path.exists(self.db_name):
-            os.makedirs(os.path.dirname(self.db_name), exist_ok=True)  # Создаем папку, если её нет
-            open(self.db_name, "w").close()
-
-    def _create_tables(self):
-        """Создание таблиц в базе данных"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            # Таблица категорий
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    type TEXT NOT NULL CHECK(type IN ('доход', 'расход'))
-                )
-            """)
-            # Таблица операций
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS operations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    amount REAL NOT NULL,
-                    category_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    operation_type TEXT NOT NULL,
-                    comment TEXT,
-                    FOREIGN KEY (category_id) REFERENCES categories (id)
-                )
-            """)
-            conn.commit()
-
-    def _ensure_db_and_tables(self):
-        """Проверка наличия базы данных и таблиц, если их нет — создание."""
-        self._ensure_db_exists()
-        self._create_tables()
+        self.db = get_manager(db_name)
+        self.db.ensure_schema(self._create_tables)
+
+    def _create_tables(self, conn):
+        """Создание и обновление схемы базы данных миграциями"""
+        migrations.migrate(conn)
+
+    def _archive_years(self):
+        """Годы, перенесённые в архивы, по возрастанию"""
+        with self.db.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT year FROM archives ORDER BY year")]
+
+    def _closed_until(self, conn):
+        """Начало первого незакрытого года (секунды) или None, если архивов нет"""
+        return conn.execute("SELECT MAX(until) FROM archives").fetchone()[0]
+
+    def _bump_version(self, conn):
+        """Увеличение версии данных в текущей транзакции"""
+        conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+    def get_data_version(self):
+        """Текущая версия данных (для кэшей, зависящих от operations и categories)"""
+        with self.db.connection() as conn:
+            return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
 
     def add_category(self, name, category_type):
         """Добавление категории"""
-        self._ensure_db_and_tables()
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO categories (name, type) 
                 VALUES (?, ?)
             """, (name, category_type))
-            conn.commit()
+            self._bump_version(conn)
 
     def get_categories(self, category_type=None):
         """Получение категорий"""
-        self._ensure_db_and_tables()
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
             if category_type:
                 cursor.execute("""
@@ -74,69 +115,263 @@ class Storage:
 
     def update_category(self, category_id, new_name, new_type):
         """Обновление категории"""
-        self._ensure_db_and_tables()
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE categories 
                 SET name = ?, type = ? 
                 WHERE id = ?
             """, (new_name, new_type, category_id))
-            conn.commit()
+            self._bump_version(conn)
+
+    def set_budget(self, category_id, monthly_limit):
+        """Месячный бюджет категории в рублях; None или 0 — бюджет снимается"""
+        with self.db.connection() as conn:
+            if not monthly_limit:
+                conn.execute("DELETE FROM budgets WHERE category_id = ?", (category_id,))
+                return
+            limit = to_minor_units(monthly_limit)
+            validate_amount(limit)
+            conn.execute("""
+                INSERT INTO budgets (category_id, monthly_limit) VALUES (?, ?)
+                ON CONFLICT (category_id) DO UPDATE SET monthly_limit = excluded.monthly_limit
+            """, (category_id, limit))
+
+    def get_budgets(self):
+        """Месячные бюджеты: {id категории: лимит в копейках}"""
+        with self.db.connection() as conn:
+            return dict(conn.execute("SELECT category_id, monthly_limit FROM budgets"))
 
     def add_operation(self, operation):
         """Добавление финансовой операции"""
-        self._ensure_db_and_tables()
         validate_amount(operation["amount"]) 
         operation["date"] = format_date(operation["date"]) 
-        with sqlite3.connect(self.db_name) as conn:
+        amount = to_minor_units(operation["amount"])
+        validate_amount(amount)  # Меньше копейки
+        row = (
+            amount,
+            operation["category_id"],
+            to_timestamp(operation["date"]),
+            operation["operation_type"],
+            operation["comment"]
+        )
+        with self.db.connection() as conn:
+            check_open_date(row[2], self._closed_until(conn))
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO operations (amount, category_id, date, operation_type, comment)
                 VALUES (?, ?, ?, ?, ?)
-            """, (
-                operation["amount"],
-                operation["category_id"],
-                operation["date"],
-                operation["operation_type"],
-                operation["comment"]
-            ))
-            conn.commit()
+            """, row)
+            aggregates.apply_operations(conn, [row])
+            self._bump_version(conn)
 
     def get_operations(self, limit=20):
         """Получение последних операций"""
-        self._ensure_db_and_tables()
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT o.id, o.amount, c.name, o.date, o.operation_type, o.comment
+            cursor.execute(f"""
+                SELECT {OPERATION_DISPLAY_COLUMNS}
                 FROM operations o
                 JOIN categories c ON o.category_id = c.id
-                ORDER BY o.date DESC
+                ORDER BY o.date DESC, o.id DESC
                 LIMIT ?
             """, (limit,))
             return cursor.fetchall()
 
+    def list_operations(self, filters=None, cursor=None, limit=50):
+        """Страница операций с фильтрами и постраничной навигацией по ключу (date, id).
+
+        Возвращает строки страницы и курсор следующей страницы (None, если это последняя).
+        """
+        where, params = self._operation_filters(filters or {})
+        if cursor:
+            where.append("(o.date, o.id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        sql = f"""
+            SELECT {OPERATION_DISPLAY_COLUMNS}, o.date
+            FROM operations o
+            JOIN categories c ON o.category_id = c.id
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY o.date DESC, o.id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self.db.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][-1], rows[-1][0])
+        return [row[:-1] for row in rows], next_cursor
+
+    def search_operations(self, query, filters=None, limit=50, offset=0):
+        """Полнотекстовый поиск операций по комментарию и названию категории.
+
+        Результаты упорядочены по релевантности (bm25), затем по id от новых
+        к старым. Возвращает (строки, есть ли следующая страница); последний
+        столбец строки — фрагмент комментария, найденные слова в нём обрамлены
+        MATCH_START и MATCH_END.
+        """
+        where, params = self._operation_filters(filters or {})
+        # Фрагменты строятся только для строк страницы, а не для всех совпадений
+        sql = f"""
+            WITH page AS (
+                SELECT o.id, bm25(operations_fts) AS score
+                FROM operations_fts
+                JOIN operations o ON o.id = operations_fts.rowid
+                WHERE {" AND ".join(["operations_fts MATCH ?"] + where)}
+                ORDER BY score, o.id DESC
+                LIMIT ? OFFSET ?
+            )
+            SELECT {OPERATION_DISPLAY_COLUMNS},
+                   snippet(operations_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 16)
+            FROM page
+            JOIN operations_fts ON operations_fts.rowid = page.id
+            JOIN operations o ON o.id = page.id
+            JOIN categories c ON o.category_id = c.id
+            WHERE operations_fts MATCH ?
+            ORDER BY page.score, o.id DESC
+        """
+        match = fts_query(query)
+        with self.db.connection() as conn:
+            rows = conn.execute(sql, [match] + params + [limit + 1, offset, match]).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def _operation_filters(self, filters):
+        """Условия WHERE для фильтров по дате, категории, типу и сумме.
+
+        Даты (YYYY-MM-DD или YYYY-MM-DDTHH:MM) и суммы в рублях переводятся
+        в секунды и копейки, чтобы сравнения шли по целочисленным столбцам.
+        """
+        where, params = [], []
+        if filters.get("date_from"):
+            where.append("o.date >= ?")
+            params.append(to_timestamp(filters["date_from"]))
+        if filters.get("date_to"):
+            date_to = filters["date_to"]
+            if len(date_to) == 10:  # Только дата — включаем весь день
+                where.append("o.date < ?")
+                params.append(to_timestamp(date_to) + 86400)
+            else:
+                where.append("o.date <= ?")
+                params.append(to_timestamp(date_to))
+        if filters.get("category_id") is not None:
+            where.append("o.category_id = ?")
+            params.append(filters["category_id"])
+        if filters.get("operation_type"):
+            where.append("o.operation_type = ?")
+            params.append(filters["operation_type"])
+        if filters.get("amount_min") is not None:
+            where.append("o.amount >= ?")
+            params.append(to_minor_units(filters["amount_min"]))
+        if filters.get("amount_max") is not None:
+            where.append("o.amount <= ?")
+            params.append(to_minor_units(filters["amount_max"]))
+        return where, params
+
     def delete_operation(self, operation_id):
         """Удаление операции по ID"""
-        self._ensure_db_and_tables()
-        with sqlite3.connect(self.db_name) as conn:
+        with self.db.connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("""
+                SELECT amount, category_id, date, operation_type
+                FROM operations
+                WHERE id = ?
+            """, (operation_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return
             cursor.execute("DELETE FROM operations WHERE id = ?", (operation_id,))
-            conn.commit()
+            aggregates.apply_operations(conn, [row], sign=-1)
+            self._bump_version(conn)
+
+    def _archive_connection(self, year):
+        """Соединение с архивом года только для чтения, закрываемое по выходу из with"""
+        return closing(archive.connect(self.db_name, year))
+
+    def _expected_aggregates(self, conn):
+        """Значения агрегатов по архивам (по одному, только для чтения) и рабочей таблице"""
+        totals = None
+        for year in self._archive_years():
+            with self._archive_connection(year) as archive_conn:
+                totals = aggregates.expected_totals(archive_conn, totals=totals)
+        return aggregates.expected_totals(conn, totals=totals)
+
+    def rebuild_aggregates(self):
+        """Полный пересчёт материализованных агрегатов (с учётом архивов)"""
+        with self.db.connection() as conn:
+            aggregates.rebuild(conn, self._expected_aggregates(conn))
+
+    def verify_aggregates(self):
+        """Сверка агрегатов с операциями и архивами; возвращает список расхождений"""
+        with self.db.connection() as conn:
+            return aggregates.verify(conn, self._expected_aggregates(conn))
+
+    def archive_closed_years(self, up_to_year, now=None):
+        """Перенос в архивы всех лет по up_to_year включительно; список (год, число операций)"""
+        archive.check_closed(up_to_year, now)
+        with self.db.connection() as conn:
+            first = conn.execute("SELECT MIN(date) FROM operations").fetchone()[0]
+        archived = []
+        if first is not None:
+            for year in range(int(from_timestamp(first)[:4]), up_to_year + 1):
+                rows = archive.archive_year(self.db_name, year, now)
+                if rows:
+                    archived.append((year, rows))
+        return archived
+
+    def get_archives(self):
+        """Архивы закрытых лет: год, число операций, доходы, расходы и сальдо в рублях"""
+        with self.db.connection() as conn:
+            rows = conn.execute("SELECT year, rows, income, expense FROM archives ORDER BY year").fetchall()
+        return [{
+            "year": year, "rows": count, "income": from_minor_units(income),
+            "expense": from_minor_units(expense), "balance": from_minor_units(income - expense),
+        } for year, count, income, expense in rows]
+
+    def get_archive_report(self, year):
+        """Итоги архивного года по категориям и месяцам из архива (без просмотра операций); None, если архива нет"""
+        if year not in self._archive_years():
+            return None
+        with self._archive_connection(year) as conn:
+            categories = conn.execute("""
+                SELECT name, operation_type, total, count FROM category_totals ORDER BY name, operation_type
+            """).fetchall()
+            months = conn.execute("""
+                SELECT month, operation_type, total, count FROM monthly_totals ORDER BY month, operation_type
+            """).fetchall()
+        summary = next(item for item in self.get_archives() if item["year"] == year)
+        return dict(summary, categories=[
+            {"name": name, "operation_type": operation_type, "total": from_minor_units(total), "count": count}
+            for name, operation_type, total, count in categories
+        ], months=[
+            {"month": month, "operation_type": operation_type, "total": from_minor_units(total), "count": count}
+            for month, operation_type, total, count in months
+        ])
 
     def load_categories_from_csv(self, file_path):
         """Загрузка категорий из CSV-файла"""
-        self._ensure_db_and_tables()
-        with open(file_path, "r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            next(reader)  # Пропускаем заголовок
-            for row in reader:
-                self.add_category(row[0], row[1])
+        with open(file_path, "r", encoding="utf-8-sig", newline="") as file:
+            return self.import_categories(file)
+
+    def import_categories(self, stream, batch_size=5000):
+        """Потоковая загрузка категорий из CSV одной транзакцией"""
+        result = ImportResult()
+        with self.db.connection() as conn:
+            known_names = {row[0] for row in conn.execute("SELECT name FROM categories")}
+            parse_row = lambda row: parse_category_row(row, known_names)
+            for batch in iter_batches(stream, parse_row, result, batch_size):
+                conn.executemany("""
+                    INSERT INTO categories (name, type)
+                    VALUES (?, ?)
+                """, batch)
+                result.accepted += len(batch)
+            if result.accepted:
+                self._bump_version(conn)
+        return result
 
     def export_categories_to_csv(self, file_path):
         """Выгрузка категорий в CSV-файл"""
-        self._ensure_db_and_tables()
         categories = self.get_categories()
         with open(file_path, "w", encoding="utf-8", newline="") as file:
             writer = csv.writer(file)
@@ -146,25 +381,134 @@ class Storage:
 
     def load_operations_from_csv(self, file_path):
         """Загрузка операций из CSV-файла"""
-        self._ensure_db_and_tables()
-        with open(file_path, "r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            next(reader)  # Пропускаем заголовок
-            for row in reader:
-                self.add_operation({
-                    "amount": float(row[0]),
-                    "category_id": int(row[1]),
-                    "date": row[2],
-                    "operation_type": row[3],
-                    "comment": row[4]
-                })
-
-    def export_operations_to_csv(self, file_path):
+        with open(file_path, "r", encoding="utf-8-sig", newline="") as file:
+            return self.import_operations(file)
+
+    def import_operations(self, stream, batch_size=5000, progress=None):
+        """Потоковая загрузка операций из CSV пачками через executemany одной транзакцией.
+
+        progress(обработано строк) вызывается после каждой пачки; исключение
+        из него откатывает всю загрузку.
+        """
+        result = ImportResult()
+        with self.db.connection() as conn:
+            category_ids = {row[0] for row in conn.execute("SELECT id FROM categories")}
+            closed_until = self._closed_until(conn)
+            parse_row = lambda row: parse_operation_row(row, category_ids, closed_until)
+            for batch in iter_batches(stream, parse_row, result, batch_size):
+                conn.executemany("""
+                    INSERT INTO operations (amount, category_id, date, operation_type, comment)
+                    VALUES (?, ?, ?, ?, ?)
+                """, batch)
+                aggregates.apply_operations(conn, batch)
+                result.accepted += len(batch)
+                if progress is not None:
+                    progress(result.accepted + result.rejected)
+            if result.accepted:
+                self._bump_version(conn)
+        return result
+
+    def ingest_operations(self, items, idempotency_key=None, key_ttl=86400):
+        """Атомарная загрузка пачки операций из JSON.
+
+        Все категории проверяются одним запросом; если хотя бы одна операция
+        некорректна, не записывается ни одна. Возвращает (итог в виде словаря,
+        признак повтора). Повторный запрос с тем же idempotency_key и тем же
+        содержимым возвращает сохранённый итог без вставки; с другим
+        содержимым — IdempotencyConflict. Ключи хранятся key_ttl секунд.
+        """
+        request_hash = hashlib.sha256(
+            json.dumps(items, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        now = int(time.time())
+        with self.db.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")  # Одновременные повторы с одним ключом выполняются по очереди
+            if idempotency_key is not None:
+                conn.execute("DELETE FROM ingest_batches WHERE created_at < ?", (now - key_ttl,))
+                stored = conn.execute("SELECT request_hash, response FROM ingest_batches WHERE key = ?",
+                                      (idempotency_key,)).fetchone()
+                if stored is not None:
+                    if stored[0] != request_hash:
+                        raise IdempotencyConflict(idempotency_key)
+                    return json.loads(stored[1]), True
+            requested = list({item.get("category_id") for item in items
+                              if isinstance(item, dict) and type(item.get("category_id")) is int})
+            category_ids = {row[0] for row in conn.execute(
+                f"SELECT id FROM categories WHERE id IN ({','.join('?' * len(requested))})", requested)}
+            result = ImportResult(max_errors=len(items), position="index")
+            closed_until = self._closed_until(conn)
+            rows = []
+            for index, item in enumerate(items):
+                try:
+                    rows.append(parse_operation_item(item, category_ids, closed_until))
+                except ValueError as e:
+                    result.reject(index, str(e))
+            if result.rejected:
+                return result.to_dict(), False
+            conn.executemany("""
+                INSERT INTO operations (amount, category_id, date, operation_type, comment)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            aggregates.apply_operations(conn, rows)
+            result.accepted = len(rows)
+            if rows:
+                self._bump_version(conn)
+            response = result.to_dict()
+            if idempotency_key is not None:
+                conn.execute("""
+                    INSERT INTO ingest_batches (key, request_hash, created_at, response)
+                    VALUES (?, ?, ?, ?)
+                """, (idempotency_key, request_hash, now, json.dumps(response, ensure_ascii=False)))
+        return response, False
+
+    def count_operations(self, filters=None, include_archive=False):
+        """Число операций, подходящих под фильтры (include_archive — вместе с архивами)"""
+        where, params = self._operation_filters(filters or {})
+        sql = f"SELECT COUNT(*) FROM operations o {'WHERE ' + ' AND '.join(where) if where else ''}"
+        count = 0
+        for connect in self._operation_sources(include_archive):
+            with connect() as conn:
+                count += conn.execute(sql, params).fetchone()[0]
+        return count
+
+    def _operation_sources(self, include_archive):
+        """Соединения с таблицами operations: архивы по годам (если нужны), затем рабочая база"""
+        sources = []
+        if include_archive:
+            sources += [functools.partial(self._archive_connection, year) for year in self._archive_years()]
+        return sources + [self.db.connection]
+
+    def iter_operation_chunks(self, filters=None, chunk_size=10000, include_archive=False):
+        """Обход операций пачками по возрастанию id; память не зависит от размера таблицы.
+
+        Строки (amount, category_id, date, operation_type, comment) — с суммой
+        в рублях и датой YYYY-MM-DDTHH:MM, как в CSV. include_archive — сначала
+        операции закрытых лет из архивов (по годам), затем рабочая таблица.
+        """
+        where, params = self._operation_filters(filters or {})
+        where.append("o.id > ?")
+        sql = f"""
+            SELECT o.id, o.amount / 100.0, o.category_id, strftime('%Y-%m-%dT%H:%M', o.date, 'unixepoch'),
+                   o.operation_type, o.comment
+            FROM operations o
+            WHERE {" AND ".join(where)}
+            ORDER BY o.id
+            LIMIT ?
+        """
+        for connect in self._operation_sources(include_archive):
+            last_id = 0
+            while True:
+                with connect() as conn:
+                    rows = conn.execute(sql, params + [last_id, chunk_size]).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                yield [row[1:] for row in rows]
+                if len(rows) < chunk_size:
+                    break
+
+    def export_operations_to_csv(self, file_path, filters=None):
         """Выгрузка операций в CSV-файл"""
-        self._ensure_db_and_tables()
-        operations = self.get_operations()
         with open(file_path, "w", encoding="utf-8", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["amount", "category_id", "date", "operation_type", "comment"])  # Заголовок
-            for operation in operations:
-                writer.writerow([operation[1], operation[2], operation[3], operation[4], operation[5]])
\ No newline at end of file
+            for chunk in stream_csv(self.iter_operation_chunks(filters)):
+                file.write(chunk)
@@ -1,5 +1,7 @@
 import re
-from datetime import datetime
+from calendar import timegm
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
 def validate_amount(amount):
     """Проверка корректности суммы (должна быть положительным числом)"""
@@ -13,4 +15,27 @@ def format_date(date_str):
         date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M")
         return date.strftime("%Y-%m-%dT%H:%M")
     except ValueError:
-        raise ValueError("Некорректный формат даты. Используйте YYYY-MM-DD.")
\ No newline at end of file
+        raise ValueError("Некорректный формат даты. Используйте YYYY-MM-DD.")
+
+def to_minor_units(amount):
+    """Сумма в рублях (число или строка) в целое число копеек"""
+    try:
+        return int(Decimal(str(amount).strip()).quantize(Decimal("0.01"), ROUND_HALF_UP) * 100)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+
+def from_minor_units(amount):
+    """Сумма в копейках в рубли"""
+    return amount / 100
+
+def to_timestamp(date_str):
+    """Дата YYYY-MM-DDTHH:MM или YYYY-MM-DD в секунды от начала эпохи (UTC)"""
+    fmt = "%Y-%m-%d" if len(date_str) == 10 else "%Y-%m-%dT%H:%M"
+    try:
+        return timegm(datetime.strptime(date_str, fmt).timetuple())
+    except ValueError:
+        raise ValueError("Некорректный формат даты. Используйте YYYY-MM-DD.")
+
+def from_timestamp(timestamp):
+    """Секунды от начала эпохи в дату формата YYYY-MM-DDTHH:MM"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M")
@@ -0,0 +1,4 @@
+from app import create_asgi_app
+
+# Запуск в рабочем режиме: uvicorn asgi:app --workers 4
+app = create_asgi_app()
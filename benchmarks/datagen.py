@@ -0,0 +1,77 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+from app import aggregates
+from app.storage import Storage
+from app.utils import to_minor_units, to_timestamp
+
+# Размеры наборов данных, используемые в бенчмарках
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+EXPENSE_CATEGORIES = ["Кровля", "Фасад", "Лифты", "Электрика", "Сантехника", "Отопление",
+                      "Окна", "Подъезды", "Подвал", "Благоустройство", "Вентиляция", "Прочее"]
+INCOME_CATEGORIES = ["Взносы", "Субсидии", "Аренда", "Пени", "Прочие доходы"]
+COMMENT_WORDS = ["замена", "ремонт", "кровля", "roof", "трубы", "счёт", "аванс", "смета",
+                 "подрядчик", "материалы", "работы", "этаж", "подъезд", "договор"]
+
+
+def parse_size(value):
+    """Размер набора: 10k, 1m, 10m или число строк"""
+    return SIZES.get(value.lower()) or int(value)
+
+
+def generate_operations(count, category_ids, start, days, seed=42):
+    """Генератор кортежей (amount, category_id, date, operation_type, comment) в формате CSV"""
+    rng = random.Random(seed)
+    categories = list(category_ids.items())
+    for _ in range(count):
+        category_id, category_type = rng.choice(categories)
+        if category_type == "доход":
+            amount = round(rng.uniform(1_000, 50_000), 2)
+        else:
+            amount = round(rng.lognormvariate(9, 1.2), 2) + 1
+        date = start + timedelta(minutes=rng.randrange(days * 24 * 60))
+        comment = " ".join(rng.sample(COMMENT_WORDS, 3))
+        yield amount, category_id, date.strftime("%Y-%m-%dT%H:%M"), category_type, comment
+
+
+def populate(db_name, rows, years=5, seed=42, chunk_size=100_000):
+    """Заполнение базы категориями и rows синтетическими операциями"""
+    storage = Storage(db_name)
+    existing = {name for _, name, _ in storage.get_categories()}
+    for name in EXPENSE_CATEGORIES:
+        if name not in existing:
+            storage.add_category(name, "расход")
+    for name in INCOME_CATEGORIES:
+        if name not in existing:
+            storage.add_category(name, "доход")
+    category_ids = {category_id: category_type for category_id, _, category_type in storage.get_categories()}
+    start = datetime(datetime.now().year - years, 1, 1)
+    operations = generate_operations(rows, category_ids, start, years * 365, seed)
+    with storage.db.connection() as conn:
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), operations)]
+            if not chunk:
+                break
+            conn.executemany("""
+                INSERT INTO operations (amount, category_id, date, operation_type, comment)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(to_minor_units(amount), category_id, to_timestamp(date), operation_type, comment)
+                  for amount, category_id, date, operation_type, comment in chunk])
+        aggregates.rebuild(conn)
+        conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетических данных для бенчмарков")
+    parser.add_argument("db", help="путь к файлу базы данных")
+    parser.add_argument("--rows", default="10k", help="10k, 1m, 10m или число строк")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    populate(args.db, parse_size(args.rows), args.years, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from benchmarks.datagen import parse_size, populate
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку (метод ближайшего ранга)"""
+    rank = math.ceil(p / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+class Runner:
+    """Замер латентности, пропускной способности и пикового потребления памяти"""
+
+    def __init__(self, iterations, only=None):
+        self.iterations = iterations
+        self.only = only
+        self.results = {}
+
+    def bench(self, name, func, iterations=None, items=1):
+        """func выполняется iterations раз; items — число обработанных элементов за вызов"""
+        if self.only and not any(part in name for part in self.only):
+            return
+        iterations = iterations or self.iterations
+        func()  # Прогрев
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - started)
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self._record(name, latencies, sum(latencies), items, peak)
+
+    def bench_concurrent(self, name, func, concurrency, requests):
+        """Нагрузочный замер: requests вызовов func в concurrency потоках"""
+        if self.only and not any(part in name for part in self.only):
+            return
+
+        def timed(_):
+            started = time.perf_counter()
+            func()
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            latencies = list(pool.map(timed, range(requests)))
+            elapsed = time.perf_counter() - started
+        self._record(name, latencies, elapsed, 1, None, concurrency=concurrency)
+
+    def _record(self, name, latencies, elapsed, items, peak, **extra):
+        latencies.sort()
+        iterations = len(latencies)
+        result = {
+            "iterations": iterations,
+            "mean_ms": sum(latencies) / iterations * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "throughput_per_s": iterations * items / elapsed if elapsed else None,
+            "peak_memory_bytes": peak,
+            **extra,
+        }
+        for p in PERCENTILES:
+            result[f"p{p}_ms"] = percentile(latencies, p) * 1000
+        self.results[name] = result
+        print(f"{name:45s} p50={result['p50_ms']:9.2f} мс  p99={result['p99_ms']:9.2f} мс  "
+              f"{result['throughput_per_s']:12.1f}/с  пик={(peak or 0) / 1024:9.0f} КБ", file=sys.stderr)
+
+
+def storage_benchmarks(runner, storage):
+    runner.bench("storage.get_operations", lambda: storage.get_operations())
+    runner.bench("storage.list_operations.first_page", lambda: storage.list_operations(limit=50))
+    runner.bench("storage.list_operations.filtered", lambda: storage.list_operations(
+        {"operation_type": "расход", "amount_min": 1000, "date_from": "2000-01-01"}, limit=50))
+    _, cursor = storage.list_operations(limit=5000)
+    runner.bench("storage.list_operations.deep_cursor", lambda: storage.list_operations(cursor=cursor, limit=50))
+    rows = sum(1 for chunk in storage.iter_operation_chunks() for _ in chunk)
+    runner.bench("storage.export_operations_csv", lambda: export_to_null(storage),
+                 iterations=max(1, runner.iterations // 10), items=rows)
+
+
+def export_to_null(storage):
+    from app.exporter import stream_csv
+    for _ in stream_csv(storage.iter_operation_chunks()):
+        pass
+
+
+def analysis_benchmarks(runner, analysis):
+    from app.analysis import CHARTS
+    runner.bench("analysis.get_balance", analysis.get_balance)
+    runner.bench("analysis.get_category_summary", analysis.get_category_summary)
+    runner.bench("analysis.get_top_expenses_or_incomes", analysis.get_top_expenses_or_incomes)
+    runner.bench("analysis.get_time_series", analysis.get_time_series)
+    for name in CHARTS:
+        runner.bench(f"analysis.render_chart.{name}", lambda name=name: analysis.render_chart(name),
+                     iterations=max(1, runner.iterations // 10))
+
+
+def http_benchmarks(runner, client):
+    from app.analysis import CHARTS
+
+    def get(path):
+        def call():
+            response = client.get(path)
+            response.get_data()
+            assert response.status_code in (200, 304), (path, response.status_code)
+        return call
+
+    runner.bench("http.index", get("/"))
+    runner.bench("http.view_operations", get("/view_operations"))
+    runner.bench("http.analysis", get("/analysis"))
+    for name in CHARTS:
+        runner.bench(f"http.chart.{name}", get(f"/charts/{name}.png"))
+    runner.bench("http.export_operations_csv", get("/export_operations_csv"),
+                 iterations=max(1, runner.iterations // 10))
+
+
+def load_benchmarks(runner, app, concurrency):
+    """Латентность главной страницы при параллельной нагрузке, в том числе на /analysis"""
+    def get(path):
+        def call():
+            app.test_client().get(path).get_data()  # Свой клиент на каждый запрос
+        return call
+
+    requests = runner.iterations * concurrency
+    runner.bench_concurrent("load.index", get("/"), concurrency, requests)
+    mixed = [get("/"), get("/analysis"), get("/charts/income_vs_expenses.png"), get("/view_operations")]
+    counter = iter(range(10 ** 9))
+    runner.bench_concurrent("load.mixed", lambda: mixed[next(counter) % len(mixed)](), concurrency, requests)
+
+
+def write_benchmarks(runner, storage, client, category_id, import_rows):
+    counter = iter(range(10 ** 9))
+    runner.bench("storage.add_operation", lambda: storage.add_operation({
+        "amount": 100.0, "category_id": category_id, "date": "2024-01-01T10:00",
+        "operation_type": "расход", "comment": f"bench {next(counter)}"
+    }))
+    data = "amount,category_id,date,operation_type,comment\n" + "".join(
+        f"{i % 1000 + 1},{category_id},2024-02-{i % 28 + 1:02d}T10:00,расход,импорт {i}\n"
+        for i in range(import_rows)
+    )
+    runner.bench("storage.import_operations", lambda: storage.import_operations(io.StringIO(data)),
+                 iterations=max(1, runner.iterations // 10), items=import_rows)
+    runner.bench("http.load_operations_csv", lambda: client.post("/load_operations_csv", data={
+        "file": (io.BytesIO(data.encode("utf-8")), "operations.csv")
+    }), iterations=max(1, runner.iterations // 10), items=import_rows)
+    batch = [{"amount": i % 1000 + 1, "category_id": category_id, "date": f"2024-03-{i % 28 + 1:02d}T10:00",
+              "operation_type": "расход", "comment": f"пакет {i}"} for i in range(import_rows)]
+    runner.bench("http.ingest_operations_batch", lambda: client.post("/api/operations/batch", json=batch),
+                 iterations=max(1, runner.iterations // 10), items=import_rows)
+
+
+def copy_database(source, target):
+    """Копия базы (вместе с незаписанным WAL) и её архивов закрытых лет"""
+    from app.archive import archive_dir
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    if os.path.isdir(archive_dir(source)):
+        shutil.copytree(archive_dir(source), archive_dir(target))
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий: p50 хуже базового больше чем на tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("p50_ms"):
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append({"name": name, "baseline_p50_ms": base["p50_ms"],
+                                "p50_ms": result["p50_ms"], "ratio": ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки хранилища, анализа и HTTP-маршрутов")
+    parser.add_argument("--rows", default="10k", help="размер набора: 10k, 1m, 10m или число строк")
+    parser.add_argument("--db", help="готовая база (замеры идут на её временной копии, иначе база генерируется)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--import-rows", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8, help="число потоков в нагрузочных замерах")
+    parser.add_argument("--only", nargs="*", help="запускать только бенчмарки, содержащие эти подстроки")
+    parser.add_argument("--output", help="файл для результатов в JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="JSON с результатами предыдущего запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение p50 (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.analysis import FinancialAnalysis
+    from app.storage import Storage
+
+    rows = parse_size(args.rows)
+    tmp = tempfile.TemporaryDirectory()
+    db_name = os.path.join(tmp.name, "bench.db")
+    source = args.db or db_name
+    if not os.path.exists(source):
+        started = time.perf_counter()
+        populate(source, rows)
+        print(f"Сгенерировано {rows} операций за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    if source != db_name:
+        # Замеры записи добавляют операции: переданная база остаётся нетронутой
+        copy_database(source, db_name)
+
+    # Своя очередь задач: замеры не забирают задачи очереди data/jobs
+    app = create_app({"DATABASE": db_name, "JOBS_DIR": os.path.join(tmp.name, "jobs"),
+                      "SHARDS_DIR": os.path.join(tmp.name, "properties"), "RENDER_PROCESSES": 0, "TESTING": True})
+    client = app.test_client()
+    storage = Storage(db_name)
+    analysis = FinancialAnalysis(db_name)
+    category_id = storage.get_categories(category_type="расход")[0][0]
+
+    runner = Runner(args.iterations, args.only)
+    storage_benchmarks(runner, storage)
+    analysis_benchmarks(runner, analysis)
+    http_benchmarks(runner, client)
+    load_benchmarks(runner, app, args.concurrency)
+    write_benchmarks(runner, storage, client, category_id, args.import_rows)
+
+    report = {
+        "meta": {
+            "rows": rows,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": runner.results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            report["regressions"] = compare(runner.results, json.load(file), args.tolerance)
+        for regression in report["regressions"]:
+            print(f"Регрессия {regression['name']}: p50 {regression['baseline_p50_ms']:.2f} → "
+                  f"{regression['p50_ms']:.2f} мс (x{regression['ratio']:.2f})", file=sys.stderr)
+        exit_code = 1 if report["regressions"] else 0
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+    storage.db.close_all()
+    tmp.cleanup()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
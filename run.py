@@ -3,4 +3,5 @@ from app import create_app
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Сервер для разработки; отладка включается через FLASK_DEBUG=1
+    app.run(debug=app.config.get("DEBUG", False))
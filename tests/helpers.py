@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from app import create_app
+from app.storage import Storage
+
+
+class StorageTestCase(unittest.TestCase):
+    """Временная база с категориями CATEGORIES (id по порядку, начиная с 1).
+
+    Если APP_CONFIG задан, создаётся и приложение с этой базой (self.app,
+    self.client); каталоги объектов и очереди задач — во временном каталоге.
+    """
+
+    CATEGORIES = (("Ремонт", "расход"), ("Взносы", "доход"))
+    APP_CONFIG = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, "tables.db")
+        if self.APP_CONFIG is not None:
+            self.app = create_app(self.app_config(**self.APP_CONFIG))
+            self.client = self.app.test_client()
+        self.storage = Storage(self.db_name)
+        for name, category_type in self.CATEGORIES:
+            self.storage.add_category(name, category_type)
+
+    def tearDown(self):
+        self.storage.db.close_all()
+        self.tmp.cleanup()
+
+    def app_config(self, **config):
+        """Настройки приложения для временной базы теста"""
+        return dict({"DATABASE": self.db_name,
+                     "SHARDS_DIR": os.path.join(self.tmp.name, "properties"),
+                     "JOBS_DIR": os.path.join(self.tmp.name, "jobs"),
+                     "RENDER_PROCESSES": 0, "REPORT_PROCESSES": 0, "JOB_WORKERS": 0}, **config)
+
+    def add(self, amount, category_id, date, operation_type="расход", comment=""):
+        self.storage.add_operation({"amount": amount, "category_id": category_id, "date": date,
+                                    "operation_type": operation_type, "comment": comment})
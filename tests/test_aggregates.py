@@ -0,0 +1,47 @@
+import io
+import unittest
+from app.analysis import FinancialAnalysis
+from helpers import StorageTestCase
+
+
+class TestAggregates(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.analysis = FinancialAnalysis(self.db_name)
+
+    def test_balance_follows_writes(self):
+        self.add(500.0, 2, "2023-01-01T10:00", "доход")
+        self.add(120.0, 1, "2023-01-05T10:00", "расход")
+        self.assertAlmostEqual(self.analysis.get_balance(), 380.0)
+        operation_id = self.storage.get_operations()[0][0]
+        self.storage.delete_operation(operation_id)
+        self.assertAlmostEqual(self.analysis.get_balance(), 500.0)
+        self.assertEqual(self.storage.verify_aggregates(), [])
+
+    def test_bulk_import_updates_aggregates(self):
+        data = io.StringIO(
+            "amount,category_id,date,operation_type,comment\n"
+            "100,1,2023-01-01T10:00,расход,\n"
+            "50,1,2023-02-01T10:00,расход,\n"
+            "300,2,2023-02-03T12:30,доход,\n"
+        )
+        self.storage.import_operations(data)
+        summary = self.analysis.get_category_summary("расход")
+        self.assertEqual(summary["total"].tolist(), [150.0])
+        self.assertIsNone(self.analysis._snapshot)  # Итоги за всё время — из агрегатов, без снимка
+        period = self.analysis.get_category_summary("расход", date_from="2023-02-01")
+        self.assertEqual(period["total"].tolist(), [50.0])
+        self.assertEqual(self.storage.verify_aggregates(), [])
+
+    def test_rebuild_repairs_drift(self):
+        self.add(100.0, 1, "2023-01-01T10:00", "расход")
+        with self.storage.db.connection() as conn:
+            conn.execute("UPDATE agg_balance SET expense = 0")
+        self.assertNotEqual(self.storage.verify_aggregates(), [])
+        self.storage.rebuild_aggregates()
+        self.assertEqual(self.storage.verify_aggregates(), [])
+        self.assertAlmostEqual(self.analysis.get_balance(), -100.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from app import create_app
+from app.storage import Storage
+from app.analysis import FinancialAnalysis, choose_bucket
+from helpers import StorageTestCase
+
+
+class TestTimeSeries(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        for month in range(1, 7):
+            self.add(1000.0, 2, f"2023-{month:02d}-05T09:00", "доход")
+            self.add(100.0 * month, 1, f"2023-{month:02d}-20T18:30", "расход")
+        self.analysis = FinancialAnalysis(self.db_name)
+
+    def test_monthly_rollup(self):
+        df = self.analysis.get_time_series("month")
+        self.assertEqual(df["bucket"].tolist(), [f"2023-{m:02d}" for m in range(1, 7)])
+        self.assertEqual(df["expense"].tolist(), [100.0 * m for m in range(1, 7)])
+        self.assertAlmostEqual(df["balance"].iloc[-1], self.analysis.get_balance())
+        self.assertAlmostEqual(df["expense_avg"].iloc[2], 200.0)
+
+    def test_quarter_and_opening_balance(self):
+        df = self.analysis.get_time_series("quarter", date_from="2023-04-01")
+        self.assertEqual(df["bucket"].tolist(), ["2023-Q2"])
+        self.assertAlmostEqual(df["balance"].iloc[0], self.analysis.get_balance())
+
+    def test_auto_bucket_bounds_points(self):
+        self.assertEqual(choose_bucket("2023-01-01", "2023-03-01"), "day")
+        self.assertEqual(choose_bucket("2020-01-01", "2023-01-01"), "month")
+        self.assertEqual(self.analysis.get_time_series().attrs["bucket"], "week")
+
+
+class TestChartData(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app({"DATABASE": os.path.join(self.tmp.name, "tables.db"), "RENDER_PROCESSES": 0})
+        self.client = self.app.test_client()
+        self.storage = Storage(self.app.config["DATABASE"])
+        self.storage.add_category("Ремонт", "расход")
+        self.storage.add_category("Взносы", "доход")
+        for day in range(1, 29):
+            self.storage.add_operation({"amount": 10.0 * day, "category_id": 1, "date": f"2023-02-{day:02d}T10:00",
+                                        "operation_type": "расход", "comment": ""})
+        self.storage.add_operation({"amount": 5000.0, "category_id": 2, "date": "2023-02-01T09:00",
+                                    "operation_type": "доход", "comment": ""})
+
+    def tearDown(self):
+        self.storage.db.close_all()
+        self.tmp.cleanup()
+
+    def test_chart_data(self):
+        analysis = FinancialAnalysis(self.app.config["DATABASE"])
+        chart = analysis.chart_data("top_expenses_and_incomes")
+        self.assertEqual(chart["labels"], ["Ремонт"] * 10 + ["Взносы"])
+        self.assertEqual(chart["series"][0]["values"][:2], [280.0, 270.0])
+        self.assertEqual(chart["series"][1]["values"], [None] * 10 + [5000.0])
+        series = analysis.chart_data("income_vs_expenses")
+        self.assertEqual(series["type"], "line")
+        self.assertEqual(sum(series["series"][1]["values"]), 4060.0)
+
+    def test_gzip_and_conditional_get(self):
+        response = self.client.get("/api/charts/income_vs_expenses", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        chart = json.loads(gzip.decompress(response.data))
+        self.assertEqual(chart["series"][0]["name"], "Доходы")
+        etag = response.headers["ETag"]
+        cached = self.client.get("/api/charts/income_vs_expenses", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.storage.delete_operation(1)
+        changed = self.client.get("/api/charts/income_vs_expenses", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotIn("Content-Encoding", changed.headers)
+        self.assertEqual(self.client.get("/api/charts/unknown").status_code, 404)
+
+    def test_analysis_page_modes(self):
+        page = self.client.get("/analysis").get_data(as_text=True)
+        self.assertIn('data-src="/api/charts/income_vs_expenses"', page)
+        page = self.client.get("/analysis?render=png").get_data(as_text=True)
+        self.assertIn("/charts/income_vs_expenses.png", page)
+        self.assertNotIn("charts.js", page)
+        # Приложение под префиксом URL (SCRIPT_NAME)
+        page = self.client.get("/analysis", base_url="http://localhost/house/").get_data(as_text=True)
+        self.assertIn('src="/house/static/js/charts.js"', page)
+
+
+if __name__ == "__main__":
+    unittest.main()
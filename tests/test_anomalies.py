@@ -0,0 +1,96 @@
+import unittest
+from app import create_app
+from app.anomalies import AnomalyDetector
+from app.snapshot import OperationsSnapshot
+from helpers import StorageTestCase
+
+
+class TestAnomalies(StorageTestCase):
+    CATEGORIES = (("Ремонт", "расход"), ("Краска", "расход"), ("Взносы", "доход"))
+
+    def setUp(self):
+        super().setUp()
+        for day in range(1, 21):
+            self.add(1000 + day * 10, 1, f"2024-01-{day:02d}T10:00")
+            self.add(200, 2, f"2024-02-{day:02d}T10:00")
+        self.add(100000, 3, "2024-01-15T10:00", "доход")
+        self.detector = AnomalyDetector(OperationsSnapshot(self.db_name))
+
+    def test_outlier_found_incrementally(self):
+        self.assertEqual(self.detector.outliers(), [])
+        self.add(50000, 1, "2024-03-01T10:00")
+        outliers = self.detector.outliers()
+        self.assertEqual(len(outliers), 1)
+        self.assertEqual(outliers[0]["amount"], 50000.0)
+        self.assertEqual(outliers[0]["category"], "Ремонт")
+        self.assertEqual(outliers[0]["median"], 1110.0)
+        self.assertEqual(outliers[0]["reasons"], ["robust_z", "rolling"])
+        self.assertEqual(self.detector.stats, {"full": 1, "incremental": 1, "unchanged": 0})
+        # Одинаковые суммы (MAD = 0) и новая сумма той же категории
+        self.add(900, 2, "2024-03-02T10:00")
+        self.assertEqual([item["amount"] for item in self.detector.outliers()], [50000.0, 900.0])
+
+    def test_incremental_matches_full_recompute(self):
+        self.detector.update()
+        self.add(50000, 1, "2023-12-31T10:00")  # Задним числом: меняются скользящие пороги категории
+        self.add(180, 2, "2024-03-01T10:00")
+        fresh = AnomalyDetector(OperationsSnapshot(self.db_name))
+        self.assertEqual(self.detector.outliers(), fresh.outliers())
+        self.assertEqual(self.detector.stats["incremental"], 1)
+
+    def test_changes_trigger_full_recompute(self):
+        self.add(50000, 1, "2024-03-01T10:00")
+        self.assertEqual(len(self.detector.outliers()), 1)
+        with self.storage.db.connection() as conn:
+            conn.execute("DELETE FROM operations WHERE amount = 5000000")
+            conn.execute("UPDATE data_version SET version = version + 1")
+        self.assertEqual(self.detector.outliers(), [])
+        self.assertEqual(self.detector.stats["full"], 2)
+
+    def test_stale_view_is_not_counted_twice(self):
+        snapshot = self.detector.snapshot
+        older = snapshot.view()
+        self.add(300, 2, "2024-02-21T10:00")
+        newer = snapshot.view()
+        views = iter([newer, older, newer])
+        snapshot.view = lambda: next(views)
+        for _ in range(3):
+            self.detector.update()
+        self.assertEqual(self.detector.size, len(newer[1]))
+        self.assertEqual(self.detector.stats, {"full": 1, "incremental": 0, "unchanged": 2})
+        self.assertEqual(self.detector._monthly[(1, "2024-02")], 430000)
+        self.assertEqual(len(self.detector._frames[1]), 21)
+
+    def test_budget_overruns(self):
+        self.storage.set_budget(1, 15000)
+        self.storage.set_budget(2, 10000)
+        self.assertEqual(self.storage.get_budgets(), {1: 1500000, 2: 1000000})
+        report = self.detector.budget_overruns(self.storage.get_budgets(), month="2024-01")
+        self.assertEqual(report[0]["category"], "Ремонт")
+        self.assertEqual(report[0]["spent"], 22100.0)
+        self.assertTrue(report[0]["over"])
+        self.assertEqual(report[0]["over_months"], 1)
+        self.assertFalse(report[1]["over"])
+        self.add(6500, 2, "2024-02-21T10:00")
+        february = self.detector.budget_overruns(self.storage.get_budgets(), month="2024-02")
+        self.assertEqual([(item["category_id"], item["over"]) for item in february], [(2, True), (1, False)])
+        self.storage.set_budget(2, None)
+        self.assertEqual(self.storage.get_budgets(), {1: 1500000})
+
+    def test_routes(self):
+        app = create_app({"DATABASE": self.db_name, "RENDER_PROCESSES": 0})
+        client = app.test_client()
+        self.add(50000, 1, "2024-03-01T10:00")
+        response = client.post("/anomalies/budgets", data={"category_id": "1", "monthly_limit": "100"})
+        self.assertEqual(response.status_code, 302)
+        data = client.get("/api/anomalies?month=2024-03").get_json()
+        self.assertEqual(data["outliers"][0]["amount"], 50000.0)
+        self.assertTrue(data["budgets"][0]["over"])
+        page = client.get("/anomalies?month=2024-03")
+        self.assertEqual(page.status_code, 200)
+        self.assertIn("Ремонт", page.get_data(as_text=True))
+        self.assertEqual(client.get("/api/anomalies?limit=x").status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import unittest
+from app.analysis import FinancialAnalysis
+from app.archive import archive_dir
+from helpers import StorageTestCase
+
+
+class TestArchive(StorageTestCase):
+    APP_CONFIG = {}
+
+    def setUp(self):
+        super().setUp()
+        for year in (2021, 2022, 2023):
+            self.add(1000.0, 2, f"{year}-03-01T10:00", "доход")
+            self.add(150.25, 1, f"{year}-06-15T12:00", "расход")
+
+    def test_closed_years_move_to_archives(self):
+        balance = FinancialAnalysis(self.storage.db_name).get_balance()
+        self.assertEqual(self.storage.archive_closed_years(2022), [(2021, 2), (2022, 2)])
+        self.assertTrue(os.path.exists(os.path.join(archive_dir(self.storage.db_name), "2021.db")))
+        self.assertEqual([row[3][:4] for row in self.storage.get_operations()], ["2023", "2023"])
+        self.assertAlmostEqual(FinancialAnalysis(self.storage.db_name).get_balance(), balance)
+        self.assertEqual(self.storage.verify_aggregates(), [])
+        self.storage.rebuild_aggregates()
+        self.assertEqual(self.storage.verify_aggregates(), [])
+        self.assertEqual(len(list(self.storage.iter_operation_chunks())[0]), 2)
+        history = [row for chunk in self.storage.iter_operation_chunks(include_archive=True) for row in chunk]
+        self.assertEqual([row[2][:4] for row in history], ["2021", "2021", "2022", "2022", "2023", "2023"])
+        self.assertEqual(self.storage.count_operations({"date_to": "2022-12-31"}, include_archive=True), 4)
+        self.assertEqual(self.storage.get_archives()[0],
+                         {"year": 2021, "rows": 2, "income": 1000.0, "expense": 150.25, "balance": 849.75})
+
+    def test_closed_years_are_read_only(self):
+        self.storage.archive_closed_years(2021)
+        with self.assertRaises(ValueError):
+            self.add(10.0, 1, "2021-12-31T23:00", "расход")
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.storage.db.connection() as conn:
+                conn.execute("UPDATE operations SET date = 0")
+        result = self.storage.ingest_operations([{"amount": 5, "category_id": 1, "date": "2020-01-01T00:00",
+                                                  "operation_type": "расход"}])[0]
+        self.assertEqual(result["rejected"], 1)
+        self.add(10.0, 1, "2022-01-01T00:00", "расход")
+        self.assertEqual(self.storage.archive_closed_years(2021), [])  # Уже в архиве
+        with self.assertRaises(ValueError):
+            self.storage.archive_closed_years(2030)  # Год не закрыт
+        self.assertEqual([item["year"] for item in self.storage.get_archives()], [2021])
+
+    def test_many_closed_years(self):
+        # Больше лет, чем SQLite позволяет подключить к одному соединению
+        for year in range(2005, 2021):
+            self.add(10.0, 1, f"{year}-05-01T10:00", "расход")
+        archived = self.storage.archive_closed_years(2022)
+        self.assertEqual(len(archived), 18)
+        self.assertEqual(self.storage.verify_aggregates(), [])
+        self.assertEqual(self.storage.count_operations(include_archive=True), 22)
+        history = [row[2][:4] for chunk in self.storage.iter_operation_chunks(chunk_size=3, include_archive=True)
+                   for row in chunk]
+        self.assertEqual(history, sorted(history))
+        self.assertEqual(len(history), 22)
+        self.assertEqual(self.storage.get_archive_report(2005)["categories"][0]["total"], 10.0)
+
+    def test_analysis_scope(self):
+        self.storage.archive_closed_years(2022)
+        analysis = FinancialAnalysis(self.storage.db_name)
+        self.assertEqual(analysis.category_totals("расход"), [("Ремонт", 450.75)])
+        portfolio = self.client.get("/portfolio?format=json").json
+        self.assertIn({"name": "Ремонт", "operation_type": "расход", "total": 450.75, "count": 3},
+                      portfolio["categories"])
+        self.assertIn("только открытые годы", self.client.get("/analysis").get_data(as_text=True))
+
+    def test_analysis_with_archives(self):
+        self.storage.archive_closed_years(2022)
+        analysis = FinancialAnalysis(self.storage.db_name, include_archive=True)
+        self.assertEqual(len(analysis.get_top_expenses_or_incomes(operation_type="расход")), 3)
+        series = analysis.get_time_series(bucket="year")
+        self.assertEqual(series["bucket"].tolist(), ["2021", "2022", "2023"])
+        self.assertAlmostEqual(series["balance"].iloc[-1], analysis.get_balance())
+        self.assertEqual(analysis.get_category_summary(date_to="2021-12-31")["total"].tolist(), [150.25])
+        self.add(99.0, 1, "2023-07-01T10:00", "расход")
+        self.assertEqual(len(analysis.get_top_expenses_or_incomes(operation_type="расход")), 4)
+        self.storage.archive_closed_years(2023)  # Перенос ещё одного года: снимок перечитывается
+        self.assertEqual(len(analysis.get_top_expenses_or_incomes(operation_type="расход")), 4)
+        self.assertEqual(analysis.snapshot.archive_years, (2021, 2022, 2023))
+        self.assertEqual(len(FinancialAnalysis(self.storage.db_name).get_top_expenses_or_incomes()), 0)
+        data = self.client.get("/api/charts/top_expenses?archive=1").json
+        self.assertEqual(len(data["labels"]), 4)
+        self.assertEqual(self.client.get("/api/charts/top_expenses").json["labels"], [])
+        page = self.client.get("/analysis?archive=1").get_data(as_text=True)
+        self.assertNotIn("только открытые годы", page)
+        self.assertIn("/api/charts/top_expenses_and_incomes?archive=1", page)
+        self.assertEqual(self.client.get("/charts/top_expenses.png?archive=1").status_code, 200)
+
+    def test_year_report_pages(self):
+        self.storage.archive_closed_years(2021)
+        report = self.client.get("/archive/2021", headers={"Accept": "application/json"}).json
+        self.assertEqual(report["categories"][0], {"name": "Взносы", "operation_type": "доход",
+                                                   "total": 1000.0, "count": 1})
+        self.assertEqual([month["month"] for month in report["months"]], ["2021-03", "2021-06"])
+        self.assertEqual(self.client.get("/archive/2022").status_code, 404)
+        self.assertIn("849.75", self.client.get("/archive").get_data(as_text=True))
+        export = self.client.get("/export_operations_csv?archive=1").get_data(as_text=True)
+        self.assertEqual(export.count("\n"), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from app import create_asgi_app
+
+
+class TestAsgiAdapter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.app = create_asgi_app({"WORKER_THREADS": 2, "RENDER_PROCESSES": 0})
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def request(self, path, query_string=b""):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query_string,
+                 "headers": [(b"host", b"localhost")], "http_version": "1.1", "scheme": "http"}
+        asyncio.run(self.app(scope, receive, send))
+        status = messages[0]["status"]
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        return status, body, messages
+
+    def test_index_and_streaming_export(self):
+        status, body, _ = self.request("/")
+        self.assertEqual(status, 200)
+        self.assertIn("Текущий баланс".encode("utf-8"), body)
+        status, body, messages = self.request("/export_operations_csv")
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith(b"amount,category_id"))
+        self.assertFalse(messages[-1]["more_body"])
+
+    def test_lifespan_shutdown_stops_executors(self):
+        queue = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return queue.pop(0)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(self.app({"type": "lifespan"}, receive, send))
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        with self.assertRaises(RuntimeError):
+            self.app.executors.workers.submit(print)
+
+
+if __name__ == "__main__":
+    unittest.main()
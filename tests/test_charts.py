@@ -0,0 +1,77 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from app.charts import ChartCache
+
+
+class TestChartCache(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.renders = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def render(self, payload):
+        def build():
+            self.renders.append(payload)
+            return payload
+        return build
+
+    def test_same_version_is_cached(self):
+        cache = ChartCache(executor=self.executor)
+        first = cache.get("chart", 1, self.render(b"v1"))
+        second = cache.get("chart", 1, self.render(b"v1"))
+        self.assertIs(first, second)
+        self.assertEqual(self.renders, [b"v1"])
+
+    def test_stale_entry_is_rerendered_in_background(self):
+        cache = ChartCache(executor=self.executor)
+        cache.get("chart", 1, self.render(b"v1"))
+        stale = cache.get("chart", 2, self.render(b"v2"))
+        self.assertEqual(stale.png, b"v1")
+        self.executor.shutdown(wait=True)
+        fresh = cache.get("chart", 2, self.render(b"v2"))
+        self.assertEqual(fresh.png, b"v2")
+        self.assertNotEqual(fresh.etag, stale.etag)
+
+    def test_concurrent_misses_render_once(self):
+        cache = ChartCache(executor=self.executor)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            self.renders.append(b"v1")
+            return b"v1"
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.get("chart", 1, slow)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(cache.get("chart", 1, self.render(b"v1"))))
+        second.start()
+        while not cache.stats["waits"]:
+            second.join(0.01)
+        release.set()
+        first.join()
+        second.join()
+        self.assertIs(results[0], results[1])
+        self.assertEqual(self.renders, [b"v1"])
+        self.assertEqual((cache.stats["misses"], cache.stats["waits"]), (1, 1))
+
+    def test_lru_eviction_by_size(self):
+        cache = ChartCache(max_bytes=10, executor=self.executor)
+        cache.get("a", 1, self.render(b"aaaa"))
+        cache.get("b", 1, self.render(b"bbbb"))
+        cache.get("a", 1, self.render(b"aaaa"))
+        cache.get("c", 1, self.render(b"cccc"))
+        self.assertEqual(cache.stats["evictions"], 1)
+        cache.get("a", 1, self.render(b"aaaa"))
+        self.assertEqual(self.renders.count(b"aaaa"), 1)
+        cache.get("b", 1, self.render(b"bbbb"))
+        self.assertEqual(self.renders.count(b"bbbb"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from helpers import StorageTestCase
+
+
+class TestBatchIngest(StorageTestCase):
+    APP_CONFIG = {"INGEST_MAX_ITEMS": 100}
+    CATEGORIES = (("Ремонт", "расход"),)
+
+    def operation(self, amount=100.5, **fields):
+        return dict({"amount": amount, "category_id": 1, "date": "2023-01-01T10:00",
+                     "operation_type": "расход", "comment": "счёт"}, **fields)
+
+    def post(self, payload, key=None):
+        headers = {"Idempotency-Key": key} if key else {}
+        return self.client.post("/api/operations/batch", json=payload, headers=headers)
+
+    def test_batch_is_inserted(self):
+        response = self.post([self.operation(), self.operation(amount=20)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["accepted"], 2)
+        self.assertEqual([row[1] for row in self.storage.get_operations()], [20.0, 100.5])
+        self.assertEqual(self.storage.verify_aggregates(), [])
+
+    def test_invalid_items_reject_whole_batch(self):
+        response = self.post({"operations": [
+            self.operation(), self.operation(amount=-1), self.operation(category_id=99),
+            self.operation(date="01.01.2023"), self.operation(operation_type="перевод"), "x",
+        ]})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual([error["index"] for error in response.json["errors"]], [1, 2, 3, 4, 5])
+        self.assertEqual(self.storage.get_operations(), [])
+
+    def test_idempotency_key(self):
+        first = self.post([self.operation()], key="batch-1")
+        retry = self.post([self.operation()], key="batch-1")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(len(self.storage.get_operations()), 1)
+        conflict = self.post([self.operation(amount=1)], key="batch-1")
+        self.assertEqual(conflict.status_code, 409)
+
+    def test_limits(self):
+        self.assertEqual(self.post({"operations": "x"}).status_code, 400)
+        self.assertEqual(self.post([self.operation()] * 101).status_code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import io
+import os
+import time
+import unittest
+from app import create_app
+from app.jobs import JobQueue
+from app.shards import ShardRouter
+from helpers import StorageTestCase
+
+
+class TestJobQueue(StorageTestCase):
+    APP_CONFIG = {}
+    CATEGORIES = (("Ремонт", "расход"),)
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = self.app.extensions["jobs"]
+
+    def tearDown(self):
+        self.jobs.shutdown()
+        self.jobs.db.close_all()
+        super().tearDown()
+
+    def csv(self, rows):
+        lines = ["amount,category_id,date,operation_type,comment"]
+        lines += [f"{100 + i},1,2023-01-{i % 28 + 1:02d}T10:00,расход,счёт {i}" for i in range(rows)]
+        return io.BytesIO("\n".join(lines).encode("utf-8"))
+
+    def submit_import(self, rows):
+        response = self.client.post("/jobs/import_operations", data={"file": (self.csv(rows), "ops.csv")},
+                                    headers={"Accept": "application/json"})
+        self.assertEqual(response.status_code, 202)
+        return response.json["id"]
+
+    def status(self, job_id):
+        return self.client.get(f"/jobs/{job_id}", headers={"Accept": "application/json"}).json
+
+    def test_import_runs_in_background(self):
+        job_id = self.submit_import(3)
+        self.assertEqual(self.status(job_id)["status"], "queued")
+        self.assertEqual(self.storage.get_operations(), [])
+        self.assertTrue(self.jobs.run_pending())
+        job = self.status(job_id)
+        self.assertEqual((job["status"], job["processed"], job["total"], job["progress"]), ("done", 3, 3, 1.0))
+        self.assertEqual(job["result"]["accepted"], 3)
+        self.assertEqual(len(self.storage.get_operations()), 3)
+        self.assertFalse(os.listdir(self.jobs.job_dir(job_id)))  # Загруженный файл удалён
+        self.assertFalse(self.jobs.run_pending())
+
+    def test_export_artifact(self):
+        self.storage.add_operation({"amount": 150.5, "category_id": 1, "date": "2023-01-05T00:00",
+                                    "operation_type": "расход", "comment": "x"})
+        response = self.client.post("/jobs/export_operations", data={"format": "csv"},
+                                    headers={"Accept": "application/json"})
+        job_id = response.json["id"]
+        self.jobs.run_pending()
+        job = self.status(job_id)
+        self.assertEqual((job["status"], job["total"]), ("done", 1))
+        artifact = self.client.get(job["artifact_url"])
+        self.assertEqual(artifact.status_code, 200)
+        self.assertIn("150.5,1,2023-01-05T00:00,расход,x", artifact.get_data(as_text=True))
+
+    def test_cancel(self):
+        job_id = self.submit_import(2)
+        response = self.client.post(f"/jobs/{job_id}/cancel", headers={"Accept": "application/json"})
+        self.assertEqual(response.json["status"], "cancelled")
+        self.assertFalse(self.jobs.run_pending())
+        self.assertEqual(self.client.get(f"/jobs/{job_id}/artifact").status_code, 404)
+
+    def test_cancel_running_import_rolls_back(self):
+        job_id = self.submit_import(30)
+
+        def progress(processed):
+            self.jobs.cancel(job_id)
+            context.progress(processed, force=True)
+
+        original = self.storage.import_operations
+        context = None
+
+        def import_operations(job, job_context):
+            nonlocal context
+            context = job_context
+            with open(job_context.path(job["params"]["filename"]), encoding="utf-8") as file:
+                original(file, batch_size=10, progress=progress)
+            return {}, None
+
+        self.jobs.handlers = dict(self.jobs.handlers, import_operations=import_operations)
+        self.jobs.run_pending()
+        self.assertEqual(self.status(job_id)["status"], "cancelled")
+        self.assertEqual(self.storage.get_operations(), [])
+
+    def test_failed_job_reports_error(self):
+        job_id = self.jobs.submit("export_operations", self.storage.db_name,
+                                  {"filters": {"date_from": "01.01.2023"}, "format": "csv"})
+        self.jobs.run_pending()
+        job = self.jobs.get(job_id)
+        self.assertEqual(job["status"], "failed")
+        self.assertTrue(job["error"])
+
+    def test_stale_job_is_requeued_and_retention(self):
+        queue = JobQueue(self.jobs.base_dir, {"JOB_WORKERS": 0, "JOB_STALE_SECONDS": 0, "JOB_RETENTION_SECONDS": 0},
+                         handlers={"noop": lambda job, context: ({"ok": True}, None)})
+        job_id = queue.submit("noop", self.storage.db_name)
+        self.assertIsNotNone(queue._claim())  # Исполнитель «упал», не завершив задачу
+        time.sleep(0.01)
+        self.assertTrue(queue.run_pending())
+        self.assertEqual(queue.get(job_id)["result"], {"ok": True})
+        time.sleep(0.01)
+        self.assertEqual(queue.cleanup(), [job_id])
+        self.assertIsNone(queue.get(job_id))
+        self.assertFalse(os.path.exists(queue.job_dir(job_id)))
+
+    def test_requeued_job_is_not_finished_by_old_worker(self):
+        queue = JobQueue(self.jobs.base_dir, {"JOB_WORKERS": 0, "JOB_STALE_SECONDS": 0},
+                         handlers={"noop": lambda job, context: ({"ok": True}, None)})
+        job_id = queue.submit("noop", self.storage.db_name)
+        stale = queue._claim()
+        time.sleep(0.01)
+        current = queue._claim()  # Прежний исполнитель не отмечался, задачу взял другой
+        self.assertEqual(current["id"], job_id)
+        self.assertTrue(queue._report_progress(stale, 1, None, time.time()))
+        self.assertFalse(queue._finish(stale, "failed", 1, error="поздно"))
+        self.assertFalse(queue._report_progress(current, 1, None, time.time()))
+        self.assertTrue(queue._finish(current, "done", 1, {"ok": True}))
+        self.assertEqual(queue.get(job_id)["result"], {"ok": True})
+
+    def test_queue_resumes_on_first_request(self):
+        job_id = self.submit_import(2)
+        self.jobs.db.close_all()
+        app = create_app({"DATABASE": self.app.config["DATABASE"], "JOBS_DIR": self.app.config["JOBS_DIR"],
+                          "SHARDS_DIR": self.app.config["SHARDS_DIR"],
+                          "RENDER_PROCESSES": 0, "JOB_HEARTBEAT_SECONDS": 0.05})
+        jobs = app.extensions["jobs"]
+        self.assertEqual(app.test_cli_runner().invoke(args=["property", "list"]).exit_code, 0)
+        self.assertEqual(jobs._threads, [])  # Команды CLI задачи не забирают
+        self.assertEqual(jobs.get(job_id)["status"], "queued")
+        app.test_client().get("/jobs")
+        for _ in range(100):
+            if jobs.get(job_id)["status"] == "done":
+                break
+            time.sleep(0.05)
+        jobs.shutdown()
+        self.assertEqual(jobs.get(job_id)["status"], "done")
+
+    def test_html_flow(self):
+        shard = ShardRouter(self.app.config["SHARDS_DIR"]).storage("house1", create=True)
+        self.addCleanup(shard.db.close_all)
+        response = self.client.post("/p/house1/jobs/report")
+        self.assertEqual(response.status_code, 302)
+        page = self.client.get(response.headers["Location"])
+        self.assertIn("refresh", page.get_data(as_text=True))
+        self.assertIn("property_house1.db", self.jobs.list()[0]["db_name"])
+        self.assertEqual(self.client.get("/jobs").status_code, 200)
+        self.assertEqual(self.client.get("/jobs/missing").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from app import create_app, metrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_render_is_cumulative(self):
+        histogram = metrics.Histogram("demo_seconds", "Демо", ("route",), buckets=(0.1, 1))
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5, "a")
+        text = histogram.render()
+        self.assertIn('demo_seconds_bucket{route="a",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{route="a",le="1"} 2', text)
+        self.assertIn('demo_seconds_bucket{route="a",le="+Inf"} 3', text)
+        self.assertIn('demo_seconds_count{route="a"} 3', text)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app({"DATABASE": os.path.join(self.tmp.name, "tables.db"),
+                               "RENDER_PROCESSES": 0})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_requests_queries_and_templates_are_recorded(self):
+        self.client.get("/")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{method="GET",endpoint="index",status="200"}', text)
+        self.assertIn('sql_query_duration_seconds_count{statement="select",table="agg_balance"}', text)
+        self.assertIn('template_render_duration_seconds_count{template="index.html"}', text)
+        self.assertIn("db_connections_total", text)
+
+    def test_slow_query_log(self):
+        metrics.configure({"SLOW_QUERY_MS": 0})
+        try:
+            with self.assertLogs("app.sql.slow", level="WARNING"):
+                self.client.get("/")
+        finally:
+            metrics.configure(self.app.config)
+
+    def test_profiler_toggle(self):
+        self.assertEqual(self.client.post("/metrics/profile", data={"action": "start"}).status_code, 403)
+        self.assertFalse(self.app.extensions["profiler"].running)
+        app = create_app({"DATABASE": self.app.config["DATABASE"], "RENDER_PROCESSES": 0,
+                          "PROFILER_CONTROL": True})
+        client = app.test_client()
+        response = client.post("/metrics/profile", data={"action": "start"})
+        self.assertTrue(response.json["running"])
+        client.get("/view_operations")
+        response = client.post("/metrics/profile", data={"action": "stop"})
+        self.assertFalse(response.json["running"])
+
+
+if __name__ == "__main__":
+    unittest.main()
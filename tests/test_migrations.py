@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from app import migrations
+from app.analysis import FinancialAnalysis
+from app.storage import Storage
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, "tables.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def create_legacy_database(self):
+        """База в исходной схеме: суммы REAL, даты TEXT, без user_version"""
+        conn = sqlite3.connect(self.db_name)
+        migrations._baseline(conn)
+        conn.execute("INSERT INTO categories (name, type) VALUES ('Ремонт', 'расход'), ('Взносы', 'доход')")
+        conn.executemany("""
+            INSERT INTO operations (amount, category_id, date, operation_type, comment)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(0.1, 1, "2023-01-05T09:30", "расход", "a"),
+              (0.2, 1, "2023-01-06T10:00", "расход", "b"),
+              (1000.55, 2, "2023-02-01T00:00", "доход", "c")])
+        conn.commit()
+        conn.close()
+
+    def test_legacy_database_is_converted(self):
+        self.create_legacy_database()
+        storage = Storage(self.db_name)
+        try:
+            with storage.db.connection() as conn:
+                self.assertEqual(migrations.get_version(conn), migrations.MIGRATIONS[-1][0])
+                self.assertEqual(conn.execute("""
+                    SELECT amount, date, typeof(amount), typeof(date) FROM operations ORDER BY id LIMIT 1
+                """).fetchone(), (10, 1672911000, "integer", "integer"))
+                triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+                self.assertIn("operations_changelog_delete", triggers)
+            self.assertEqual(storage.verify_aggregates(), [])
+            self.assertEqual(storage.get_operations()[0][1:4], (1000.55, "Взносы", "2023-02-01T00:00"))
+            self.assertAlmostEqual(FinancialAnalysis(self.db_name).get_balance(), 1000.25)
+            self.assertEqual([row[0] for row in storage.search_operations("взносы")[0]], [3])
+        finally:
+            storage.db.close_all()
+
+    def test_legacy_rows_are_normalised_or_rejected(self):
+        conn = sqlite3.connect(self.db_name)
+        migrations._baseline(conn)
+        conn.execute("INSERT INTO categories (name, type) VALUES ('Ремонт', 'расход')")
+        conn.executemany("""
+            INSERT INTO operations (amount, category_id, date, operation_type, comment)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(10, 1, "2023-01-05T09:30", " Расход ", "тип"),
+              (20, 1, "05.01.2023", "расход", "дата"),
+              (30, 1, "2023-01-05 09:30:00", "расход", "секунды"),
+              (40, 1, "2023-01-05T09:30", "перевод", "неизвестный тип"),
+              (50, 1, "вчера", "расход", "неизвестная дата"),
+              (-5, 1, "2023-01-05T09:30", "расход", "отрицательная сумма")])
+        conn.commit()
+        conn.close()
+        with self.assertLogs("app.migrations", "WARNING"):
+            storage = Storage(self.db_name)
+        try:
+            with storage.db.connection() as conn:
+                self.assertEqual(conn.execute("SELECT id, amount, date, operation_type FROM operations ORDER BY id")
+                                 .fetchall(), [(1, 1000, 1672911000, "расход"), (2, 2000, 1672876800, "расход"),
+                                               (3, 3000, 1672911000, "расход")])
+                self.assertEqual([row[0] for row in conn.execute("SELECT id FROM operations_rejected ORDER BY id")],
+                                 [4, 5, 6])
+            self.assertEqual(storage.verify_aggregates(), [])
+            storage.add_operation({"amount": 1.0, "category_id": 1, "date": "2023-02-01T10:00",
+                                   "operation_type": "расход", "comment": ""})
+            with storage.db.connection() as conn:
+                self.assertEqual(conn.execute("SELECT MAX(id) FROM operations").fetchone()[0], 7)
+        finally:
+            storage.db.close_all()
+
+    def test_concurrent_migrate(self):
+        self.create_legacy_database()
+        conn = sqlite3.connect(self.db_name)
+        conn.executemany("""
+            INSERT INTO operations (amount, category_id, date, operation_type, comment)
+            VALUES (12.5, 1, '2023-03-01T10:00', 'расход', ?)
+        """, [(str(i),) for i in range(20000)])
+        conn.commit()
+        conn.close()
+        barrier = threading.Barrier(2)
+        applied, errors = [], []
+
+        def run():
+            conn = sqlite3.connect(self.db_name, timeout=30)
+            try:
+                barrier.wait()
+                applied.append(migrations.migrate(conn))
+                conn.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(len(versions) for versions in applied), [0, len(migrations.MIGRATIONS)])
+        conn = sqlite3.connect(self.db_name)
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM operations_rejected").fetchone()[0], 0)
+            self.assertEqual(conn.execute("SELECT MIN(amount), MAX(amount) FROM operations").fetchone(),
+                             (10, 100055))
+        finally:
+            conn.close()
+
+    def test_constraints(self):
+        storage = Storage(self.db_name)
+        storage.add_category("Ремонт", "расход")
+        try:
+            for row in ((100, 1, 0, "перевод"), (0, 1, 0, "расход")):
+                with self.assertRaises(sqlite3.IntegrityError):
+                    with storage.db.connection() as conn:
+                        conn.execute("""
+                            INSERT INTO operations (amount, category_id, date, operation_type)
+                            VALUES (?, ?, ?, ?)
+                        """, row)
+            with self.assertRaises(ValueError):
+                storage.add_operation({"amount": 0.001, "category_id": 1, "date": "2023-01-01T10:00",
+                                       "operation_type": "расход", "comment": ""})
+        finally:
+            storage.db.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
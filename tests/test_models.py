@@ -1,5 +1,5 @@
 import unittest
-from models import FinancialOperation
+from app.models import FinancialOperation
 
 class TestFinancialOperation(unittest.TestCase):
     def test_operation_creation(self):
@@ -0,0 +1,65 @@
+import os
+import unittest
+from app.storage import fts_query
+from helpers import StorageTestCase
+
+
+class TestOperationSearch(StorageTestCase):
+    APP_CONFIG = {}
+    CATEGORIES = (("Кровля", "расход"), ("Фасад", "расход"))
+
+    def setUp(self):
+        super().setUp()
+        self.note(1, "замена листов, roof leak")
+        self.note(2, "покраска фасада и кровли")
+        self.note(2, "леса <b>аренда</b>")
+
+    def note(self, category_id, comment):
+        self.add(100.0, category_id, "2023-01-05T10:00", comment=comment)
+
+    def ids(self, query, **filters):
+        return [row[0] for row in self.storage.search_operations(query, filters)[0]]
+
+    def test_query_syntax(self):
+        self.assertEqual(fts_query('кровля OR "roof'), '"кровля"* OR "roof"*')
+        self.assertEqual(fts_query("OR крыша OR"), '"крыша"*')
+        self.assertEqual(fts_query("roof or кровля Или краска"), '"roof"* OR "кровля"* OR "краска"*')
+        with self.assertRaises(ValueError):
+            fts_query(" - ")
+
+    def test_comments_and_category_names(self):
+        self.assertEqual(sorted(self.ids("кровл")), [1, 2])  # Категория первой, комментарий второй
+        self.assertEqual(sorted(self.ids("roof OR аренда")), [1, 3])
+        self.assertEqual(sorted(self.ids("roof or аренда")), [1, 3])
+        self.assertEqual(sorted(self.ids("roof или аренда")), [1, 3])
+        self.assertEqual(self.ids("фасад покраска"), [2])
+        self.assertEqual(self.ids("кровл", date_from="2023-02-01"), [])
+
+    def test_index_follows_changes(self):
+        with open(os.path.join(self.tmp.name, "ops.csv"), "w", encoding="utf-8") as file:
+            file.write("amount,category_id,date,operation_type,comment\n50,1,2023-02-01T10:00,расход,водосток\n")
+        self.storage.load_operations_from_csv(os.path.join(self.tmp.name, "ops.csv"))
+        self.assertEqual(self.ids("водосток"), [4])
+        self.storage.update_category(1, "Крыша", "расход")
+        self.assertEqual(sorted(self.ids("крыша")), [1, 4])
+        with self.storage.db.connection() as conn:
+            conn.execute("UPDATE operations SET comment = 'герметик' WHERE id = 2")
+        self.assertEqual(self.ids("покраска"), [])
+        self.assertEqual(self.ids("герметик"), [2])
+        self.storage.delete_operation(4)
+        self.assertEqual(self.ids("водосток"), [])
+
+    def test_api_and_page(self):
+        response = self.client.get("/api/operations/search?q=фасад&limit=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json["results"]), 1)
+        self.assertEqual(response.json["next_page"], 2)
+        second = self.client.get("/api/operations/search?q=фасад&limit=1&page=2").json
+        self.assertIsNone(second["next_page"])
+        self.assertEqual(self.client.get("/api/operations/search?q=").status_code, 400)
+        page = self.client.get("/search_operations?q=аренда").get_data(as_text=True)
+        self.assertIn("&lt;b&gt;<mark>аренда</mark>&lt;/b&gt;", page)
+
+
+if __name__ == "__main__":
+    unittest.main()
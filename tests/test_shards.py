@@ -0,0 +1,110 @@
+import os
+import unittest
+from app import anomalies, create_app, db, snapshot
+from app.shards import ShardRouter, UnknownProperty, merge_partials, shard_partial
+from helpers import StorageTestCase
+
+
+class TestShards(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = self.app_config()
+        self.router = ShardRouter(self.config["SHARDS_DIR"])
+        for property_id, amounts in (("house-1", (100.0, 300.0)), ("house-2", (250.0,))):
+            storage = self.router.storage(property_id, create=True)
+            for name, category_type in self.CATEGORIES:
+                storage.add_category(name, category_type)
+            storage.add_operation({"amount": 1000.0, "category_id": 2, "date": "2023-01-01T10:00",
+                                   "operation_type": "доход", "comment": ""})
+            for amount in amounts:
+                storage.add_operation({"amount": amount, "category_id": 1, "date": "2023-01-02T10:00",
+                                       "operation_type": "расход", "comment": ""})
+
+    def tearDown(self):
+        for property_id in self.router.properties():
+            self.router.storage(property_id).db.close_all()
+        super().tearDown()
+
+    def test_router_isolates_properties(self):
+        self.assertEqual(self.router.properties(), ["house-1", "house-2"])
+        self.assertAlmostEqual(self.router.analysis("house-1").get_balance(), 600.0)
+        self.assertAlmostEqual(self.router.analysis("house-2").get_balance(), 750.0)
+        with self.assertRaises(ValueError):
+            self.router.db_name("../etc")
+        with self.assertRaises(UnknownProperty):
+            self.router.storage("house-3")
+        self.assertFalse(self.router.exists("house-3"))
+
+    def test_storage_cache_is_bounded(self):
+        router = ShardRouter(self.config["SHARDS_DIR"], cache_size=1)
+        first = router.storage("house-1")
+        router.storage("house-2")
+        self.assertEqual(len(router._storages), 1)
+        self.assertIsNot(router.storage("house-1"), first)
+
+    def test_evicted_shards_leave_registries(self):
+        router = ShardRouter(os.path.join(self.tmp.name, "flats"), cache_size=2)
+        base = os.path.abspath(router.base_dir)
+        self.addCleanup(lambda: [router._release(db_name) for db_name in list(router._storages)])
+
+        def shard_keys(registry):
+            # Ключ снимка — (путь, include_archive)
+            return [key for key in registry if (key[0] if isinstance(key, tuple) else key).startswith(base)]
+
+        for index in range(6):
+            storage = router.storage(f"flat-{index}", create=True)
+            anomalies.get_detector(storage.db_name).update()
+            router.analysis(f"flat-{index}").get_time_series()
+        for registry in (db._managers, snapshot._snapshots, anomalies._detectors):
+            self.assertLessEqual(len(shard_keys(registry)), 2)
+        self.assertEqual(sorted(shard_keys(snapshot._snapshots)),
+                         sorted((os.path.abspath(router.db_name(f"flat-{index}")), False) for index in (4, 5)))
+
+    def test_merge_partials(self):
+        partials = [shard_partial(property_id, self.router.db_name(property_id), n=2)
+                    for property_id in self.router.properties()]
+        report = merge_partials(partials, n=2)
+        self.assertEqual(report["properties"], 2)
+        self.assertAlmostEqual(report["balance"], 1350.0)
+        self.assertIn({"name": "Ремонт", "operation_type": "расход", "total": 650.0, "count": 3},
+                      report["categories"])
+        self.assertEqual([(row["property"], row["amount"]) for row in report["top"]["расход"]],
+                         [("house-1", 300.0), ("house-2", 250.0)])
+
+    def test_property_routes_and_portfolio(self):
+        client = create_app(self.config).test_client()
+        page = client.get("/p/house-2/view_operations").get_data(as_text=True)
+        self.assertIn('href="/p/house-2/analysis"', page)
+        self.assertEqual(client.get("/p/..%2Fx/").status_code, 404)
+        for path in ("/p/typo1/", "/p/crawler-2/view_operations", "/p/x3/api/charts/top_expenses"):
+            self.assertEqual(client.get(path).status_code, 404)
+        self.assertEqual(client.post("/p/x3/categories", data={"add": "1", "name": "a", "type": "расход"})
+                         .status_code, 404)
+        self.assertEqual(self.router.properties(), ["house-1", "house-2"])
+        report = client.get("/portfolio?format=json").json
+        self.assertEqual(report["properties"], 3)  # Основная база и два объекта
+        self.assertAlmostEqual(report["balance"], 1350.0)
+        self.assertEqual(client.get("/portfolio").status_code, 200)
+
+    def test_portfolio_in_process_pool(self):
+        app = create_app(dict(self.config, REPORT_PROCESSES=2))
+        try:
+            report = app.test_client().get("/portfolio?format=json").json
+        finally:
+            app.extensions["executors"].shutdown()
+        self.assertAlmostEqual(report["balance"], 1350.0)
+
+    def test_create_property_command(self):
+        app = create_app(self.config)
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["property", "create", "house-3"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(self.router.exists("house-3"))
+        self.assertEqual(runner.invoke(args=["property", "create", "house-3"]).exit_code, 1)
+        self.assertEqual(runner.invoke(args=["property", "list"]).output.split(), ["house-1", "house-2", "house-3"])
+        self.assertEqual(runner.invoke(args=["aggregates", "verify", "--property", "house-9"]).exit_code, 1)
+        self.router.storage("house-3").db.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from app import migrations
+from app.analysis import FinancialAnalysis
+from app.snapshot import OperationsSnapshot, bucket_label, to_epoch
+from helpers import StorageTestCase
+
+
+class TestOperationsSnapshot(StorageTestCase):
+    CATEGORIES = (("Ремонт", "расход"), ("Материалы", "расход"), ("Взносы", "доход"))
+
+    def setUp(self):
+        super().setUp()
+        self.add(1000.0, 3, "2023-01-05T09:00", "доход")
+        self.add(300.0, 1, "2023-01-20T18:30", "расход")
+        self.add(200.0, 2, "2023-02-10T12:00", "расход")
+        self.snapshot = OperationsSnapshot(self.db_name)
+
+    def test_full_load_and_queries(self):
+        self.assertAlmostEqual(self.snapshot.balance(), 500.0)
+        self.assertEqual(self.snapshot.category_summary("расход"), [("Материалы", 200.0), ("Ремонт", 300.0)])
+        self.assertEqual(self.snapshot.category_summary("расход", date_from="2023-02-01"), [("Материалы", 200.0)])
+        amounts, names, dates = self.snapshot.top(1, "расход")
+        self.assertEqual((amounts, names, dates), ([300.0], ["Ремонт"], ["2023-01-20T18:30"]))
+        self.assertEqual(self.snapshot.stats["full"], 1)
+
+    def test_incremental_insert_delete_and_update(self):
+        self.snapshot.refresh()
+        self.add(50.0, 1, "2023-03-01T10:00", "расход")
+        self.storage.delete_operation(1)
+        with self.storage.db.connection() as conn:
+            conn.execute("UPDATE operations SET amount = 25000 WHERE id = 3")
+            self.storage._bump_version(conn)
+        self.assertAlmostEqual(self.snapshot.balance(), -600.0)
+        self.assertEqual(self.snapshot.size, 3)
+        self.assertEqual(self.snapshot.stats, {"full": 1, "incremental": 1, "unchanged": 0})
+        self.snapshot.refresh()
+        self.assertEqual(self.snapshot.stats["unchanged"], 1)
+
+    def test_trimmed_changelog_forces_full_reload(self):
+        self.snapshot.refresh()
+        self.storage.delete_operation(2)
+        with self.storage.db.connection() as conn:
+            conn.execute("DELETE FROM operations_changelog")
+            conn.execute("INSERT INTO operations_changelog (operation_id, kind) VALUES (0, 'update')")
+        self.assertAlmostEqual(self.snapshot.balance(), 800.0)
+        self.assertEqual(self.snapshot.stats["full"], 2)
+
+    def test_changelog_is_trimmed(self):
+        with self.storage.db.connection() as conn:
+            conn.execute("UPDATE operations SET comment = 'x'")
+            count = conn.execute("SELECT COUNT(*) FROM operations_changelog").fetchone()[0]
+        self.assertEqual(count, 3)
+        self.assertGreaterEqual(migrations.CHANGELOG_KEEP, 1000)
+
+    def test_bucket_labels_match_sqlite(self):
+        with self.storage.db.connection() as conn:
+            for day in ("2023-01-01", "2023-01-02", "2024-12-30", "2021-01-03"):
+                expected = conn.execute("SELECT strftime('%Y-W%W', ?)", (day,)).fetchone()[0]
+                self.assertEqual(bucket_label(to_epoch(day) // 86400, "week"), expected)
+        self.assertEqual(bucket_label(to_epoch("2023-05-17") // 86400, "quarter"), "2023-Q2")
+
+    def test_time_series_for_category(self):
+        analysis = FinancialAnalysis(self.db_name)
+        df = analysis.get_time_series("month", category_id=1)
+        self.assertEqual(df["bucket"].tolist(), ["2023-01"])
+        self.assertEqual(df["expense"].tolist(), [300.0])
+        top = analysis.get_top_expenses_or_incomes(n=5)
+        self.assertEqual(top["amount"].tolist(), [300.0, 200.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Допустимое время импорта и создания приложения в новом процессе (секунды)
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "1.5"))
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+app = create_app({"DATABASE": sys.argv[1], "SHARDS_DIR": sys.argv[2]})
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("pandas", "numpy", "matplotlib", "matplotlib.pyplot") if name in sys.modules]
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, "tables.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_import_time_budget(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, self.db_name, os.path.join(self.tmp.name, "properties")],
+            cwd=root, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        self.assertEqual(result["heavy"], [])
+        self.assertFalse(os.path.exists(self.db_name))  # База открывается при первом запросе
+        self.assertLess(result["elapsed"], STARTUP_BUDGET_SECONDS)
+
+    def test_warm_up_does_not_import_pyplot(self):
+        from app.analysis import warm_up
+        from app.storage import Storage
+        storage = Storage(self.db_name)
+        try:
+            warm_up(self.db_name)
+        finally:
+            storage.db.close_all()
+        self.assertIn("matplotlib", sys.modules)
+        self.assertNotIn("matplotlib.pyplot", sys.modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import io
+import os
+import unittest
+from app.analysis import FinancialAnalysis
+from helpers import StorageTestCase
+
+
+class TestStorage(StorageTestCase):
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.storage.get_categories()
+        stats = self.storage.db.get_stats()
+        self.assertEqual(stats["opened"], 1)
+        self.assertGreaterEqual(stats["reused"], 5)
+
+    def test_wal_mode_enabled(self):
+        with self.storage.db.connection() as conn:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_analysis_shares_connections(self):
+        self.storage.add_operation({
+            "amount": 100.0, "category_id": 2, "date": "2023-01-01T10:00",
+            "operation_type": "доход", "comment": ""
+        })
+        self.storage.add_operation({
+            "amount": 40.0, "category_id": 1, "date": "2023-01-02T10:00",
+            "operation_type": "расход", "comment": ""
+        })
+        analysis = FinancialAnalysis(self.db_name)
+        self.assertIs(analysis.db, self.storage.db)
+        self.assertEqual(analysis.get_balance(), 60.0)
+
+    def test_failed_transaction_is_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.storage.db.connection() as conn:
+                conn.execute("INSERT INTO categories (name, type) VALUES ('X', 'доход')")
+                raise RuntimeError
+        names = [c[1] for c in self.storage.get_categories()]
+        self.assertNotIn("X", names)
+
+    def test_import_operations_reports_rejected_rows(self):
+        data = io.StringIO(
+            "amount,category_id,date,operation_type,comment\n"
+            "100,1,2023-01-01T10:00,расход,кровля\n"
+            "-5,1,2023-01-01T10:00,расход,\n"
+            "50,99,2023-01-01T10:00,расход,\n"
+            "70,2,2023-13-01T10:00,доход,\n"
+            "200,2,2023-01-03T12:30,доход,\n"
+        )
+        result = self.storage.import_operations(data, batch_size=1)
+        self.assertEqual(result.accepted, 2)
+        self.assertEqual(result.rejected, 3)
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5])
+        self.assertEqual(len(self.storage.get_operations()), 2)
+
+    def test_import_categories_skips_duplicates(self):
+        data = io.StringIO("name,type\nРемонт,расход\nКровля,расход\nКровля,расход\n")
+        result = self.storage.import_categories(data)
+        self.assertEqual(result.accepted, 1)
+        self.assertEqual(result.rejected, 2)
+        self.assertEqual(len(self.storage.get_categories()), 3)
+
+    def test_list_operations_keyset_pagination(self):
+        for day in range(1, 8):
+            self.storage.add_operation({
+                "amount": float(day * 10), "category_id": 1 + day % 2,
+                "date": f"2023-01-{day:02d}T10:00",
+                "operation_type": "расход" if day % 2 else "доход", "comment": ""
+            })
+        seen = []
+        rows, cursor = self.storage.list_operations(limit=3)
+        seen.extend(rows)
+        while cursor:
+            rows, cursor = self.storage.list_operations(cursor=cursor, limit=3)
+            seen.extend(rows)
+        self.assertEqual([row[3][:10] for row in seen], [f"2023-01-{d:02d}" for d in range(7, 0, -1)])
+        rows, cursor = self.storage.list_operations(
+            {"operation_type": "расход", "amount_min": 20, "date_to": "2023-01-05"}, limit=10
+        )
+        self.assertEqual([row[1] for row in rows], [50.0, 30.0])
+        self.assertIsNone(cursor)
+
+    def test_listing_uses_index(self):
+        with self.storage.db.connection() as conn:
+            plan = " ".join(row[3] for row in conn.execute("""
+                EXPLAIN QUERY PLAN
+                SELECT o.id FROM operations o JOIN categories c ON o.category_id = c.id
+                WHERE o.category_id = 1 AND (o.date, o.id) < (1672876800, 10)
+                ORDER BY o.date DESC, o.id DESC LIMIT 50
+            """))
+        self.assertIn("idx_operations_category_date", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_export_roundtrip_in_chunks(self):
+        data = io.StringIO(
+            "amount,category_id,date,operation_type,comment\n"
+            + "".join(f"{i},1,2023-01-{i:02d}T10:00,расход,крыша {i}\n" for i in range(1, 11))
+        )
+        self.storage.import_operations(data)
+        path = os.path.join(self.tmp.name, "export.csv")
+        self.storage.export_operations_to_csv(path, {"date_from": "2023-01-04"})
+        with open(path, encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0], "amount,category_id,date,operation_type,comment")
+        self.assertEqual(len(lines), 8)
+        chunks = list(self.storage.iter_operation_chunks(chunk_size=4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertEqual(chunks[0][0], (1.0, 1, "2023-01-01T10:00", "расход", "крыша 1"))
+
+
+if __name__ == "__main__":
+    unittest.main()